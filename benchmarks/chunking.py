@@ -0,0 +1,100 @@
+"""
+Compares the member cache cost of the startup, background and lazy chunk modes on a synthetic 200k member guild.
+
+Each mode runs in its own process so RSS is measured from a clean interpreter. Members arrive the way the gateway
+sends them, in GUILD_MEMBERS_CHUNK events of 1000 members, and every chunk is parsed on the event loop into Member
+objects.
+
+* startup: the bot is ready once every chunk is parsed
+* background: the bot is ready right away and the chunks are parsed by a task afterwards
+* lazy: the bot is ready right away and only the members that requests touch are built
+
+ready is the time until the bot would dispatch on_ready, chunked the time until the member cache is complete and
+stall the longest the event loop was blocked in between. Gateway transfer time is simulated with a fixed delay per
+chunk, 0 by default, so the times reported are the parse cost only unless a delay is given.
+
+    python -m benchmarks.chunking [members] [touched] [transfer ms per chunk]
+"""
+
+import asyncio
+import os
+import psutil
+import subprocess
+import sys
+import time
+import weakref
+
+
+MEMBERS = 200_000
+TOUCHED = 2_000 # members resolved by commands and lookups while a lazy guild is not chunked
+CHUNK_SIZE = 1000 # members per GUILD_MEMBERS_CHUNK event
+GUILD_ID = 772491741412589579
+
+
+def member_payload(i: int) -> dict:
+    return {
+        'user': {'id': str(10**17 + i), 'username': f'survivor{i}', 'discriminator': f'{i % 10000:04}', 'avatar': None},
+        'roles': [str(GUILD_ID + 1 + i % 7)],
+        'joined_at': '2021-08-01T00:00:00.000000+00:00',
+        'deaf': False,
+        'mute': False,
+    }
+
+
+async def run_mode(mode: str, members: int, touched: int, transfer: float) -> None:
+    import discord
+    from discord.state import ConnectionState
+
+    # only the parts of the connection state that Member and User touch
+    state = ConnectionState.__new__(ConnectionState)
+    state._users = weakref.WeakValueDictionary()
+    state.member_cache_flags = discord.MemberCacheFlags.all()
+    guild = discord.Object(GUILD_ID)
+
+    count = touched if mode == 'lazy' else members
+    payloads = [member_payload(i) for i in range(count)]
+    process = psutil.Process(os.getpid())
+    rss = process.memory_info().rss
+    cache = {}
+    stall = 0.0
+
+    async def chunk_guild() -> None:
+        nonlocal stall
+        for offset in range(0, len(payloads), CHUNK_SIZE):
+            await asyncio.sleep(transfer)
+            start = time.perf_counter()
+            for data in payloads[offset:offset+CHUNK_SIZE]:
+                member = discord.Member(data=data, guild=guild, state=state) # type: ignore
+                cache[member.id] = member
+            stall = max(stall, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if mode == 'startup':
+        await chunk_guild()
+        ready = time.perf_counter() - start
+    else:
+        ready = time.perf_counter() - start
+        await chunk_guild() # background: the task started after on_ready, lazy: the members requests resolve
+    chunked = time.perf_counter() - start
+
+    print(f'{len(cache)} {ready:.3f} {chunked:.3f} {stall * 1000:.1f} {(process.memory_info().rss - rss) / 1024**2:.1f}')
+
+
+def main() -> None:
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else MEMBERS
+    touched = int(sys.argv[2]) if len(sys.argv) > 2 else TOUCHED
+    transfer = sys.argv[3] if len(sys.argv) > 3 else '0'
+
+    print(f'{"mode":>10} {"members":>8} {"ready":>8} {"chunked":>8} {"stall":>8} {"rss":>9}')
+    for mode in ('startup', 'background', 'lazy'):
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.chunking', '--child', mode, str(members), str(touched), transfer], text=True)
+        built, ready, chunked, stall, rss = output.split()
+        print(f'{mode:>10} {built:>8} {ready:>7}s {chunked:>7}s {stall:>6}ms {rss:>7}MB')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        mode, members, touched, transfer = sys.argv[2:6]
+        asyncio.run(run_mode(mode, int(members), int(touched), float(transfer) / 1000))
+    else:
+        main()
@@ -0,0 +1,56 @@
+"""
+Compares the per message cost of the old command_prefix lambda with PrefixResolver.
+
+The corpus is a text file with one message content per line, e.g. exported from a busy channel. Without one a
+synthetic corpus with 2% commands is used.
+
+    python -m benchmarks.prefix [corpus.txt]
+"""
+
+import random
+import string
+import sys
+import timeit
+
+from utils.prefix import PrefixResolver
+
+
+BOT_ID = 784386591225135125
+PREFIXES = (f'<@!{BOT_ID}> ', f'<@{BOT_ID}> ', 'b!', 'bb ')
+
+
+def synthetic_corpus(size: int = 100_000):
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 8))) for _ in range(500)]
+    corpus = []
+    for _ in range(size):
+        message = ' '.join(random.choices(words, k=random.randint(1, 12)))
+        if random.random() < 0.02:
+            message = random.choice(('b!', 'B!', 'bb ', 'BB ', f'<@{BOT_ID}> ')) + message
+        corpus.append(message)
+    return corpus
+
+
+def old(content: str) -> bool:
+    # the lambda built the list on every message and discord.py tried each prefix
+    prefixes = [f'<@!{BOT_ID}> ', f'<@{BOT_ID}> ', 'b!', 'B!', 'bb ', 'Bb ', 'BB ']
+    return content.startswith(tuple(prefixes))
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as file:
+            corpus = file.read().splitlines()
+    else:
+        corpus = synthetic_corpus()
+
+    resolver = PrefixResolver(PREFIXES)
+    new = lambda content: resolver.resolve(content) is not None
+
+    print(f'{len(corpus)} messages, {sum(map(new, corpus))} commands')
+    for name, func in (('lambda', old), ('resolver', new)):
+        elapsed = min(timeit.repeat(lambda: [func(content) for content in corpus], number=1, repeat=5))
+        print(f'{name:>8} {elapsed * 1e9 / len(corpus):>7.0f} ns/message')
+
+
+if __name__ == '__main__':
+    main()
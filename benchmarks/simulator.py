@@ -0,0 +1,442 @@
+"""
+An offline stand-in for the Discord gateway and REST API.
+
+:class:`World` builds the payloads of a synthetic guild, its members, channels and messages. :class:`Simulator`
+feeds gateway events to the bot's own ConnectionState parsers, so discord.py builds the Message, Member, Reaction
+and Interaction objects and dispatches the listeners, commands and views exactly as it does for a live gateway.
+:class:`FakeHTTP` answers the REST requests and interaction responses from the world after a simulated round trip,
+so nothing leaves the machine.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import discord
+import itertools
+import json
+import random
+import re
+
+from discord.webhook.async_ import AsyncWebhookAdapter, async_context
+from typing import Any, Counter, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+GUILD_ID = 772491741412589579
+BOT_ID = 10**17 - 1
+MEMBER_BASE = 10**17 # synthetic ids, far below any real snowflake of the guild
+CHANNEL_BASE = 10**16
+ADMIN_ROLE = GUILD_ID + 1
+MAX_MESSAGES = 10_000 # messages the fake API remembers for fetches, edits and clicks
+
+PERMISSIONS = discord.Permissions(
+    read_messages=True,
+    send_messages=True,
+    read_message_history=True,
+    add_reactions=True,
+    embed_links=True,
+    attach_files=True,
+    use_external_emojis=True,
+)
+
+
+class World:
+    """
+    The payloads of a synthetic guild with members members and channels text channels. The bot user has an
+    administrator role, everyone else only @everyone and the roles they are added with.
+    """
+
+    def __init__(self, *, members: int = 1000, channels: int = 10, seed: int = 0, bot_id: int = BOT_ID) -> None:
+        self.random = random.Random(seed)
+        self._ids = itertools.count()
+        self.bot_id = bot_id
+        self.bot_user = self.user_payload(bot_id, 'Bunker Bot', bot=True)
+        self.users: Dict[int, dict] = {bot_id: self.bot_user}
+        self.members: Dict[int, dict] = {bot_id: self.member_payload(self.bot_user, roles=[ADMIN_ROLE])}
+        self.member_ids: List[int] = []
+        self.channels: List[dict] = []
+        self.roles: Dict[int, dict] = {}
+        self.messages: collections.OrderedDict[int, dict] = collections.OrderedDict()
+
+        self.add_role(GUILD_ID, '@everyone', PERMISSIONS)
+        self.add_role(ADMIN_ROLE, 'Bots', discord.Permissions.all())
+        for i in range(members):
+            self.add_member(MEMBER_BASE + i, f'survivor{i}')
+        for i in range(channels):
+            self.add_channel(CHANNEL_BASE + i)
+
+    def add_member(self, user_id: int, name: Optional[str] = None, *, roles: Iterable[int] = (), bot: bool = False) -> None:
+        user = self.users[user_id] = self.user_payload(user_id, name or f'user{user_id}', bot=bot)
+        if user_id not in self.members:
+            self.member_ids.append(user_id)
+        self.members[user_id] = self.member_payload(user, roles=list(roles))
+
+    def add_channel(self, channel_id: int, name: Optional[str] = None) -> None:
+        self.channels.append(self.channel_payload(channel_id, name or f'channel-{len(self.channels)}', len(self.channels)))
+
+    def add_role(self, role_id: int, name: Optional[str] = None, permissions: discord.Permissions = discord.Permissions.none()) -> None:
+        self.roles[role_id] = {
+            'id': str(role_id),
+            'name': name or f'role-{len(self.roles)}',
+            'permissions': str(permissions.value),
+            'position': len(self.roles),
+            'color': 0,
+            'hoist': False,
+            'managed': False,
+            'mentionable': False,
+        }
+
+    def snowflake(self) -> int:
+        return discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._ids) % 2**22
+
+    @staticmethod
+    def timestamp() -> str:
+        return discord.utils.utcnow().isoformat()
+
+    @staticmethod
+    def user_payload(user_id: int, name: str, *, bot: bool = False) -> dict:
+        return {'id': str(user_id), 'username': name, 'discriminator': f'{user_id % 10000:04}', 'avatar': None, 'bot': bot}
+
+    def member_payload(self, user: dict, *, roles: Optional[List[int]] = None) -> dict:
+        return {
+            'user': user,
+            'roles': [str(role) for role in roles or ()],
+            'nick': None,
+            'joined_at': '2021-08-01T00:00:00.000000+00:00',
+            'deaf': False,
+            'mute': False,
+            'pending': False,
+        }
+
+    @staticmethod
+    def channel_payload(channel_id: int, name: str, position: int) -> dict:
+        return {
+            'id': str(channel_id),
+            'type': 0,
+            'guild_id': str(GUILD_ID),
+            'name': name,
+            'position': position,
+            'permission_overwrites': [],
+            'nsfw': False,
+            'parent_id': None,
+            'topic': None,
+            'rate_limit_per_user': 0,
+            'last_message_id': None,
+        }
+
+    def guild_payload(self) -> dict:
+        return {
+            'id': str(GUILD_ID),
+            'name': 'Simulated Bunker',
+            'icon': None,
+            'owner_id': str(MEMBER_BASE),
+            'unavailable': False,
+            'large': True,
+            'member_count': len(self.members),
+            'members': list(self.members.values()),
+            'channels': self.channels,
+            'roles': list(self.roles.values()),
+            'emojis': [],
+            'stickers': [],
+            'features': [],
+            'threads': [],
+            'presences': [],
+            'voice_states': [],
+            'stage_instances': [],
+            'afk_timeout': 300,
+            'verification_level': 0,
+            'default_message_notifications': 0,
+            'explicit_content_filter': 0,
+            'mfa_level': 0,
+            'nsfw_level': 0,
+            'premium_tier': 0,
+            'system_channel_flags': 0,
+            'preferred_locale': 'en-US',
+        }
+
+    def ready_payload(self) -> dict:
+        return {
+            'v': 9,
+            'user': self.bot_user,
+            'guilds': [{'id': str(GUILD_ID), 'unavailable': True}],
+            'session_id': 'simulated',
+            'application': {'id': str(self.bot_id), 'flags': 0},
+        }
+
+    def message_payload(self, channel_id: int, author_id: int, content: str, **fields: Any) -> dict:
+        member = self.members.get(author_id)
+        data = {
+            'id': str(self.snowflake()),
+            'channel_id': str(channel_id),
+            'guild_id': str(GUILD_ID),
+            'author': self.users[author_id],
+            'content': content,
+            'timestamp': self.timestamp(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'components': [],
+            'pinned': False,
+            'type': 0,
+        }
+        if member is not None:
+            data['member'] = {k: v for k, v in member.items() if k != 'user'}
+        data.update(fields)
+        self.remember(data)
+        return data
+
+    def remember(self, data: dict) -> None:
+        self.messages[int(data['id'])] = data
+        if len(self.messages) > MAX_MESSAGES:
+            self.messages.popitem(last=False)
+
+    def random_member(self) -> int:
+        return self.random.choice(self.member_ids)
+
+    def random_channel(self) -> int:
+        return int(self.random.choice(self.channels)['id'])
+
+
+def _template(path: str) -> re.Pattern:
+    return re.compile(re.escape(discord.http.Route.BASE + path).replace(r'\{', '{').replace(r'\}', '}').format_map(_Groups()) + r'(?:\?.*)?$')
+
+
+class _Groups(dict):
+    def __missing__(self, key: str) -> str:
+        return f'(?P<{key}>[^/?]+)'
+
+
+class FakeResponse:
+    def __init__(self, status: int, reason: str) -> None:
+        self.status = status
+        self.reason = reason
+
+
+class FakeHTTP:
+    """
+    Answers the REST requests of HTTPClient.request and of the interaction webhooks from the world, after sleeping
+    latency seconds like a round trip to Discord would
+
+    Attributes
+    ------------
+    requests: Counter[str]
+        Requests made per method and path template
+    views: Deque[Tuple[int, int, List[str]]]
+        (channel id, message id, custom ids) of the messages sent with components, newest last
+    """
+
+    def __init__(self, world: World, *, latency: float = 0.05) -> None:
+        self.world = world
+        self.latency = latency
+        self.requests: Counter[str] = collections.Counter()
+        self.views: Deque[Tuple[int, int, List[str]]] = collections.deque(maxlen=100)
+        self._patterns: Dict[str, re.Pattern] = {}
+
+    def _params(self, route: Any) -> Dict[str, str]:
+        pattern = self._patterns.get(route.path)
+        if pattern is None:
+            pattern = self._patterns[route.path] = _template(route.path)
+        match = pattern.match(route.url)
+        return match.groupdict() if match else {}
+
+    @staticmethod
+    def _payload(kwargs: Dict[str, Any]) -> dict:
+        if 'json' in kwargs:
+            return kwargs['json'] or {}
+        for entry in kwargs.get('form') or (): # messages with files
+            if entry['name'] == 'payload_json':
+                return json.loads(entry['value'])
+        return {}
+
+    def _not_found(self, what: str) -> discord.NotFound:
+        return discord.NotFound(FakeResponse(404, 'Not Found'), {'code': 10000, 'message': f'Unknown {what}'}) # type: ignore
+
+    def _send(self, channel_id: int, payload: dict) -> dict:
+        world = self.world
+        data = world.message_payload(
+            channel_id,
+            world.bot_id,
+            payload.get('content') or '',
+            embeds=payload.get('embeds') or ([payload['embed']] if payload.get('embed') else []),
+            components=payload.get('components') or [],
+        )
+        self._track_view(channel_id, data)
+        return data
+
+    def _track_view(self, channel_id: int, data: dict) -> None:
+        custom_ids = [c['custom_id'] for row in data['components'] for c in row.get('components', ()) if 'custom_id' in c]
+        if custom_ids:
+            self.views.append((channel_id, int(data['id']), custom_ids))
+
+    async def respond(self, method: str, path: str, params: Dict[str, str], payload: dict) -> Any:
+        self.requests[f'{method} {path}'] += 1
+        await asyncio.sleep(self.latency)
+        world = self.world
+
+        if path == '/channels/{channel_id}/messages':
+            return self._send(int(params['channel_id']), payload) if method == 'POST' else []
+
+        if path == '/channels/{channel_id}/messages/{message_id}':
+            data = world.messages.get(int(params['message_id']))
+            if data is None:
+                raise self._not_found('Message')
+            if method == 'PATCH':
+                data = {**data, **{k: v for k, v in payload.items() if k in ('content', 'embeds', 'components')}, 'edited_timestamp': world.timestamp()}
+                world.remember(data)
+                self._track_view(int(params['channel_id']), data)
+            return data if method != 'DELETE' else None
+
+        if path == '/guilds/{guild_id}/members/{user_id}' and method == 'GET':
+            member = world.members.get(int(params['user_id']))
+            if member is None:
+                raise self._not_found('Member')
+            return member
+
+        if path == '/users/{user_id}' and method == 'GET':
+            user = world.users.get(int(params['user_id']))
+            if user is None:
+                raise self._not_found('User')
+            return user
+
+        if path.startswith('/webhooks/{webhook_id}/{webhook_token}') and method in ('POST', 'PATCH'): # interaction followups and edits
+            return self._send(int(params['webhook_token'].rsplit('-', 1)[1]), payload) # the simulated tokens end with the channel id
+
+        return None # reactions, role edits, deletes and interaction responses return nothing worth simulating
+
+    async def request(self, route: Any, **kwargs: Any) -> Any:
+        return await self.respond(route.method, route.path, self._params(route), self._payload(kwargs))
+
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    """
+    Interaction responses and followups are made through the webhook adapter and not HTTPClient.request
+    """
+
+    def __init__(self, http: FakeHTTP) -> None:
+        super().__init__()
+        self.http = http
+
+    async def request(self, route: Any, session: Any, *, payload: Optional[dict] = None, multipart: Optional[List[Dict[str, Any]]] = None, **kwargs: Any) -> Any:
+        if payload is None and multipart:
+            payload = FakeHTTP._payload({'form': multipart})
+        return await self.http.respond(route.method, route.path, self.http._params(route), payload or {})
+
+
+class Simulator:
+    """
+    Connects a bot to the world without a gateway and feeds it events
+
+    Parameters
+    -----------
+    bot: discord.Client
+        The bot, not logged in
+    world: World
+        The guild the bot is connected to
+    latency: float
+        Seconds every REST request takes
+    """
+
+    def __init__(self, bot: discord.Client, world: World, *, latency: float = 0.05) -> None:
+        self.bot = bot
+        self.world = world
+        self.http = FakeHTTP(world, latency=latency)
+        self.events: Counter[str] = collections.Counter()
+        self._baseline: set = set()
+
+        bot.http.request = self.http.request # type: ignore
+        async_context.set(FakeWebhookAdapter(self.http)) # the tasks of every dispatched event inherit the adapter
+
+    @property
+    def state(self) -> Any:
+        return self.bot._connection # type: ignore
+
+    def dispatch(self, event: str, data: dict) -> None:
+        """
+        Parses a gateway event the way the websocket does when it receives one
+        """
+        self.events[event] += 1
+        self.state.parsers[event](data)
+
+    async def connect(self) -> None:
+        """
+        Sends READY and the guild, and waits until the bot is ready
+        """
+        self.state.guild_ready_timeout = 0.1 # nothing else is streamed after the only guild
+        self.dispatch('READY', self.world.ready_payload())
+        self.dispatch('GUILD_CREATE', self.world.guild_payload())
+        await self.bot.wait_until_ready()
+        self._baseline = asyncio.all_tasks()
+
+    def message(self, content: str, *, author_id: Optional[int] = None, channel_id: Optional[int] = None) -> dict:
+        world = self.world
+        data = world.message_payload(channel_id or world.random_channel(), author_id or world.random_member(), content)
+        self.dispatch('MESSAGE_CREATE', data)
+        return data
+
+    def reaction(self, emoji: str = '\N{THUMBS UP SIGN}', *, message_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[dict]:
+        """
+        Adds a reaction to the given message, or to one of the latest messages. Only reactions on messages the bot
+        still has cached reach on_reaction_add.
+        """
+        world = self.world
+        if message_id is None:
+            if not world.messages:
+                return None
+            message_id = world.random.choice(list(itertools.islice(reversed(world.messages), 50)))
+
+        message = world.messages[message_id]
+        user_id = user_id or world.random_member()
+        data = {
+            'user_id': str(user_id),
+            'channel_id': message['channel_id'],
+            'message_id': message['id'],
+            'guild_id': str(GUILD_ID),
+            'member': world.members[user_id],
+            'emoji': {'id': None, 'name': emoji},
+        }
+        self.dispatch('MESSAGE_REACTION_ADD', data)
+        return data
+
+    def click(self, *, user_id: Optional[int] = None) -> Optional[dict]:
+        """
+        Clicks a component of one of the latest messages the bot sent with a view
+        """
+        world = self.world
+        if not self.http.views:
+            return None
+
+        channel_id, message_id, custom_ids = world.random.choice(self.http.views)
+        message = world.messages.get(message_id)
+        if message is None:
+            return None
+
+        user_id = user_id or world.random_member()
+        data = {
+            'id': str(world.snowflake()),
+            'application_id': str(world.bot_id),
+            'type': 3,
+            'token': f'simulated-{channel_id}',
+            'version': 1,
+            'guild_id': str(GUILD_ID),
+            'channel_id': str(channel_id),
+            'member': {**world.members[user_id], 'permissions': str(PERMISSIONS.value)},
+            'message': message,
+            'data': {'custom_id': world.random.choice(custom_ids), 'component_type': 2},
+        }
+        self.dispatch('INTERACTION_CREATE', data)
+        return data
+
+    async def settle(self, timeout: float = 30.0) -> int:
+        """
+        Waits for the tasks started by the events fed so far and returns the amount still running after timeout,
+        e.g. loops and timers started by commands
+        """
+        pending = asyncio.all_tasks() - self._baseline - {asyncio.current_task()}
+        if not pending:
+            return 0
+        _, pending = await asyncio.wait(pending, timeout=timeout)
+        return len(pending)
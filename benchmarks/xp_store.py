@@ -0,0 +1,56 @@
+"""
+Compares memory and throughput of XPStore against the Dict[int, float] it replaced.
+
+    python -m benchmarks.xp_store
+"""
+
+import random
+import time
+import tracemalloc
+
+from utils.xp import XPStore
+
+
+USERS = 50_000
+MESSAGES = 500_000
+BASE_ID = 300_000_000_000_000_000
+
+
+def fill_dict(ids):
+    data = {}
+    for user_id in ids:
+        try:
+            data[user_id] += 0.01
+        except KeyError:
+            data[user_id] = 0.01
+    return data
+
+
+def fill_store(ids):
+    data = XPStore()
+    for user_id in ids:
+        data.add(user_id, 0.01)
+    return data
+
+
+def main() -> None:
+    users = [BASE_ID + random.getrandbits(50) for _ in range(USERS)]
+    ids = users + random.choices(users, k=MESSAGES - USERS)
+
+    print(f'{USERS} users, {MESSAGES} increments')
+    print(f'{"":>6} {"memory":>10} {"per user":>9} {"increments/s":>13}')
+    for name, fill in (('dict', fill_dict), ('store', fill_store)):
+        tracemalloc.start()
+        data = fill(ids)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        fill(ids)
+        elapsed = time.perf_counter() - start
+
+        print(f'{name:>6} {memory/1024**2:>8.2f}MB {memory/len(data):>8.1f}B {MESSAGES/elapsed:>13,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,146 @@
+import asyncio
 import asyncpg
 import discord
 import logging
+import re
+import time
 
 from context import BBContext
 from discord.ext import commands
-from typing import Callable, Dict, List, Optional, Set, Union
+from discord.ext.commands.view import StringView
+from typing import Any, Awaitable, Callable, Collection, Dict, Iterable, List, Literal, NamedTuple, Optional, Sequence, Set, Tuple, Union
+from utils.cachesync import CacheSync
+from utils.connections import ConnectionTracker
+from utils.lookup import LookupStats, NegativeCache, SingleFlight
+from utils.looplag import LoopMonitor
+from utils.metrics import MetricsRegistry, MetricsServer
+from utils.outbound import Outbound
+from utils.prefix import PrefixResolver
+from utils.queries import catalog
+from utils.replica import ReplicaMonitor
+from utils.recorder import GatewayRecorder
+from utils.rest import REST_ORIGIN, RestAccounting, tagged
+from utils.shutdown import DrainHook, ShutdownCoordinator
+from utils.snapshot import SnapshotError, fingerprint, read_snapshot, write_snapshot
+from utils.timing import DB_TIMER, DBTimer, HandlerTimings
+from utils.xp import XPCache, create_flush_table, create_staging_table, flush_copy, flush_executemany, forget_flush, record_flush
 
 
-async def release_connection(ctx: BBContext) -> None:
-    await ctx.release_connection()
+PREFIXES = ('b!', 'bb ')
+SNAPSHOT_PATH = 'cache.snapshot'
+SNAPSHOT_INTERVAL = 60*10
+
+# startup: every guild is chunked before the bot is ready
+# background: guilds are chunked one by one after the bot is ready
+# lazy: a guild is only chunked once a command needs all of its members
+ChunkMode = Literal['startup', 'background', 'lazy']
+
+
+async def before_invoke(ctx: BBContext) -> None:
+    ctx.db_timer = DBTimer()
+    DB_TIMER.set(ctx.db_timer) # the command callback runs in this task, so it sees the timer
+    if ctx.command is not None:
+        REST_ORIGIN.set(f'{ctx.command.cog_name or "bot"}:{ctx.command.qualified_name}')
+    ctx.invoked_at = time.perf_counter()
+
+
+async def after_invoke(ctx: BBContext) -> None:
+    try:
+        if ctx.invoked_at is not None and ctx.command is not None:
+            db_time = ctx.db_timer.elapsed if ctx.db_timer else 0.0
+            ctx.bot.handler_timings.record('command', ctx.command.qualified_name, time.perf_counter() - ctx.invoked_at, db_time, ctx.command_failed)
+    finally:
+        await ctx.release_connection()
+
+
+class Preload(NamedTuple):
+    """
+    A query run during the warm-up phase whose rows are passed to callback to fill a cache. dump returns the
+    cache as rows for the snapshot, without it the rows last passed to callback are saved.
+    """
+    name: str
+    query: str
+    callback: Callable[[Sequence[Sequence[Any]]], None]
+    dump: Optional[Callable[[], Sequence[Sequence[Any]]]] = None
+
+
+class MessageStage:
+    """
+    A consumer of gateway messages in the bot's message pipeline. Stages run one after the other in order of
+    priority and a stage is skipped if the message does not pass its filters. Background stages are started as a
+    task instead, so slow work such as replies does not hold up the stages after them.
+
+    Parameters
+    -----------
+    name: str
+        Unique name of the stage
+    callback: Callable[[discord.Message], Awaitable[None]]
+        The coroutine called with every message that passes the filters
+    priority: int
+        Stages with a lower priority run first
+    bots: bool
+        If messages from bots are passed to the stage
+    skip_blacklisted: bool
+        If messages from blacklisted users are not passed to the stage
+    channels: Optional[Collection[int]]
+        If provided only messages from these channels are passed to the stage
+    exclude_channels: Optional[Collection[int]]
+        Messages from these channels are not passed to the stage
+    predicate: Optional[Callable[[discord.Message], bool]]
+        A cheap check on the message, the stage is skipped if it returns False
+    background: bool
+        If the callback is started as a task and the pipeline moves on without waiting for it
+    """
+
+    __slots__ = ('name', 'callback', 'priority', 'bots', 'skip_blacklisted', 'channels', 'exclude_channels', 'predicate', 'background')
+
+    def __init__(
+        self,
+        name: str,
+        callback: Callable[[discord.Message], Awaitable[None]],
+        *,
+        priority: int = 0,
+        bots: bool = False,
+        skip_blacklisted: bool = False,
+        channels: Optional[Collection[int]] = None,
+        exclude_channels: Optional[Collection[int]] = None,
+        predicate: Optional[Callable[[discord.Message], bool]] = None,
+        background: bool = False,
+        ) -> None:
+
+        self.name = name
+        self.callback = callback
+        self.priority = priority
+        self.bots = bots
+        self.skip_blacklisted = skip_blacklisted
+        self.channels = frozenset(channels) if channels is not None else None
+        self.exclude_channels = frozenset(exclude_channels or ())
+        self.predicate = predicate
+        self.background = background
+
+    def __repr__(self) -> str:
+        return f'MessageStage<name={self.name} priority={self.priority}>'
+
+    def accepts(self, message: discord.Message, *, is_bot: bool, is_blacklisted: bool, channel_id: int) -> bool:
+        if is_bot and not self.bots:
+            return False
+        if is_blacklisted and self.skip_blacklisted:
+            return False
+        if self.channels is not None and channel_id not in self.channels:
+            return False
+        if channel_id in self.exclude_channels:
+            return False
+        return self.predicate is None or bool(self.predicate(message))
 
 
 class BunkerBot(commands.Bot):
     pool: asyncpg.Pool
+    read_pool: Optional[asyncpg.Pool] = None # a streaming replica of the database pool is connected to, see pool_for
+    connect_kwargs: Dict[str, str]
     logger: logging.Logger
+    xp_flush_mode: Literal['copy', 'executemany'] = 'copy'
     
-    def __init__(self):
+    def __init__(self, *, chunk_mode: ChunkMode = 'startup', metrics_port: Optional[int] = None, recording_dir: Optional[str] = None):
 
         allowed_mentions = discord.AllowedMentions(everyone=True, users=True, roles=True, replied_user=True)
         intents = discord.Intents(
@@ -28,90 +153,617 @@ class BunkerBot(commands.Bot):
         )
         member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
         owner_id = 378957690073907201
-        command_prefix: Callable[[BunkerBot, discord.Message], List[str]] = lambda bot, message: [f'<@!{bot.user.id}> ', f'<@{bot.user.id}> ', 'b!', 'B!', 'bb ', 'Bb ', 'BB '] # type: ignore
+        command_prefix: Callable[[BunkerBot, discord.Message], Union[str, List[str]]] = lambda bot, message: bot.prefixes.resolve(message.content) or list(bot.prefixes.prefixes)
 
         super().__init__(
             allowed_mentions = allowed_mentions,
             case_insensitive=True,
-            chunk_guilds_at_startup = True,
+            chunk_guilds_at_startup = chunk_mode == 'startup',
             command_prefix = command_prefix,
+            enable_debug_events = recording_dir is not None, # the recorder reads on_socket_raw_receive
             intents=intents,
             member_cache_flags = member_cache_flags,
             owner_id=owner_id
         )
 
-        self._after_invoke = release_connection
+        self._before_invoke = before_invoke
+        self._after_invoke = after_invoke
+        self.chunk_mode = chunk_mode
+        self.prefixes = PrefixResolver(PREFIXES) # rebuilt with the mention prefixes once the bot user is known
         self.beta_testers: Set[int] = set()
         self.blacklist: Set[int] = set()
         self.tags: Set[str] = set()
         self.times_code_is_asked: int = 0
         self.on_time = discord.utils.utcnow()
-        self.xp_cache: Dict[int, float] = {}
+        self.xp_cache = XPCache()
+        self._xp_prepared = False # the xp tables exist and the journal is recovered
+        self._xp_preparing = asyncio.Lock()
+        self.lookup_stats = LookupStats()
+        self._lookups = SingleFlight()
+        self._missing = NegativeCache(ttl=60*60) # (guild_id, user_id) for members who left, (None, user_id) for deleted users
+        self.message_stages: List[MessageStage] = []
+        self._stage_tasks: Set[asyncio.Task] = set()
+        self.preloads: Dict[str, Preload] = {}
+        self._preload_rows: Dict[str, Sequence[Sequence[Any]]] = {}
+        self.warmed_up = asyncio.Event()
+        self.warm_up_task: Optional[asyncio.Task] = None
+        self.snapshot_path = SNAPSHOT_PATH
+        self.snapshot_task: Optional[asyncio.Task] = None
+        self.caches: Dict[str, Callable[[], int]] = {}
+        self.shutdown = ShutdownCoordinator(logging.getLogger('bunkerbot')) # the logger main.py configures, bot.logger is set after init
+        self.outbound = Outbound(self.loop)
+        self.metrics = MetricsRegistry()
+        self.metrics_server = MetricsServer(self.metrics, port=metrics_port) if metrics_port else None
+        self.loop_monitor = LoopMonitor(self.loop, logging.getLogger('bunkerbot'))
+        self.connections = ConnectionTracker(self.loop, logging.getLogger('bunkerbot'))
+        self.replica = ReplicaMonitor(self.loop, logging.getLogger('bunkerbot'))
+        self.recorder = GatewayRecorder(recording_dir) if recording_dir else None
+        if self.recorder:
+            self.recorder.keep(re.compile('^(?:' + '|'.join(map(re.escape, PREFIXES)) + ')', re.IGNORECASE)) # commands are replayed as sent
 
-    async def start(self, token: str, *, reconnect: bool = True) -> None:
-        async with self.pool.acquire() as con:
-            blacklist = await con.fetchval('SELECT array_agg(user_id) FROM extras.blacklist')
-            if blacklist:
-                self.blacklist = set(blacklist)
+        for name, query in (
+            ('blacklist', 'SELECT user_id FROM extras.blacklist'),
+            ('tags', 'SELECT name FROM tags.names'),
+            ('beta_testers', 'SELECT user_id FROM extras.beta_testers'),
+        ):
+            self.add_preload(
+                name, 
+                query, 
+                lambda rows, name=name: setattr(self, name, {row[0] for row in rows}),
+                dump=lambda name=name: [(value,) for value in getattr(self, name)]
+            )
+
+        self.cache_sync = CacheSync(self)
+        self.cache_sync.register('blacklist', 'extras.blacklist', 'user_id', int)
+        self.cache_sync.register('tags', 'tags.names', 'name')
+        self.cache_sync.register('beta_testers', 'extras.beta_testers', 'user_id', int)
 
-            tags = await con.fetchval('SELECT array_agg(name) FROM tags.names')
-            if tags:
-                self.tags = set(tags)
+        self.add_message_stage(MessageStage('commands', self.process_commands, priority=100, skip_blacklisted=True))
 
-            testers = await con.fetchval('SELECT array_agg(user_id) FROM extras.beta_testers')
-            if testers:
-                self.beta_testers = set(testers)
+        self.add_cache('blacklist', lambda: len(self.blacklist))
+        self.add_cache('tags', lambda: len(self.tags))
+        self.add_cache('beta_testers', lambda: len(self.beta_testers))
+        self.add_cache('missing_lookups', lambda: len(self._missing))
+        self.add_cache('users', lambda: len(self._connection._users))
+        self.add_cache('members', lambda: sum(len(guild._members) for guild in self.guilds))
+        self.add_cache('messages', lambda: len(self.cached_messages))
 
+        metrics = self.metrics
+        self.message_count = metrics.counter('messages_total', 'Messages received')
+        self.command_count = metrics.counter('commands_total', 'Commands invoked', labels=('command',))
+        self.stage_latency = metrics.histogram('message_stage_seconds', 'Time spent in each message pipeline stage', labels=('stage',))
+        self.connections.register_metrics(metrics)
+        self.pool_wait = self.connections.wait
+        self.replica.register_metrics(metrics)
+        self.reads = metrics.counter('db_reads_total', 'Read-only connections handed out by the pool they came from', labels=('pool',))
+        self.query_batches = metrics.counter('query_batches_total', 'Query batches of commands by how they ran', labels=('mode',))
+        self.handler_timings = HandlerTimings(metrics)
+        catalog.register_metrics(metrics)
+        self.rest = RestAccounting()
+        self.rest.register_metrics(metrics)
+        self.rest.attach(self.http)
+        self._listener_wrappers: Dict[Tuple[str, Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]] = {}
+        metrics.gauge('uptime_seconds', 'Seconds since the bot started', collect=lambda: (discord.utils.utcnow() - self.on_time).total_seconds())
+        metrics.gauge('websocket_latency_seconds', 'Gateway heartbeat latency', collect=lambda: self.latency)
+        metrics.counter('code_asked_total', 'Bunker code auto responses triggered', collect=lambda: self.times_code_is_asked)
+        metrics.gauge('cache_entries', 'Entries in the in-memory caches', labels=('cache',), collect=self._cache_entries)
+        metrics.counter('lookups_total', 'Member and user lookups by outcome', labels=('result',), collect=lambda: {(k,): v for k, v in self.lookup_stats.items()})
+        metrics.gauge('xp_backlog_users', 'Users with xp waiting to be flushed', collect=lambda: len(self.xp_cache))
+        self.loop_monitor.register_metrics(metrics)
+        metrics.gauge('outbound_queued', 'Pending outbound sends by priority', labels=('priority',), collect=lambda: {(p.name.lower(),): n for p, n in self.outbound.depths().items()})
+        metrics.counter('outbound_total', 'Outbound sends by outcome', labels=('outcome',), collect=lambda: {(k,): v for k, v in self.outbound.stats.items()})
+
+        # writes drain in parallel first, then the listener and finally the pool once nothing uses it anymore
+        self.add_drain_hook('message_stages', self._drain_stages, priority=-10) # background stages may still queue outbound sends
+        self.add_drain_hook('tasks', self._cancel_tasks, priority=-10) # the snapshot is saved once more by its own hook
+        self.add_drain_hook('xp', self._drain_xp, budget=10, persist=self._persist_xp)
+        self.add_drain_hook('snapshot', self.save_snapshot)
+        self.add_drain_hook('outbound', self.outbound.join)
+        self.add_drain_hook('cache_sync', self.cache_sync.close, priority=10)
+        self.add_drain_hook('loop_monitor', self.loop_monitor.stop, priority=10)
+        self.add_drain_hook('connections', self.connections.stop, priority=10)
+        self.add_drain_hook('replica', self.replica.stop, priority=10)
+        if self.recorder:
+            metrics.counter('gateway_recorded_events_total', 'Gateway events written to the recording', labels=('event',), collect=lambda: {(k,): v for k, v in self.recorder.recorded.items()}) # type: ignore
+            self.add_drain_hook('recorder', self.recorder.close, priority=10)
+        if self.metrics_server:
+            self.add_drain_hook('metrics', self.metrics_server.close, priority=10)
+        self.add_drain_hook('pool', self._close_pool, priority=100, budget=15)
+
+    async def start(self, token: str, *, reconnect: bool = True) -> None:
+        self.loop_monitor.start()
+        self.connections.start()
+        if self.read_pool:
+            self.replica.start(self.read_pool)
+        self.warm_up_task = self.loop.create_task(self.warm_up(), name='warm_up') # runs while logging in and connecting to the gateway
+        self.warm_up_task.add_done_callback(self._log_task_failure)
+        if self.metrics_server:
+            await self.metrics_server.start()
+            self.logger.info('Serving metrics on %s:%d/metrics', self.metrics_server.host, self.metrics_server.port)
         return await super().start(token, reconnect=reconnect)
 
+    async def login(self, token: str) -> None:
+        await super().login(token)
+        self.rest.trace(self.http) # the http session is made while logging in
+
+    def add_preload(
+        self, 
+        name: str, 
+        query: str, 
+        callback: Callable[[Sequence[Sequence[Any]]], None], 
+        *, 
+        dump: Optional[Callable[[], Sequence[Sequence[Any]]]] = None,
+        ) -> None:
+        """
+        Registers a query to be run during the warm-up phase. If the warm-up is already done the query is run right away.
+
+        Parameters
+        -----------
+        name: str
+            Unique name of the preload
+        query: str
+            The query to fetch
+        callback: Callable[[Sequence[Sequence[Any]]], None]
+            Called with the fetched rows, or with the rows from the snapshot which are plain tuples
+        dump: Optional[Callable[[], Sequence[Sequence[Any]]]]
+            Returns the current contents of the cache as rows for the snapshot
+        """
+        preload = Preload(name, query, callback, dump)
+        self.preloads[name] = preload
+
+        if self.warmed_up.is_set():
+            self.loop.create_task(self._run_preload(preload))
+
+    def remove_preload(self, name: str) -> Optional[Preload]:
+        return self.preloads.pop(name, None)
+
+    def add_drain_hook(
+        self,
+        name: str,
+        drain: Callable[[], Awaitable[Optional[str]]],
+        *,
+        priority: int = 0,
+        budget: float = 5.0,
+        persist: Optional[Callable[[], List[Any]]] = None,
+        replay: Optional[Callable[[List[Any]], Awaitable[None]]] = None,
+        ) -> None:
+        """
+        Registers work to finish when the bot shuts down. Hooks with the same priority drain in parallel.
+
+        Parameters
+        -----------
+        name: str
+            Unique name of the hook
+        drain: Callable[[], Awaitable[Optional[str]]]
+            Finishes the work, may return a short description of what was drained for the log
+        priority: int
+            Hooks with a lower priority drain first
+        budget: float
+            Seconds the hook is given before it is cancelled
+        persist: Optional[Callable[[], List[Any]]]
+            Called after drain, returns JSON serializable entries for the work still pending
+        replay: Optional[Callable[[List[Any]], Awaitable[None]]]
+            Called after the next warm-up with the entries persisted on shutdown
+        """
+        self.shutdown.register(DrainHook(name, drain, priority, budget, persist, replay))
+
+    def remove_drain_hook(self, name: str) -> Optional[DrainHook]:
+        return self.shutdown.unregister(name)
+
+    def add_listener(self, func: Callable[..., Awaitable[Any]], name: str = discord.utils.MISSING) -> None:
+        # every listener is timed and tags its requests, the wrapper is kept so remove_listener can find it by the original function
+        name = func.__name__ if name is discord.utils.MISSING else name
+        wrapper = self.handler_timings.wrap('listener', func.__qualname__, tagged(':'.join(func.__qualname__.rsplit('.', 1)), func))
+        self._listener_wrappers[(name, func)] = wrapper
+        super().add_listener(wrapper, name)
+
+    def remove_listener(self, func: Callable[..., Awaitable[Any]], name: str = discord.utils.MISSING) -> None:
+        name = func.__name__ if name is discord.utils.MISSING else name
+        super().remove_listener(self._listener_wrappers.pop((name, func), func), name)
+
+    def add_cache(self, name: str, size: Callable[[], int]) -> None:
+        """
+        Registers an in-memory cache to be reported in the metrics and the memory census
+
+        Parameters
+        -----------
+        name: str
+            Unique name of the cache, prefixed with the cog for caches of cogs
+        size: Callable[[], int]
+            Returns the amount of entries in the cache
+        """
+        self.caches[name] = size
+
+    def remove_cache(self, name: str) -> Optional[Callable[[], int]]:
+        return self.caches.pop(name, None)
+
+    async def _run_preload(self, preload: Preload) -> None:
+        start = time.perf_counter()
+        while True:
+            version = self.cache_sync.version(preload.name)
+            async with self.pool.acquire() as con:
+                rows = await con.fetch(preload.query)
+            if self.cache_sync.version(preload.name) == version:
+                break
+            self.logger.debug('Preload %s raced a change to its cache, loading it again', preload.name)
+
+        preload.callback(rows)
+        self._preload_rows[preload.name] = rows
+        self.logger.debug('Preload %s fetched %d rows in %.3fs', preload.name, len(rows), time.perf_counter() - start)
+
+    async def _prepare_xp(self) -> None:
+        async with self._xp_preparing:
+            if self._xp_prepared:
+                return
+
+            async with self.pool.acquire() as con:
+                await create_flush_table(con)
+                if self.xp_flush_mode == 'copy':
+                    await create_staging_table(con)
+                await self.xp_cache.recover(con)
+            self._xp_prepared = True
+
+    async def _recover_xp(self) -> None:
+        await self._prepare_xp()
+        await self.update_xp() # stores xp recovered from the journal of a previous run
+
+    def restore_snapshot(self) -> bool:
+        """
+        Fills the caches from the snapshot file. Returns True if every preload was restored.
+        """
+        try:
+            sections = read_snapshot(self.snapshot_path)
+        except FileNotFoundError:
+            return False
+        except SnapshotError:
+            self.logger.exception('Ignoring unreadable cache snapshot')
+            return False
+
+        restored = 0
+        for name, preload in self.preloads.items():
+            fp, rows = sections.get(name, (None, None))
+            if fp != fingerprint(preload.query): # missing, or saved from a different query
+                continue
+
+            try:
+                preload.callback(rows)
+            except Exception:
+                self.logger.exception('Ignoring the snapshot of %s, it could not be restored', name)
+                continue
+
+            self._preload_rows[name] = rows
+            restored += 1
+
+        return restored == len(self.preloads)
+
+    async def save_snapshot(self) -> None:
+        """
+        Writes the current contents of every loaded cache to the snapshot file
+        """
+        sections = {
+            name: (fingerprint(preload.query), preload.dump() if preload.dump else self._preload_rows[name])
+            for name, preload in self.preloads.items() if name in self._preload_rows
+        }
+        size = await self.loop.run_in_executor(None, write_snapshot, self.snapshot_path, sections)
+        self.logger.debug('Cache snapshot saved (%d bytes)', size)
+
+    async def _snapshot_task(self) -> None:
+        while not self.is_closed():
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshot()
+            except Exception:
+                self.logger.exception('Saving the cache snapshot failed')
+
+    async def warm_up(self) -> None:
+        """
+        Runs every registered preload concurrently, each on its own pool connection. The message pipeline is held
+        until this is done, unless every cache could be restored from the snapshot. In that case the preloads
+        reconcile the caches with the database in the background.
+        """
+        start = time.perf_counter()
+        preloads = list(self.preloads.values())
+
+        try:
+            try:
+                restored = self.restore_snapshot()
+            except Exception: # the preloads below start from a cold cache
+                self.logger.exception('Restoring the cache snapshot failed')
+                restored = False
+
+            if restored:
+                self.warmed_up.set()
+                self.logger.info('Caches restored from snapshot in %.3fs', time.perf_counter() - start)
+
+            await self.cache_sync.start() # listen before loading so no change is missed in between
+            results = await asyncio.gather(self._recover_xp(), catalog.check(self.pool), *(self._run_preload(p) for p in preloads), return_exceptions=True)
+            for name, result in zip(['xp', 'catalog'] + [p.name for p in preloads], results):
+                if isinstance(result, BaseException):
+                    self.logger.error('Preload %s failed', name, exc_info=result)
+
+            await self.shutdown.replay()
+        finally:
+            self.warmed_up.set()
+            self.logger.info('Warm-up finished in %.3fs', time.perf_counter() - start)
+            self.snapshot_task = self.loop.create_task(self._snapshot_task(), name='snapshot')
+            self.snapshot_task.add_done_callback(self._log_task_failure)
+
+    def _log_task_failure(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error('Task %s failed', task.get_name(), exc_info=task.exception())
+
+    async def _cancel_tasks(self) -> Optional[str]:
+        tasks = [task for task in (self.warm_up_task, self.snapshot_task) if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return f'cancelled {", ".join(task.get_name() for task in tasks)}' if tasks else None
+
     async def close(self):
         try:
-            await self.update_xp()
-            await self.pool.close()
-        except:
-            pass
+            await self.shutdown.drain()
         finally:
+            self.xp_cache.close()
             await super().close()
             self.logger.info('Bot shutting down')
 
+    async def _drain_xp(self) -> str:
+        users = len(self.xp_cache)
+        await self.update_xp()
+        return f'{users} users flushed'
+
+    def _persist_xp(self) -> List[Any]:
+        # xp that could not be flushed is already in the journal and recovered from there on boot
+        self.xp_cache.sync()
+        return []
+
+    async def _close_pool(self) -> Optional[str]:
+        pools = [self.pool, self.read_pool] if self.read_pool else [self.pool]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(pool.close() for pool in pools)), 10)
+        except asyncio.TimeoutError:
+            for pool in pools:
+                pool.terminate()
+            return 'connections still in use were terminated'
+        return None
+
+    def pool_for(self, *, readonly: bool = False) -> asyncpg.Pool:
+        """
+        Returns the read replica's pool for reads while it is close enough behind the primary, the primary's
+        otherwise. A replica read can miss writes of the last max lag seconds, so reads of what a user may just have
+        written, such as balances after a purchase, stay on the primary.
+        """
+        if not readonly:
+            return self.pool
+
+        if self.read_pool is not None and self.replica.healthy:
+            self.reads.labels('replica').inc()
+            return self.read_pool
+        self.reads.labels('primary').inc()
+        return self.pool
+
+    async def on_ready(self) -> None:
+        self.prefixes = PrefixResolver((f'<@!{self.user.id}> ', f'<@{self.user.id}> ', *PREFIXES)) # type: ignore
+
+        if self.chunk_mode == 'background':
+            self.loop.create_task(self._chunk_guilds())
+
+        if self.recorder:
+            self.recorder.start(self.user.id) # type: ignore
+
+    async def on_socket_raw_receive(self, msg: str) -> None:
+        if self.recorder:
+            self.recorder.receive(msg)
+
+    async def _chunk_guilds(self) -> None:
+        for guild in self.guilds:
+            start = time.perf_counter()
+            await self.ensure_chunked(guild)
+            self.logger.info('Chunked %s (%d members) in %.2fs', guild, guild.member_count, time.perf_counter() - start)
+
+    async def ensure_chunked(self, guild: discord.Guild) -> None:
+        """
+        Chunks the guild if it is not chunked yet. Commands that need every member of a guild must await this
+        first, as outside of startup chunk mode the member cache only holds members seen so far.
+
+        Parameters
+        -----------
+        guild: discord.Guild
+            The guild to chunk
+        """
+        if not guild.chunked:
+            await self._lookups.run(('chunk', guild.id), guild.chunk)
+
     async def get_context(self, message: discord.Message, *, cls=BBContext):
+        if self.prefixes.resolve(message.content) is None: # not a command, skip the rest of the prefix handling
+            return cls(prefix=None, view=StringView(message.content), bot=self, message=message)
         return await super().get_context(message, cls=cls)
     
+    def add_message_stage(self, stage: MessageStage) -> None:
+        """
+        Registers a stage in the message pipeline
+
+        Parameters
+        -----------
+        stage: MessageStage
+            The stage to register
+        """
+        if any(s.name == stage.name for s in self.message_stages):
+            raise ValueError(f'Message stage {stage.name} is already registered')
+
+        self.message_stages.append(stage)
+        self.message_stages.sort(key=lambda s: s.priority)
+
+    def remove_message_stage(self, name: str) -> Optional[MessageStage]:
+        """
+        Removes a stage from the message pipeline and returns it
+
+        Parameters
+        -----------
+        name: str
+            The name of the stage to remove
+        """
+        for i, stage in enumerate(self.message_stages):
+            if stage.name == name:
+                return self.message_stages.pop(i)
+
     async def on_message(self, message: discord.Message):
-        if message.author.id in self.blacklist:
-            return
-        return await super().on_message(message)
+        if not self.warmed_up.is_set():
+            await self.warmed_up.wait()
+
+        self.message_count.inc()
+        is_bot = message.author.bot
+        is_blacklisted = message.author.id in self.blacklist
+        channel_id = message.channel.id
+
+        for stage in self.message_stages:
+            if not stage.accepts(message, is_bot=is_bot, is_blacklisted=is_blacklisted, channel_id=channel_id):
+                continue
+
+            if stage.background:
+                task = self.loop.create_task(self._run_stage(stage, message))
+                self._stage_tasks.add(task)
+                task.add_done_callback(self._stage_tasks.discard)
+            else:
+                await self._run_stage(stage, message)
+
+    async def _run_stage(self, stage: MessageStage, message: discord.Message) -> None:
+        start = time.perf_counter()
+        try:
+            await stage.callback(message)
+        except Exception:
+            self.logger.exception('Ignoring exception in message stage %s', stage.name)
+        finally:
+            self.stage_latency.labels(stage.name).observe(time.perf_counter() - start)
+
+    async def _drain_stages(self) -> Optional[str]:
+        if not self._stage_tasks:
+            return None
+        pending = len(self._stage_tasks)
+        await asyncio.gather(*self._stage_tasks)
+        return f'{pending} background stages'
 
     async def update_xp(self) -> None:
+        flush = flush_copy if self.xp_flush_mode == 'copy' else flush_executemany
+        if not self._xp_prepared: # xp_task starts with the cog, before warm_up gets here
+            await self._prepare_xp()
+
         async with self.pool.acquire() as con:
-            _data = self.xp_cache.copy()
-            self.xp_cache = {}
-            query = 'INSERT INTO events.leaderboard(user_id, xp) \
-                     VALUES($1, $2) \
-                     ON CONFLICT(user_id) \
-                     DO UPDATE SET xp = events.leaderboard.xp + $2'
-            await con.executemany(query, _data.items())
+            with self.xp_cache.drain() as (_data, token):
+                if not _data:
+                    return
+                async with con.transaction(): # the token tells a restart whether this xp was stored
+                    await flush(con, _data)
+                    await record_flush(con, token)
+
+            await forget_flush(con, token)
+
+    async def on_command(self, ctx: BBContext) -> None:
+        self.command_count.labels(ctx.command.qualified_name).inc() # type: ignore (always set once invoked)
+
+    def _cache_entries(self) -> Dict[Tuple[str], float]:
+        return {(name,): size() for name, size in self.caches.items()}
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self._missing.discard((member.guild.id, member.id))
 
     async def getch_member(self, guild: discord.Guild, user_id: int) -> Union[discord.Member, int]:
         member = guild.get_member(user_id)
         if member:
+            self.lookup_stats['cache_hit'] += 1
             return member
 
+        key = (guild.id, user_id)
+        if key in self._missing:
+            self.lookup_stats['negative_hit'] += 1
+            return user_id
+
+        if key in self._lookups:
+            self.lookup_stats['coalesced'] += 1
+
+        return await self._lookups.run(key, lambda: self._fetch_member(guild, user_id))
+
+    async def resolve_members(self, guild: discord.Guild, ids: Iterable[int]) -> Dict[int, Union[discord.Member, int]]:
+        """
+        Resolves many members at once. Ids not in the member cache are requested in chunks of 100 through the
+        gateway instead of one REST request each.
+
+        Parameters
+        -----------
+        guild: discord.Guild
+            The guild the members are in
+        ids: Iterable[int]
+            The user ids to resolve
+
+        Returns
+        --------
+        Dict[int, Union[discord.Member, int]]
+            Mapping of every id, in the given order, to its member or to the id itself if the member was not found
+        """
+        resolved: Dict[int, Union[discord.Member, int]] = {}
+        misses: List[int] = []
+
+        for user_id in map(int, ids): # ids from numeric columns come as Decimal
+            member = guild.get_member(user_id)
+            if member:
+                self.lookup_stats['cache_hit'] += 1
+            elif (guild.id, user_id) in self._missing:
+                self.lookup_stats['negative_hit'] += 1
+            else:
+                misses.append(user_id)
+            resolved[user_id] = member or user_id
+
+        for i in range(0, len(misses), 100):
+            chunk = misses[i:i+100]
+            self.lookup_stats['fetch'] += 1
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=len(chunk))
+            except asyncio.TimeoutError:
+                continue
+
+            for member in members:
+                resolved[member.id] = member
+
+            for user_id in chunk:
+                if isinstance(resolved[user_id], int):
+                    self.lookup_stats['not_found'] += 1
+                    self._missing.add((guild.id, user_id))
+
+        return resolved
+
+    async def _fetch_member(self, guild: discord.Guild, user_id: int) -> Union[discord.Member, int]:
+        self.lookup_stats['fetch'] += 1
         try:
-            member = await guild.fetch_member(user_id)
+            return await guild.fetch_member(user_id)
+        except discord.NotFound:
+            self.lookup_stats['not_found'] += 1
+            self._missing.add((guild.id, user_id))
+            return user_id
         except discord.HTTPException:
             return user_id
-        else:
-            return member
 
     async def getch_user(self, user_id: int) -> Optional[discord.User]:
         user = self.get_user(user_id)
         if user:
+            self.lookup_stats['cache_hit'] += 1
             return user
-        
+
+        key = (None, user_id)
+        if key in self._missing:
+            self.lookup_stats['negative_hit'] += 1
+            return
+
+        if key in self._lookups:
+            self.lookup_stats['coalesced'] += 1
+
+        return await self._lookups.run(key, lambda: self._fetch_user(user_id))
+
+    async def _fetch_user(self, user_id: int) -> Optional[discord.User]:
+        self.lookup_stats['fetch'] += 1
         try:
-            user = await self.fetch_user(user_id)
+            return await self.fetch_user(user_id)
+        except discord.NotFound:
+            self.lookup_stats['not_found'] += 1
+            self._missing.add((None, user_id))
         except discord.HTTPException:
             return
-        else:
-            return user
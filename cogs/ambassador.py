@@ -8,6 +8,7 @@ from random import choice
 from typing import Callable, List, Optional
 from utils.checks import is_staff_or_support
 from utils.constants import staff_lounge, ambassadors_lounge, training_room
+from utils.outbound import Priority
 from utils.views import EmbedViewPagination
 
 
@@ -106,10 +107,10 @@ class ambassador(commands.Cog):
         for channel_id in FLARE_INFO_CHANNELS:
             channel = self.bot.get_channel(channel_id)
             flare = Flare(ctx.author, ctx.channel, reason, emoji_message.jump_url) # type: ignore (Direct messages intent is not being used so author will be a member)
-            flare.message = await channel.send(embed=flare.ambass) # type: ignore
+            flare.message = await self.bot.outbound.send(channel, Priority.STAFF, embed=flare.ambass) # type: ignore
             flares.append(flare)
 
-        await staff.send(embed=flare.staff, view=FlareView(flares)) # type: ignore
+        await self.bot.outbound.send(staff, Priority.STAFF, embed=flare.staff, view=FlareView(flares)) # type: ignore
 
     @commands.command(name='redalert', aliases=['red-alert'])
     @is_staff_or_support()
@@ -127,10 +128,10 @@ class ambassador(commands.Cog):
         for channel_id in FLARE_INFO_CHANNELS:
             channel = self.bot.get_channel(channel_id)
             flare = Flare(ctx.author, ctx.channel, reason, emoji_message.jump_url, urgent=True) # type: ignore (Direct messages intent is not being used so author will be a member)
-            flare.message = await channel.send(embed=flare.ambass) # type: ignore
+            flare.message = await self.bot.outbound.send(channel, Priority.STAFF, embed=flare.ambass) # type: ignore
             flares.append(flare)
 
-        await staff.send('@here', embed=flare.staff, view=FlareView(flares)) # type: ignore
+        await self.bot.outbound.send(staff, Priority.STAFF, '@here', embed=flare.staff, view=FlareView(flares)) # type: ignore
 
     @commands.command(aliases=['whois'])
     @is_staff_or_support()
@@ -145,6 +146,8 @@ class ambassador(commands.Cog):
         if not person:
             return
 
+        await self.bot.ensure_chunked(ctx.guild) # type: ignore (Direct messages intent is not being used so guild will not be none)
+
         roles = [role.mention for role in person.roles]
         permissions = [perm[0] if perm[1] else '' for perm in person.guild_permissions]
         join_position = sorted(ctx.guild.members, key=lambda m: m.joined_at).index(person) + 1 # type: ignore (Direct messages intent is not being used so guild will not be none)
@@ -166,6 +169,8 @@ class ambassador(commands.Cog):
         A command to find all the members having a certain role.
         """
 
+        await self.bot.ensure_chunked(ctx.guild) # type: ignore (Direct messages intent is not being used so guild will not be none)
+
         predicate: Callable[[discord.Member], bool] = lambda member: role in member.roles
         members: List[Optional[discord.Member]] = [member for member in ctx.guild.members if predicate(member)] # type: ignore (Direct messages intent is not being used so guild will not be none)
 
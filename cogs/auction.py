@@ -7,6 +7,7 @@ from context import BBContext
 from datetime import datetime, timedelta
 from discord.ext import commands
 from typing import List, Optional
+from utils import queries
 from utils.checks import is_beta_tester, spam_channel_only
 from utils.constants import COINS
 from utils.converters import TimeConverter
@@ -31,8 +32,7 @@ class AuctionItem:
 
     @classmethod
     async def fetch(cls, item_name: str, con: asyncpg.Connection) -> Optional[AuctionItem]:
-        query = 'SELECT id, name, current_bet, minimum_increment, active_till, current_holder FROM events.auctions where name = $1'
-        row = await con.fetchrow(query, item_name)
+        row = await queries.AUCTION_ITEM.fetchrow(con, item_name)
         if not row:
             return None
 
@@ -63,11 +63,12 @@ class AuctionPages(EmbedViewPagination):
 
     async def format_page(self, data: List[asyncpg.Record]) -> discord.Embed:
         embed = discord.Embed(title='Goodies for auction').set_footer(text=f'{self.current_page}/{self.max_pages}')
+        holders = await self.bot.resolve_members(self.guild, [row['current_holder'] for row in data if row['current_holder']])
         for row in data:
             item = AuctionItem.from_dict(dict(row))
 
             if item.current_holder:
-                user = await self.bot.getch_member(self.guild, item.current_holder)
+                user = holders[item.current_holder]
                 current_holder = user.name if isinstance(user, discord.Member) else user
             else:
                 current_holder = 'No bet yet'                  
@@ -104,9 +105,8 @@ class auction(commands.Cog):
         if not self.enabled:
             return await ctx.send('There is no auction being conducted right now.')
 
-        con = await ctx.get_connection()
-        query = 'SELECT id, name, current_bet, minimum_increment, active_till, current_holder FROM events.auctions WHERE active_till > $1'
-        rows = await con.fetch(query, discord.utils.utcnow())
+        con = await ctx.get_connection() # current bets, a bid placed a moment ago has to show
+        rows = await queries.AUCTION_ACTIVE.fetch(con, discord.utils.utcnow())
 
         if rows:    
             view = AuctionPages(ctx.author.id, rows, bot=self.bot, guild=ctx.guild) # type: ignore (Direct messages intent is not being used so guild will not be none)
@@ -126,9 +126,11 @@ class auction(commands.Cog):
         if not self.enabled:
             return await ctx.send('There is no auction being conducted right now.')
             
-        con = await ctx.get_connection()
-        item = await AuctionItem.fetch(item_name, con)
+        async with ctx.batch() as batch:
+            fetched = batch.call(lambda con: AuctionItem.fetch(item_name, con))
+            player = batch.call(LeaderboardPlayer.fetch, ctx.author)
 
+        item = fetched.result
         if not item:
             return await ctx.send(f'No item with name: **{item_name}** exists.')
 
@@ -141,13 +143,11 @@ class auction(commands.Cog):
         if bet_amount < item.next_bet:
             return await ctx.send(f'You can not bet **{bet_amount}**. You need to bet at least **{item.next_bet}**.')
 
-        player = await LeaderboardPlayer.fetch(con, ctx.author)
+        if player.result.coins < bet_amount:
+            return await ctx.send(f'You only have **{player.result.coins}** {COINS} lol.')
 
-        if player.coins < bet_amount:
-            return await ctx.send(f'You only have **{player.coins}** {COINS} lol.')
-
-        query = 'INSERT INTO events.auctions_log(user_id, item_id, bet_amount, time, item_name, old_bet, old_user_id) VALUES($1, $2, $3, $4, $5, $6, $7)'
-        await con.execute(query, ctx.author.id, item.id, bet_amount, discord.utils.utcnow(), item.name, item.current_bet, item.current_holder)
+        con = await ctx.get_connection()
+        await queries.AUCTION_BET.execute(con, ctx.author.id, item.id, bet_amount, discord.utils.utcnow(), item.name, item.current_bet, item.current_holder)
         await ctx.tick()
         self.bot.logger.info('%d bet on auction item (%s) %d for %d event coins', str(ctx.author), item.id, item.name, bet_amount)
 
@@ -2,13 +2,15 @@ import asyncpg
 import discord
 import re
 
-from bot import BunkerBot
+from bot import BunkerBot, MessageStage
 from context import BBContext
 from datetime import datetime, timezone
 from discord.ext import commands
-from typing import Any, List, NamedTuple, Optional
+from typing import Any, List, NamedTuple, Optional, Sequence
+from utils import queries
 from utils.checks import spam_channel_only
 from utils.constants import BUNKER_CODE_DENIED
+from utils.outbound import Priority
 from utils.views import EmbedViewPagination
 
 code_regex = re.compile(r'(([bvgc][liouy]+[wnm]+\w+er|al(ph|f)a) (?=code))|(^(what|know|may|plase|does|anyone)\s.*code'
@@ -110,8 +112,29 @@ class bunkercode(commands.Cog):
         self.bot = bot
         self.code_enabled: bool = True
         self.arts_cache: List[Art] = []
+        self._arts_loaded: List[Art] = [] # the last loaded arts, arts_cache is consumed as codes are sent
 
         self._set_codes()
+        bot.add_preload('arts', f'SELECT url, artist_id, artist_name FROM {TABLE_ARTS} ORDER BY random() LIMIT 20', self._set_arts, dump=lambda: self._arts_loaded)
+        bot.add_cache('bunkercode.arts', lambda: len(self.arts_cache))
+        bot.add_cache('bunkercode.user_cooldowns', lambda: len(USER_COOLDOWN._cache))
+        bot.add_cache('bunkercode.channel_cooldowns', lambda: len(CHANNEL_COOLDOWN._cache))
+        bot.add_message_stage(MessageStage(
+            'bunkercode',
+            self.on_code_message,
+            priority=10,
+            exclude_channels=BUNKER_CODE_DENIED,
+            background=True, # the reply waits on the outbound queue and possibly a query for arts
+            predicate=lambda message: self.code_enabled and code_regex.search(message.content) is not None
+        ))
+        if bot.recorder:
+            bot.recorder.keep(code_regex) # replays have to trigger the auto response like the recorded messages did
+
+    def cog_unload(self) -> None:
+        self.bot.remove_message_stage('bunkercode')
+        self.bot.remove_preload('arts')
+        for name in ('bunkercode.arts', 'bunkercode.user_cooldowns', 'bunkercode.channel_cooldowns'):
+            self.bot.remove_cache(name)
 
     def _set_codes(self) -> None:
         """
@@ -142,23 +165,26 @@ class bunkercode(commands.Cog):
         day = discord.utils.utcnow().day
         return self._codes[int(day)]
 
+    def _set_arts(self, rows: Sequence[Sequence[Any]]) -> None:
+        self._arts_loaded = [Art(url, artist_id, artist_name) for (url, artist_id, artist_name) in rows]
+        self.arts_cache = list(self._arts_loaded)
+
     async def _get_art(self) -> Art:
         """
         Returns an Art to be used inside code message
         """
         if not self.arts_cache:
             async with self.bot.pool.acquire() as con:
-                query = f'SELECT url, artist_id, artist_name FROM {TABLE_ARTS} ORDER BY random() LIMIT 20'
+                query = self.bot.preloads['arts'].query
                 rows: List[asyncpg.Record] = await con.fetch(query)
-                self.arts_cache = [Art(url, artist_id, artist_name) for (url, artist_id, artist_name) in rows]
+                self._set_arts(rows)
 
         return self.arts_cache.pop()
 
-    @commands.Cog.listener(name='on_message')
     async def on_code_message(self, message: discord.Message) -> None:
         """
-        A listener that is triggered for every message. Uses regex to check if the message's author is trying to
-        trigger the bunker code auto response
+        Sends the bunker code auto response. Runs in the message pipeline for messages whose author the regex 
+        detected to be trying to trigger the auto response.
 
         Parameters
         -----------
@@ -166,34 +192,37 @@ class bunkercode(commands.Cog):
 
         :return: None
         """
-        
-        if message.author.bot or message.channel.id in BUNKER_CODE_DENIED or not self.code_enabled:
-            return
-
-        # if message.channel.id != 411523566761148426:
-        #     return  # TODO remove, only for testing
-
-        if code_regex.search(message.content):
-            self.bot.times_code_is_asked += 1
-
-            # check cooldowns
-            user_bucket = USER_COOLDOWN.get_bucket(message)
-            channel_bucket = CHANNEL_COOLDOWN.get_bucket(message)
-            retry_after1 = user_bucket.update_rate_limit()
-            retry_after2 = channel_bucket.update_rate_limit()
-
-            if retry_after1:
-                await message.channel.send(
-                    content=f'Hey, {message.author.mention}! You just used that command, please wait {int(retry_after1)} seconds... The code is **{self.code}**',
-                    delete_after=10)
-            elif retry_after2:
-                await message.channel.send(
-                    content=f'Hey, {message.author.mention}! That command was just used in this channel, please wait {int(retry_after2)} seconds... The code is **{self.code}**.',
-                    delete_after=10)
-            else:
-                embed = discord.Embed(title=f'Bunker Code: {self.code}')
-                art = await self._get_art()
-                await message.reply(embed=embed, view=BunkerCodeView(self.code, art.url, art.artist_name))
+
+        self.bot.times_code_is_asked += 1
+
+        # check cooldowns
+        user_bucket = USER_COOLDOWN.get_bucket(message)
+        channel_bucket = CHANNEL_COOLDOWN.get_bucket(message)
+        retry_after1 = user_bucket.update_rate_limit()
+        retry_after2 = channel_bucket.update_rate_limit()
+
+        # cooldown notices are cosmetic, while the channel is busy pending ones for the same user are merged into the latest
+        if retry_after1:
+            await self.bot.outbound.send(
+                message.channel,
+                Priority.COSMETIC,
+                content=f'Hey, {message.author.mention}! You just used that command, please wait {int(retry_after1)} seconds... The code is **{self.code}**',
+                delete_after=10,
+                merge_key=('code_cooldown', message.author.id))
+        elif retry_after2:
+            await self.bot.outbound.send(
+                message.channel,
+                Priority.COSMETIC,
+                content=f'Hey, {message.author.mention}! That command was just used in this channel, please wait {int(retry_after2)} seconds... The code is **{self.code}**.',
+                delete_after=10,
+                merge_key=('code_cooldown', message.author.id))
+        else:
+            embed = discord.Embed(title=f'Bunker Code: {self.code}')
+            art = await self._get_art()
+            await self.bot.outbound.submit(
+                message.channel.id,
+                Priority.REPLY,
+                lambda: message.reply(embed=embed, view=BunkerCodeView(self.code, art.url, art.artist_name)))
 
     @commands.group()
     @commands.has_guild_permissions(administrator=True)
@@ -304,7 +333,7 @@ class bunkercode(commands.Cog):
 
         args = [query]
 
-        con = await ctx.get_connection()
+        con = await ctx.get_connection(readonly=True)
         data: List[asyncpg.Record] = await con.fetch(*args)
         view = ArtsLeaderboardPagination(data, ctx.author) # type: ignore (Direct messages intent is not being used so author can only be a member)
         await view.start(ctx.channel)
@@ -317,15 +346,11 @@ class bunkercode(commands.Cog):
         are shown and are selected randomly.
         """
 
+        con = await ctx.get_connection(readonly=True)
         if artist:
-            query = f'SELECT url, artist_name FROM {TABLE_ARTS} WHERE artist_id = $1 LIMIT 20'
-            args = [query, artist.id]
+            data: List[asyncpg.Record] = await queries.ARTS_BY_ARTIST.fetch(con, artist.id)
         else:
-            query = f'SELECT url, artist_name FROM {TABLE_ARTS} ORDER BY random() LIMIT 20'
-            args = [query]
-
-        con = await ctx.get_connection()
-        data: List[asyncpg.Record] = await con.fetch(*args)
+            data = await queries.ARTS_RANDOM.fetch(con)
 
         view = ArtsPagination(data, ctx.author) # type: ignore (Direct messages intent is not being used so author can only be a member)
         await view.start(ctx.channel)
@@ -11,13 +11,13 @@ from utils.constants import MR_K, SIGNAL, TICKET
 from datetime import datetime, timedelta
 from discord.ext import commands, tasks
 from random import randint, choices
-from typing import List, Optional, Tuple, Dict
+from typing import Any, List, Optional, Sequence, Tuple, Dict
+from utils import queries
 from utils.checks import spam_channel_only, is_beta_tester
 from utils.levels import LeaderboardPlayer
 
 
 TABLE_CURRENCY = 'events.currency'
-TABLE_GAME_TTL = 'events.game_ttl'
 AWARDS = { # difficulty_level: (min reward, max reward)
     75: (10, 20), # easy
     45: (30, 50), # medium
@@ -229,11 +229,10 @@ class ChooseGameSelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction) -> None:
         event_id = int(self.values[0])
-        query = 'SELECT description, outcomes FROM events.situations WHERE game_id = $1 ORDER BY random() LIMIT $2'
         self.view.clear_items()
 
         async with self.view.bot.pool.acquire() as con:
-            rows: List[asyncpg.Record] = await con.fetch(query, event_id, self.view.no_of_situations)
+            rows: List[asyncpg.Record] = await queries.GAME_SITUATIONS.fetch(con, event_id, self.view.no_of_situations)
             self.view.situations = [Situation(description, json.loads(options)) for (description, options) in rows]
 
         next_situation = self.view.situations.pop()
@@ -310,26 +309,37 @@ class game(commands.Cog):
     game_tasks: Dict[str, asyncio.Task] = {}
     def __init__(self, bot: BunkerBot) -> None:
         self.bot = bot
-        bot.loop.create_task(self.get_games())
+        self.games = []
+        bot.add_preload('games', 'SELECT game_id, name FROM events.games ORDER BY random()', self.set_games)
+        bot.add_drain_hook('game.ttl', self.drain_game_tasks)
+        bot.add_cache('game.games', lambda: len(self.games))
+        bot.add_cache('game.ttl_tasks', lambda: len(self.game_tasks))
         self.game_command_ttl.start()
 
-    async def get_games(self) -> None:
-        query = 'SELECT game_id, name FROM events.games ORDER BY random()'
-
-        async with self.bot.pool.acquire() as con:
-            rows = await con.fetch(query)
-            self.games = [(game_name, game_id) for (game_id, game_name) in rows]
+    def set_games(self, rows: Sequence[Sequence[Any]]) -> None:
+        self.games = [(game_name, game_id) for (game_id, game_name) in rows]
 
     def cog_unload(self):
+        self.bot.remove_preload('games')
+        self.bot.remove_drain_hook('game.ttl')
+        self.bot.remove_cache('game.games')
+        self.bot.remove_cache('game.ttl_tasks')
         for task in self.game_tasks.values():
             task.cancel()
+
+    async def drain_game_tasks(self) -> str:
+        # the cooldowns stay in the database, game_command_ttl schedules their removal again on boot
+        tasks = list(self.game_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        return f'{len(tasks)} cooldown removals cancelled'
     
     @tasks.loop(hours=1)
     async def game_command_ttl(self):
-        query = f'SELECT user_id, time FROM {TABLE_GAME_TTL} WHERE time < $1'
-
         async with self.bot.pool.acquire() as con:
-            rows = await con.fetch(query, discord.utils.utcnow() + timedelta(hours=1))
+            rows = await queries.GAME_TTL_DUE.fetch(con, discord.utils.utcnow() + timedelta(hours=1))
         
         for row in rows:
             task = self.bot.loop.create_task(self.remove_cooldown_from_game(row['user_id'], row['time']), name=str(row['user_id']))
@@ -337,9 +347,8 @@ class game(commands.Cog):
 
     async def remove_cooldown_from_game(self, user_id: int, time: datetime) -> None:
         await discord.utils.sleep_until(time)
-        query = f'DELETE FROM {TABLE_GAME_TTL} WHERE user_id = $1'
         async with self.bot.pool.acquire() as con:
-            await con.execute(query, user_id)
+            await queries.GAME_TTL_REMOVE.execute(con, user_id)
         del self.game_tasks[str(user_id)]
     
     @commands.command(aliases=['tasks'])
@@ -350,23 +359,22 @@ class game(commands.Cog):
         A bunker bot special game. Complete tasks given to you by MR.K and earn tickets!
         """
 
-        con = await ctx.get_connection()
-        query = f'SELECT time FROM {TABLE_GAME_TTL} WHERE user_id = $1'
+        async with ctx.batch() as batch:
+            ttl = batch.call(queries.GAME_TTL.fetchval, ctx.author.id)
+            player = batch.call(LeaderboardPlayer.fetch, ctx.author)
 
-        if time := await con.fetchval(query, ctx.author.id):
+        if time := ttl.result:
             embed = discord.Embed(description=f'Back so soon? I do not have any more tasks for you right now. Check again {discord.utils.format_dt(time, "R")}')
             embed.set_image(url=MR_K)
             return await ctx.reply(embed=embed)
 
-        query = f'INSERT INTO {TABLE_GAME_TTL}(user_id, time) VALUES($1, $2)'
-        await con.execute(query, ctx.author.id, discord.utils.utcnow() + timedelta(days=1))
-        player = await LeaderboardPlayer.fetch(await ctx.get_connection(), ctx.author)
+        await queries.GAME_TTL_ADD.execute(await ctx.get_connection(), ctx.author.id, discord.utils.utcnow() + timedelta(days=1))
 
-        if player.level < 1:
+        if player.result.level < 1:
             return await ctx.send('You must be at least level 1 to play the game :(')
 
         embed = discord.Embed(description="Hey survivor!\nCan you do me favor? Don't worry you succeed and you get payed well").set_image(url=MR_K)
-        game = GameView(player, choices(self.games, k=1)) # TODO add more events and change k to 3
+        game = GameView(player.result, choices(self.games, k=1)) # TODO add more events and change k to 3
         game.bot = self.bot
         await ctx.send(embed=embed, view=game)
 
@@ -2,12 +2,13 @@ from __future__ import annotations
 import asyncpg
 import discord
 
-from bot import BunkerBot
+from bot import BunkerBot, MessageStage
 from context import BBContext
 from discord.ext import commands, tasks
-from typing import Callable, Dict, List, Union
+from typing import Dict, List
+from utils import queries
 from utils.checks import spam_channel_only
-from utils.constants import TABLE_LB_CONFIG, TABLE_LEADERBOARD, NO_XP_CHANNELS
+from utils.constants import TABLE_LB_CONFIG, NO_XP_CHANNELS
 from utils.views import EmbedViewPagination
 
 
@@ -29,14 +30,16 @@ class LevelConfigPages(EmbedViewPagination):
 
 
 class LeaderboardPages(EmbedViewPagination):
-    def __init__(self, user_id: int, data: List[asyncpg.Record], *, bot: BunkerBot):
+    def __init__(self, user_id: int, data: List[asyncpg.Record], *, bot: BunkerBot, guild: discord.Guild):
         super().__init__(data, per_page=10)
         self.user_id = user_id
-        self.get_user: Callable[[int], Union[discord.User, int]] = lambda user_id: bot.get_user(user_id) or user_id
+        self.bot = bot
+        self.guild = guild
 
     async def format_page(self, data: List[asyncpg.Record]) -> discord.Embed:
         start = (self.current_page-1) * self.per_page
-        description = '\n'.join(f'{start+i+1}) {self.get_user(user_id)}: {xp}' for i, (user_id, xp) in enumerate(data))
+        members = await self.bot.resolve_members(self.guild, [user_id for user_id, _ in data])
+        description = '\n'.join(f'{start+i+1}) {members[user_id]}: {xp}' for i, (user_id, xp) in enumerate(data))
         return discord.Embed(title='Leaderboard', description=description).set_footer(text=f'Page {self.current_page}/{self.max_pages}')
 
 
@@ -46,39 +49,48 @@ class leaderboard(commands.Cog):
         self.xp_channel_mapping : Dict[int, int] = {}
 
         self.xp_task.start()
+        self.journal_task.start()
+        bot.add_message_stage(MessageStage('xp', self.add_message, exclude_channels=NO_XP_CHANNELS))
+        bot.add_cache('leaderboard.xp_cooldowns', lambda: len(XP_COOLDOWN._cache))
+        bot.add_cache('leaderboard.xp_channels', lambda: len(self.xp_channel_mapping))
 
     def cog_unload(self):
         self.xp_task.cancel()
+        self.journal_task.cancel()
+        self.bot.remove_message_stage('xp')
+        self.bot.remove_cache('leaderboard.xp_cooldowns')
+        self.bot.remove_cache('leaderboard.xp_channels')
 
-    @commands.Cog.listener(name='on_message')
     async def add_message(self, message: discord.Message) -> None:
         """
-        Increments the xp for a player in the xp cache
+        Increments the xp for a player in the xp cache. Runs in the message pipeline for messages from users
+        outside of NO_XP_CHANNELS.
 
         Parameters
         -----------
         message: discord.Message
-            message received by the listener
+            message received by the pipeline
         """
-        if message.author.bot or message.channel.id in NO_XP_CHANNELS:
-            return
-
         bucket = XP_COOLDOWN.get_bucket(message)
         if bucket.update_rate_limit():
             return
 
-        try:
-            self.bot.xp_cache[message.author.id] += self.xp_channel_mapping.get(message.channel.id, DEFAULT_XP)
-        except KeyError:
-            self.bot.xp_cache[message.author.id] = self.xp_channel_mapping.get(message.channel.id, DEFAULT_XP)
+        self.bot.xp_cache.add(message.author.id, self.xp_channel_mapping.get(message.channel.id, DEFAULT_XP))
 
-    @tasks.loop(minutes=10)
+    @tasks.loop(minutes=30)
     async def xp_task(self) -> None:
         """
-        Task that updates the xp from memory to db every 10 minutes
+        Task that updates the xp from memory to db every 30 minutes. Xp not flushed yet is kept in the xp journal
         """
         await self.bot.update_xp()
 
+    @tasks.loop(seconds=5)
+    async def journal_task(self) -> None:
+        """
+        Task that syncs the xp journal to disk every 5 seconds
+        """
+        await self.bot.xp_cache.sync_async()
+
     @commands.group()
     @commands.has_guild_permissions(administrator=True)
     async def level(self, ctx: BBContext):
@@ -108,10 +120,9 @@ class leaderboard(commands.Cog):
         A command to show top members in the XP leaderboard.
         """
 
-        con = await ctx.get_connection()
-        query = f'SELECT user_id, xp FROM {TABLE_LEADERBOARD} ORDER BY xp DESC LIMIT 100'
-        rows = await con.fetch(query)
-        view = LeaderboardPages(ctx.author.id, rows, bot=self.bot)
+        con = await ctx.get_connection(readonly=True)
+        rows = await queries.LEADERBOARD_TOP.fetch(con)
+        view = LeaderboardPages(ctx.author.id, rows, bot=self.bot, guild=ctx.guild) # type: ignore (Direct messages intent is not being used so guild will not be none)
         await view.start(ctx.channel)
 
 
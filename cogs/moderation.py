@@ -14,6 +14,7 @@ from utils.checks import is_staff, is_staff_or_guide, has_kick_permissions
 from utils.constants import mute_warn_proof, muted, react_banned, LDOE
 from utils.converters import TimeConverter
 from utils.logs import create_logger, create_handler
+from utils.outbound import Priority
 from utils.views import EmbedViewPagination
 
 
@@ -155,13 +156,20 @@ class moderation(commands.Cog):
     def __init__(self, bot: BunkerBot) -> None:
         self.bot = bot
         self.unmute_tasks: Dict[int, asyncio.Task] = {}
+        self.temporary_mutes: Dict[int, datetime] = {} # user_id: unmute time, for mutes that are not in the database
 
         self.logger = create_logger('moderation', level=logging.DEBUG)
         self.logger.addHandler(create_handler('moderation'))
 
+        bot.add_drain_hook('moderation.unmutes', self.drain_unmutes, persist=self.persist_unmutes, replay=self.replay_unmutes)
+        bot.add_cache('moderation.unmute_tasks', lambda: len(self.unmute_tasks))
+        bot.add_cache('moderation.temporary_mutes', lambda: len(self.temporary_mutes))
         self.unmute_task.start()
     
     def cog_unload(self) -> None:
+        self.bot.remove_drain_hook('moderation.unmutes')
+        self.bot.remove_cache('moderation.unmute_tasks')
+        self.bot.remove_cache('moderation.temporary_mutes')
         for task in self.unmute_tasks.values():
             task.cancel()
         
@@ -301,10 +309,10 @@ class moderation(commands.Cog):
                 reason=reason
             )
 
-            view.message = await mwf.send(content, view=view)
+            view.message = await self.bot.outbound.send(mwf, Priority.MODERATION, content, view=view) # type: ignore (moderation sends are never dropped)
             return view.message
         else:
-            return await mwf.send(content)
+            return await self.bot.outbound.send(mwf, Priority.MODERATION, content)
 
 
     async def _mute(self, user: Union[discord.Member, discord.User]) -> Tuple[bool, str]:
@@ -335,6 +343,8 @@ class moderation(commands.Cog):
         ) -> None:
 
         await asyncio.sleep(time)
+        await self.bot.wait_until_ready()
+        self.temporary_mutes.pop(user_id, None)
         ldoe = self.bot.get_guild(LDOE)
 
         if not ldoe:
@@ -361,6 +371,41 @@ class moderation(commands.Cog):
 
         if user_id in self.unmute_tasks:
             del self.unmute_tasks[user_id]
+
+    def schedule_unmute(
+        self, 
+        user_id: int, 
+        time: int, 
+        *, 
+        reason: Optional[str] = None,
+        update_db: bool = True,
+        ) -> None:
+        task = self.bot.loop.create_task(self._unmute(user_id, time, reason=reason, update_db=update_db))
+        self.unmute_tasks[user_id] = task
+
+        if not update_db:
+            self.temporary_mutes[user_id] = discord.utils.utcnow() + timedelta(seconds=time)
+
+    async def drain_unmutes(self) -> str:
+        """
+        Cancels the pending unmutes. Mutes in the database are picked up again by the unmute task on boot, 
+        temporary mutes are persisted for replay.
+        """
+        tasks = list(self.unmute_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        return f'{len(tasks)} pending unmutes cancelled'
+
+    def persist_unmutes(self) -> List[Tuple[int, str]]:
+        return [(user_id, unmute.isoformat()) for user_id, unmute in self.temporary_mutes.items()]
+
+    async def replay_unmutes(self, entries: List[Tuple[int, str]]) -> None:
+        now = discord.utils.utcnow()
+        for user_id, unmute in entries:
+            delta = datetime.fromisoformat(unmute) - now
+            self.schedule_unmute(user_id, max(int(delta.total_seconds()), 0), reason='Mute Expired', update_db=False)
     
     async def _ban_request(
         self, 
@@ -434,7 +479,7 @@ class moderation(commands.Cog):
         if not success:
             mwf = self.bot.get_channel(mute_warn_proof)
             if isinstance(mwf, discord.TextChannel):
-                await mwf.send(f'Mute for {offender} failed. {error_message}')
+                await self.bot.outbound.send(mwf, Priority.STAFF, f'Mute for {offender} failed. {error_message}')
         
         self.logger.info('%s muted %s (%s) for %s', str(ctx.author), str(offender), offender.id, reason)
                 
@@ -624,11 +669,11 @@ class moderation(commands.Cog):
         if not success:
             mwf = self.bot.get_channel(mute_warn_proof)
             if isinstance(mwf, discord.TextChannel):
-                await mwf.send(f'Mute for {offender} failed. {error_message}')
+                await self.bot.outbound.send(mwf, Priority.STAFF, f'Mute for {offender} failed. {error_message}')
         
         self.logger.info('%s muted %s (%s) for %s', str(ctx.author), str(offender), offender.id, reason)
         await ctx.message.delete()
-        await self._unmute(offender.id, 300, reason='Mute Expired', update_db=False)
+        self.schedule_unmute(offender.id, 300, reason='Mute Expired', update_db=False)
 
     @commands.command(name='modlogs', aliases=['mod-logs', 'punishments'])
     @is_staff()
@@ -637,7 +682,7 @@ class moderation(commands.Cog):
         A command to display infractions for a member.
         """
 
-        async with self.bot.pool.acquire() as con:
+        async with self.bot.pool_for(readonly=True).acquire() as con:
             data = await con.fetch('SELECT case_id, message_id, type FROM moderation.moderation WHERE user_id= $1', user.id)
             mwf = self.bot.get_channel(mute_warn_proof)
             view = ModLogs(data, mwf) # type: ignore
@@ -741,8 +786,7 @@ class moderation(commands.Cog):
         if rows:
             for row in rows:
                 delta: timedelta = row[1] - discord.utils.utcnow()
-                task = self.bot.loop.create_task(self._unmute(row[0], delta.seconds, reason='Mute Expired'))
-                self.unmute_tasks[row[0]] = task
+                self.schedule_unmute(row[0], delta.seconds, reason='Mute Expired')
 
 
 def setup(bot: BunkerBot) -> None:
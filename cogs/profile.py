@@ -4,9 +4,9 @@ import discord
 from bot import BunkerBot
 from context import BBContext
 from discord.ext import commands
-from typing import Optional
 from utils.checks import spam_channel_only
 from utils.constants import COINS, DOGTAGS, TICKET
+from utils import queries
 from utils.levels import LeaderboardPlayer
 
 
@@ -94,17 +94,14 @@ class profile(commands.Cog):
         A command to view your LDoE server profile. Your profile includes general, events and clan info.
         """
         
-        con = await ctx.get_connection()
+        async with ctx.batch() as batch: # balances change with purchases and bets, read them where they were written
+            # Clan Data
+            clan_data = batch.call(queries.CLAN_OF_MEMBER.fetchrow, ctx.author.id)
 
-        # Clan Data
-        query = '''SELECT clan_name, description, banner_url, clan_role, clan_language, clan_tag FROM clans.clan_members  
-                   INNER JOIN clans.clan ON clan.clan_id = clan_members.clan_id WHERE member_id = $1'''
-        clan_data: Optional[asyncpg.Record] = await con.fetchrow(query, ctx.author.id)
+            # Events Data
+            player = batch.call(LeaderboardPlayer.fetch, ctx.author)
 
-        # Events Data
-        player = await LeaderboardPlayer.fetch(con, ctx.author)
-
-        view = ProfileView(ctx.author, clan_data, player) # type: ignore (Dm messages intents is disabled, author will be a member)
+        view = ProfileView(ctx.author, clan_data.result, player.result) # type: ignore (Dm messages intents is disabled, author will be a member)
         await ctx.send(embed=view.format_user_info(), view=view)
 
 
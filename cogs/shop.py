@@ -7,20 +7,22 @@ from context import BBContext
 from datetime import timedelta
 from discord.ext import commands
 from typing import Dict, List, Optional, Union
+from utils import queries
 from utils.checks import spam_channel_only, is_event_coord, is_beta_tester
 from utils.constants import COINS, TICKET
 from utils.converters import TimeConverter
 from utils.levels import LeaderboardPlayer
+from utils.shutdown import InFlight
 from utils.views import Confirm, EmbedViewPagination
 
 
 TABLE_CURRENCY = 'events.currency'
 TABLE_SHOP = 'events.shop'
-TABLE_SHOP_LOG = 'events.shop_log'
 CURRENCY_EMOJI = {
     'tickets': TICKET,
     'event coins': COINS
 }
+TRANSACTIONS = InFlight() # purchases in progress, waited for on shutdown
 
 
 class ShopItem:
@@ -67,19 +69,17 @@ class ShopSelect(discord.ui.Select):
         else:
             raise ValueError(f'Invalid currency: {item.currency} for item: {item.name} with ID: {item.id}')
 
-        async with self.view.bot.pool.acquire() as con:
+        async with TRANSACTIONS, self.view.bot.pool.acquire() as con:
             con: asyncpg.Connection
 
             async with con.transaction():
 
                 if item.cooldown:
                     last_bought_item = discord.utils.utcnow() + timedelta(seconds=item.cooldown)
-                    query = f'SELECT EXISTS (SELECT FROM {TABLE_SHOP_LOG} WHERE user_id = $1 and item_id = $2 and time < $3)'
-                    if await con.fetchval(query, self.view.player.user.id, item.id, last_bought_item):
+                    if await queries.SHOP_BOUGHT_RECENTLY.fetchval(con, self.view.player.user.id, item.id, last_bought_item):
                         return await interaction.response.send_message(f'You can not buy this item again so soon.')
 
-                query = f'INSERT INTO {TABLE_SHOP_LOG}(user_id, item_id, price, time, item_name, item_amount, currency_used) VALUES($1, $2, $3, $4, $5, $6, $7)'
-                await con.execute(query, self.view.player.user.id, item.id, item.price, discord.utils.utcnow(), item.name, item.amount, item.currency) 
+                await queries.SHOP_BUY.execute(con, self.view.player.user.id, item.id, item.price, discord.utils.utcnow(), item.name, item.amount, item.currency) 
                 # tickets and coins are subtracted automatically and stock is updated via triggers
                 # Event Coins are also transffered via the same if bought
 
@@ -98,11 +98,9 @@ class Shop(EmbedViewPagination):
             
     @classmethod
     async def fetch_with_items(cls, user: Union[discord.Member, discord.User], bot: BunkerBot) -> Shop:
-        async with bot.pool.acquire() as con:
+        async with bot.pool.acquire() as con: # the balance the purchase is checked against, never behind a purchase just made
             player = await LeaderboardPlayer.fetch(con, user)
-            query = f'SELECT id, name, description, emoji, price, currency, stock, minimum_level, cooldown, amount FROM {TABLE_SHOP} ORDER BY price'
-
-            rows = await con.fetch(query)
+            rows = await queries.SHOP_ITEMS.fetch(con)
             items = [ShopItem(**dict(row)) for row in rows]
 
         return cls(player, bot, items)
@@ -172,6 +170,10 @@ class ShopItemUpdateFlags(commands.FlagConverter, delimiter=' ', prefix='-'):
 class shop(commands.Cog):
     def __init__(self, bot: BunkerBot) -> None:
         self.bot = bot
+        bot.add_drain_hook('shop.transactions', TRANSACTIONS.wait, budget=10)
+
+    def cog_unload(self) -> None:
+        self.bot.remove_drain_hook('shop.transactions')
 
     @commands.group(invoke_without_command=True)
     @spam_channel_only()
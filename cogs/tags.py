@@ -8,6 +8,7 @@ from bot import BunkerBot
 from context import BBContext
 from discord.ext import commands
 from typing import Dict, List, Optional, Union
+from utils import queries
 from utils.checks import is_staff_or_support
 from utils.views import Confirm, EmbedViewPagination
 
@@ -66,9 +67,8 @@ class TagButton(discord.ui.Button):
         tag = self.view.tags.get(self.tag_id)
         embed = None
         if not tag:
-            async with self.view.bot.pool.acquire() as con:
-                query = f'SELECT content, embed FROM {TABLE_CONTENT} WHERE id = $1'
-                tag = await con.fetchrow(query, self.tag_id)
+            async with self.view.bot.pool_for(readonly=True).acquire() as con:
+                tag = await queries.TAG_CONTENT.fetchrow(con, self.tag_id)
                 
             if not tag:
                 self.view.tags[self.tag_id] = tag = {'content': f'Data for Tag ID: {self.tag_id} not found. Please contact a staff member', 'embed': None}
@@ -111,9 +111,8 @@ class TagSelect(discord.ui.Select):
         embed = None
         tag = self.view.tags.get(tag_id)
         if not tag:
-            async with self.view.bot.pool.acquire() as con:
-                query = f'SELECT content, embed FROM {TABLE_CONTENT} WHERE id = $1'
-                tag = await con.fetchrow(query, tag_id)
+            async with self.view.bot.pool_for(readonly=True).acquire() as con:
+                tag = await queries.TAG_CONTENT.fetchrow(con, tag_id)
                 
             if not tag:
                 self.view.tags[tag_id] = tag = {'content': f'Data for Tag ID: {tag_id} not found. Please contact a staff member', 'embed': None}
@@ -289,10 +288,8 @@ class tags(commands.Cog):
             else:
                 await ctx.send(f'Could not find the tag {name}')
 
-        query = f'SELECT tags.get_tag($1)'
-        con = await ctx.get_connection()
-
-        row = await con.fetchrow(query, name)
+        con = await ctx.get_connection(readonly=True)
+        row = await queries.TAG.fetchrow(con, name)
         if not row:
             return await ctx.send(f'No tag named **{name}** found.')
 
@@ -676,9 +673,8 @@ class tags(commands.Cog):
         A command to list all available tags.
         """
         
-        con = await ctx.get_connection()
-        query = f'SELECT name, id FROM {TABLE_NAMES} ORDER BY name'
-        rows = await con.fetch(query)
+        con = await ctx.get_connection(readonly=True)
+        rows = await queries.TAG_NAMES.fetch(con)
         view = TagsListPages(rows, ctx.author.id)
         await view.start(ctx.channel)
 
@@ -5,24 +5,50 @@ import discord
 
 from discord.ext import commands
 from typing import Optional, TYPE_CHECKING
+from utils.batch import QueryBatch
 
 if TYPE_CHECKING:
     from bot import BunkerBot
+    from utils.timing import DBTimer
 
 
 class BBContext(commands.Context):
     bot: BunkerBot
     con: Optional[asyncpg.Connection] = None
+    readonly: bool = False # if con is a connection to the read replica
+    invoked_at: Optional[float] = None
+    db_timer: Optional[DBTimer] = None
     
-    async def get_connection(self) -> asyncpg.Connection:
-        if not self.con or self.con.is_closed: # TODO check if released con evals to be true
-            self.con = await self.bot.pool.acquire()
+    async def get_connection(self, *, readonly: bool = False) -> asyncpg.Connection:
+        """
+        Returns the connection of the command, acquiring it on first use. With readonly the connection may be one to
+        the read replica, which can be behind the primary by up to the replica's max lag. A command that already holds
+        a primary connection keeps using it, one holding a replica connection swaps it for a primary one once it
+        asks for a connection it can write with.
+        """
+        if self.con is not None and not self.bot.connections.holds(self.con):
+            self.con = None # reclaimed by the watchdog and already back in the pool, the proxy raises on every use
+        if self.con is not None and (self.con.is_closed() or (self.readonly and not readonly)):
+            await self.release_connection()
+
+        if self.con is None:
+            holder = self.command.qualified_name if self.command else 'unknown'
+            pool = self.bot.pool_for(readonly=readonly)
+            self.readonly = pool is not self.bot.pool
+            self.con = await self.bot.connections.acquire(pool, holder, role='replica' if self.readonly else 'primary')
         
-        return self.con # type: ignore
+        return self.con
     
     async def release_connection(self) -> None:
-        if self.con:
-            await self.bot.pool.release(self.con)
+        if self.con is not None:
+            con, self.con = self.con, None
+            await self.bot.connections.release(con)
+
+    def batch(self, *, readonly: bool = False) -> QueryBatch:
+        """
+        Returns a batch to run independent queries together, see :class:`utils.batch.QueryBatch`
+        """
+        return QueryBatch(self, readonly=readonly)
 
     async def tick(self, value: bool = True) -> None:
         reaction = '\N{WHITE HEAVY CHECK MARK}' if value else '\N{CROSS MARK}'
@@ -5,6 +5,7 @@ import logging
 from bot import BunkerBot
 from configparser import ConfigParser
 from utils import logs
+from utils.timing import TimedConnection
 
 try:
     import uvloop
@@ -27,13 +28,33 @@ def run_bot():
     loop = asyncio.get_event_loop()
 
     psql = config['postgreSQL']
-    pool = loop.run_until_complete(asyncpg.create_pool(database=psql['name'], user=psql['user'], password=psql['password']))
+    connect_kwargs = dict(database=psql['name'], user=psql['user'], password=psql['password'])
+    pool = loop.run_until_complete(asyncpg.create_pool(**connect_kwargs, connection_class=TimedConnection))
 
     if not pool:
         raise RuntimeError('Connection pool not acquired. Terminating connection...')
 
-    bot = BunkerBot()
+    read_pool = None
+    if config.has_section('replica'): # a streaming replica read-only commands are routed to
+        replica = config['replica']
+        replica_kwargs = dict(
+            host=replica['host'],
+            port=replica.getint('port', fallback=5432),
+            database=replica.get('name', psql['name']),
+            user=replica.get('user', psql['user']),
+            password=replica.get('password', psql['password']),
+        )
+        read_pool = loop.run_until_complete(asyncpg.create_pool(**replica_kwargs, connection_class=TimedConnection))
+
+    bot = BunkerBot(
+        chunk_mode=config.get('discord', 'chunk_mode', fallback='startup'), # type: ignore
+        metrics_port=config.getint('metrics', 'port', fallback=None), # type: ignore
+        recording_dir=config.get('recording', 'directory', fallback=None), # records the gateway traffic for benchmarks.replay
+    )
     bot.pool = pool
+    bot.read_pool = read_pool
+    bot.replica.max_lag = config.getfloat('replica', 'max_lag', fallback=bot.replica.max_lag)
+    bot.connect_kwargs = connect_kwargs
     bot.logger = logger
 
     bot.load_extension('jishaku')
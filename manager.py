@@ -1,52 +1,258 @@
 import asyncpg
 import discord
+import gc
+import io
 import os
 import psutil
+import threading
+import tracemalloc
 
 from bot import BunkerBot
 from context import BBContext
-from discord.ext import commands
+from datetime import timedelta
+from discord.ext import commands, tasks
+from typing import Dict, Optional, Tuple
+from utils.census import AllocationTracker, view_census
+from utils.profiler import SamplingProfiler
+from utils.queries import catalog
 
 
 TABLE_BLACKLIST = 'extras.blacklist'
+CPU_INTERVAL = 15.0
 
 
 class manager(commands.Cog):
     def __init__(self, bot: BunkerBot) -> None:
         self.bot = bot
         self.process = psutil.Process(os.getpid())
+        self.allocations = AllocationTracker()
+        bot.metrics.gauge('process_memory_bytes', 'Memory used by the bot process', labels=('type',), collect=self._memory)
+        self.cpu = bot.metrics.gauge('process_cpu_percent', f'CPU used by the bot process over the last {CPU_INTERVAL:.0f} seconds')
+        self.cpu_task.start()
 
         for filename in os.listdir('cogs'):  # loads all the cogs in cogs folder
             if not filename.startswith('_') and filename.endswith('.py'):
                 self.bot.load_extension(f"cogs.{filename[:-3]}")
 
     def cog_unload(self) -> None:
+        self.cpu_task.cancel()
+        self.allocations.stop()
         for filename in os.listdir('cogs'):  # unloads all the cogs in cogs folder
             if not filename.startswith('_') and filename.endswith('.py'):
                 self.bot.unload_extension(f"cogs.{filename[:-3]}")
 
+    def _memory(self) -> Dict[Tuple[str], float]:
+        usage = self.process.memory_full_info()
+        return {('rss',): usage.rss, ('vms',): usage.vms, ('uss',): usage.uss}
+
+    @tasks.loop(seconds=CPU_INTERVAL)
+    async def cpu_task(self) -> None:
+        """
+        Samples the CPU usage on a fixed interval, so the gauge does not depend on when it is scraped or read. The
+        first sample only starts the measurement and reads 0
+        """
+        self.cpu.set(self.process.cpu_percent() / psutil.cpu_count())
+
     @commands.command()
     @commands.has_guild_permissions(administrator=True)
     async def usage(self, ctx: BBContext) -> None:
+        metrics = self.bot.metrics
 
-        uptime = discord.utils.utcnow() - self.bot.on_time
+        uptime = timedelta(seconds=metrics.value('uptime_seconds'))
         days = uptime.days
         hours, rem = divmod(uptime.seconds, 3600)
         minutes, _ = divmod(rem, 60)
 
-        usage = self.process.memory_full_info()
-        rss = usage.rss / 1024**2
-        vms = usage.vms / 1024**2
-        uss = usage.uss / 1024**2
-        cpu = self.process.cpu_percent() / psutil.cpu_count()
+        memory = metrics.values('process_memory_bytes')
+        rss = memory[('rss',)] / 1024**2
+        vms = memory[('vms',)] / 1024**2
+        uss = memory[('uss',)] / 1024**2
+        cpu = metrics.value('process_cpu_percent')
+        commands_used = sum(metrics.values('commands_total').values())
 
         embed = discord.Embed(title='Usage')
-        embed.add_field(name='Bot', value=f'Bunker code asked: {self.bot.times_code_is_asked}\nUptime: {days} days {hours} hours {minutes} minutes')
-        embed.add_field(name='Discord', value=f'ws latency: {self.bot.latency:.2f}')
+        embed.add_field(name='Bot', value=f'Bunker code asked: {metrics.value("code_asked_total"):.0f}\nCommands used: {commands_used:.0f}\nUptime: {days} days {hours} hours {minutes} minutes')
+        embed.add_field(name='Discord', value=f'ws latency: {metrics.value("websocket_latency_seconds"):.2f}\nmessages: {metrics.value("messages_total"):.0f}')
         embed.add_field(name='Process', value=f'{cpu:.2f}% CPU\n{uss:.2f} mb (uss)\n{rss:.2f} mb(rss)\n{vms:.2f} mb (vms)')
 
+        stages = '\n'.join(
+            f'{name}: {h.count} msgs, avg {h.sum / h.count * 1000 if h.count else 0:.2f} ms, p95 {h.quantile(0.95) * 1000:.2f} ms' # type: ignore
+            for (name,), h in metrics.get('message_stage_seconds').children()
+        )
+        embed.add_field(name='Message Pipeline', value=stages or 'No messages yet', inline=False)
+
+        wait = self.bot.pool_wait
+        embed.add_field(name='Database', value=f'pool wait p50 {wait.quantile(0.5) * 1000:.2f} ms, p95 {wait.quantile(0.95) * 1000:.2f} ms\n{self.bot.connections.summary()}\n{self.bot.replica.summary()}\nxp backlog: {metrics.value("xp_backlog_users"):.0f} users', inline=False)
+        embed.add_field(name='Member Lookups', value=self.bot.lookup_stats.summary(), inline=False)
+        embed.add_field(name='Outbound Messages', value=self.bot.outbound.summary(), inline=False)
+
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def timings(self, ctx: BBContext, *, handler: Optional[str] = None) -> None:
+        """
+        Shows the slowest commands and listeners over the last 5 minutes, or only those whose name contains handler
+        """
+        rows = [
+            (stats, summary) for stats, summary in self.bot.handler_timings.summaries()
+            if handler is None or handler.lower() in stats.name.lower()
+        ]
+        rows.sort(key=lambda row: row[1]['p95'], reverse=True)
+
+        lines = [f'{"handler":<32} {"calls":>5} {"p50":>7} {"p95":>7} {"p99":>7} {"err":>5} {"db":>4}']
+        for stats, summary in rows[:15]:
+            lines.append(
+                f'{stats.name[:32]:<32} {summary["count"]:>5.0f} {summary["p50"] * 1000:>5.0f}ms {summary["p95"] * 1000:>5.0f}ms '
+                f'{summary["p99"] * 1000:>5.0f}ms {summary["error_rate"] * 100:>4.0f}% {summary["db_share"] * 100:>3.0f}%'
+            )
+
+        if len(lines) == 1:
+            return await ctx.send('No calls in the last 5 minutes.')
+        await ctx.send('```\n' + '\n'.join(lines) + '```')
+
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def rest(self, ctx: BBContext) -> None:
+        """
+        Shows which cogs and commands make the most Discord API requests and the routes waiting on rate limits
+        """
+        rest = self.bot.rest
+
+        embed = discord.Embed(title='Discord REST', description=rest.summary())
+        origins = '\n'.join(f'{count} `{origin}`' for origin, count in rest.origins().most_common(10))
+        embed.add_field(name='Top Origins', value=origins or 'None', inline=False)
+        consumers = '\n'.join(f'{count} `{origin}` {route}' for origin, route, count in rest.top(10))
+        embed.add_field(name='Top Consumers', value=consumers or 'None', inline=False)
+
+        routes = sorted(rest.routes.items(), key=lambda route: route[1].waited, reverse=True)[:10]
+        lines = '\n'.join(
+            f'{stats.requests} reqs, {stats.rate_limited} 429s, waited {stats.waited:.2f}s, {stats.errors} errors: {route}'
+            for route, stats in routes if stats.waited or stats.rate_limited
+        )
+        embed.add_field(name='Rate Limited Routes', value=lines or 'None', inline=False)
+
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def queries(self, ctx: BBContext) -> None:
+        """
+        Shows the queries of the catalog that took the most time in total since the bot started
+        """
+        lines = [f'{"query":<24} {"calls":>7} {"avg":>8} {"p95":>8} {"total":>8}']
+        latency = dict(catalog.latency.children()) if catalog.latency else {}
+        for query in catalog.stats()[:15]:
+            p95 = latency[(query.name,)].quantile(0.95) if (query.name,) in latency else 0.0 # type: ignore
+            lines.append(f'{query.name[:24]:<24} {query.calls:>7} {query.elapsed / query.calls * 1000:>6.2f}ms {p95 * 1000:>6.2f}ms {query.elapsed:>7.1f}s')
+
+        if len(lines) == 1:
+            return await ctx.send('No catalog queries ran yet.')
+        await ctx.send('```\n' + '\n'.join(lines) + '```')
+
+    @commands.group(invoke_without_command=True)
+    @commands.is_owner()
+    async def profiler(self, ctx: BBContext) -> None:
+        await ctx.send_help(ctx.command)
+
+    @profiler.command(name='cpu')
+    @commands.is_owner()
+    @commands.max_concurrency(1)
+    async def profiler_cpu(self, ctx: BBContext, seconds: int = 30) -> None:
+        """
+        Samples the event loop thread for the given seconds and attaches the collapsed stacks for a flamegraph
+        """
+        if not 1 <= seconds <= 300:
+            return await ctx.send('Profile between 1 and 300 seconds.')
+
+        await ctx.tick()
+        profile = await SamplingProfiler(self.bot.loop, threading.get_ident()).run(seconds) # commands run on the loop thread
+
+        embed = discord.Embed(title=f'CPU profile ({profile.duration:.1f}s, {profile.samples} samples, {profile.interval * 1000:.1f} ms interval)')
+        tasks = '\n'.join(f'{share * 100:5.1f}% {spent:6.2f}s `{name[:80]}`' for name, spent, share in profile.task_times())
+        embed.add_field(name='Coroutines', value=tasks or 'No samples', inline=False)
+        hottest = '\n'.join(f'{count / profile.samples * 100:5.1f}% `{name[:80]}`' for name, count in profile.hottest())
+        embed.add_field(name='On top of the stack', value=hottest or 'No samples', inline=False)
+
+        file = discord.File(io.BytesIO(profile.collapsed().encode('utf-8')), filename=f'profile-{int(discord.utils.utcnow().timestamp())}.folded')
+        await ctx.send(embed=embed, file=file)
+
+    @commands.group(invoke_without_command=True)
+    @commands.is_owner()
+    async def memory(self, ctx: BBContext) -> None:
+        """
+        Shows the live views per class and the size of every registered cache
+        """
+        views, rows = await self.bot.loop.run_in_executor(None, view_census)
+
+        embed = discord.Embed(title='Memory Census')
+        lines = '\n'.join(f'{count} `{name}`' + (f' ({rows[name]} rows)' if rows[name] else '') for name, count in views.most_common(10))
+        embed.add_field(name=f'Live Views ({sum(views.values())})', value=lines or 'None', inline=False)
+
+        caches = sorted(((name, size()) for name, size in self.bot.caches.items()), key=lambda cache: cache[1], reverse=True)
+        embed.add_field(name='Caches', value='\n'.join(f'{size} `{name}`' for name, size in caches) or 'None', inline=False)
+
+        if self.allocations.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            tracing = f'tracing, {current / 1024**2:.2f} mb traced, {peak / 1024**2:.2f} mb peak'
+        else:
+            tracing = 'not tracing'
+        embed.add_field(name='Python', value=f'{len(gc.get_objects())} objects tracked by gc\ntracemalloc {tracing}', inline=False)
+
+        await ctx.send(embed=embed)
+
+    @memory.command(name='start')
+    @commands.is_owner()
+    async def memory_start(self, ctx: BBContext) -> None:
+        """
+        Starts tracing allocations and takes the baseline to diff against
+        """
+        await self.bot.loop.run_in_executor(None, self.allocations.start)
+        await ctx.tick()
+
+    @memory.command(name='diff')
+    @commands.is_owner()
+    async def memory_diff(self, ctx: BBContext, limit: int = 10) -> None:
+        """
+        Shows the allocation sites that grew the most since the baseline
+        """
+        try:
+            stats = await self.bot.loop.run_in_executor(None, self.allocations.diff, min(limit, 25))
+        except RuntimeError as e:
+            return await ctx.send(str(e))
+
+        lines = '\n'.join(f'{stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7d} `{stat.traceback[0].filename.rsplit(os.sep, 2)[-1]}:{stat.traceback[0].lineno}`' for stat in stats)
+        await ctx.send(embed=discord.Embed(title='Allocations since baseline', description=lines or 'No change'))
+
+    @memory.command(name='stop')
+    @commands.is_owner()
+    async def memory_stop(self, ctx: BBContext) -> None:
+        self.allocations.stop()
+        await ctx.tick()
+
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def lag(self, ctx: BBContext) -> None:
+        """
+        Shows how late the event loop runs and where it was blocked the most
+        """
+        monitor = self.bot.loop_monitor
+        lag = monitor.lag
+
+        embed = discord.Embed(title='Event Loop')
+        if lag is not None:
+            embed.add_field(name='Lag', value=f'p50 {lag.quantile(0.5) * 1000:.2f} ms\np95 {lag.quantile(0.95) * 1000:.2f} ms\np99 {lag.quantile(0.99) * 1000:.2f} ms\nmax {monitor.max_lag * 1000:.2f} ms')
+
+        hotspots = '\n'.join(f'{count}x `{hotspot}`' for hotspot, count in monitor.hotspots.most_common(5))
+        embed.add_field(name=f'Stalls over {monitor.threshold}s', value=hotspots or 'None', inline=False)
+
+        if monitor.stalls:
+            stall = monitor.stalls[-1]
+            stack = ''.join(stall.stack)[-1000:]
+            embed.add_field(name=f'Last stall ({stall.blocked:.2f}s, <t:{int(stall.at)}:R>)', value=f'```py\n{stack}```', inline=False)
+
         await ctx.send(embed=embed)
-     
+
     @commands.command()
     @commands.has_guild_permissions(administrator=True)
     async def blacklist(self, ctx: BBContext, person: discord.Member, *, reason: str) -> None:
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import asyncpg
+
+from typing import Any, Awaitable, Callable, Generic, List, Optional, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from context import BBContext
+
+
+__all__ = (
+    'Pending',
+    'QueryBatch',
+)
+
+
+T = TypeVar('T')
+
+MAX_BORROWED = 3 # extra connections a single batch takes from the pool at most
+
+
+class Pending(Generic[T]):
+    """
+    A query added to a :class:`QueryBatch`, its result is available once the batch ran
+    """
+
+    __slots__ = ('func', 'args', '_result', '_done')
+
+    def __init__(self, func: Callable[..., Awaitable[T]], args: tuple) -> None:
+        self.func = func
+        self.args = args
+        self._result: Optional[T] = None
+        self._done = False
+
+    async def _run(self, con: asyncpg.Connection) -> None:
+        self._result = await self.func(con, *self.args)
+        self._done = True
+
+    @property
+    def result(self) -> T:
+        if not self._done:
+            raise RuntimeError('The batch this query belongs to has not run yet')
+        return self._result # type: ignore
+
+
+class QueryBatch:
+    """
+    Queries of a command that do not depend on each other, run together when the ``async with`` block exits instead
+    of one round trip after another. The first lane of queries runs on the command's connection, the others on
+    connections borrowed from the pool for the duration of the batch, which go back to the pool in the background
+    once their lane is done. Connections are only borrowed while the pool has some to spare, otherwise every query
+    runs on the command's connection in the order it was added.
+
+    Queries on borrowed connections do not see an open transaction of the command, batch only reads and writes that
+    do not depend on it. With readonly the batch runs on the read replica while it is in use, like
+    :meth:`BBContext.get_connection`.
+
+    .. code-block:: python
+
+        async with ctx.batch() as batch:
+            clan = batch.fetchrow(query, ctx.author.id)
+            player = batch.call(LeaderboardPlayer.fetch, ctx.author)
+
+        clan.result, player.result
+    """
+
+    def __init__(self, ctx: BBContext, *, readonly: bool = False) -> None:
+        self.ctx = ctx
+        self.readonly = readonly
+        self.pending: List[Pending[Any]] = []
+
+    def call(self, func: Callable[..., Awaitable[T]], *args: Any) -> Pending[T]:
+        """
+        Adds func(con, *args) to the batch
+        """
+        pending = Pending(func, args)
+        self.pending.append(pending)
+        return pending
+
+    def fetch(self, query: str, *args: Any) -> Pending[List[asyncpg.Record]]:
+        return self.call(lambda con: con.fetch(query, *args)) # pool connections are proxies, not asyncpg.Connection
+
+    def fetchrow(self, query: str, *args: Any) -> Pending[Optional[asyncpg.Record]]:
+        return self.call(lambda con: con.fetchrow(query, *args))
+
+    def fetchval(self, query: str, *args: Any) -> Pending[Any]:
+        return self.call(lambda con: con.fetchval(query, *args))
+
+    def execute(self, query: str, *args: Any) -> Pending[str]:
+        return self.call(lambda con: con.execute(query, *args))
+
+    async def run(self) -> None:
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        bot = self.ctx.bot
+        con = await self.ctx.get_connection(readonly=self.readonly)
+        pool = bot.read_pool if self.ctx.readonly else bot.pool # borrowed connections come from the same pool
+        borrow = min(len(pending) - 1, MAX_BORROWED, bot.connections.spare(pool))
+        bot.query_batches.labels('concurrent' if borrow else 'sequential').inc()
+
+        if not borrow:
+            return await self._lane(con, pending)
+
+        lanes = borrow + 1
+        holder = self.ctx.command.qualified_name if self.ctx.command else 'unknown'
+        results = await asyncio.gather(
+            self._lane(con, pending[0::lanes]),
+            *(self._borrowed_lane(pool, holder, pending[lane::lanes]) for lane in range(1, lanes)),
+            return_exceptions=True,
+        ) # every lane finishes before an error is raised, so no borrowed connection is left running a query
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _lane(self, con: asyncpg.Connection, queries: List[Pending[Any]]) -> None:
+        for query in queries:
+            await query._run(con)
+
+    async def _borrowed_lane(self, pool: asyncpg.Pool, holder: str, queries: List[Pending[Any]]) -> None:
+        connections = self.ctx.bot.connections
+        con = await connections.acquire(pool, holder, role='replica' if self.ctx.readonly else 'primary')
+        try:
+            await self._lane(con, queries)
+        finally:
+            connections.release_soon(con) # the results are ready, the batch does not wait for the pool's reset
+
+    async def __aenter__(self) -> QueryBatch:
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.run()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import asyncpg
+
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bot import BunkerBot
+
+
+__all__ = (
+    'CacheSync',
+)
+
+
+CHANNEL = 'bunkerbot_cache'
+RECONNECT_DELAY = 5.0
+MAX_RECONNECT_DELAY = 300.0
+
+# Payloads are '<cache>:<op>:<value>' where op is + (added), - (removed) or * (table truncated, reload everything)
+NOTIFY_FUNCTION = f'''
+CREATE OR REPLACE FUNCTION extras.cache_notify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':*:');
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':-:' || (to_jsonb(OLD) ->> TG_ARGV[1]));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':+:' || (to_jsonb(NEW) ->> TG_ARGV[1]));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+'''
+
+
+class SyncedCache(NamedTuple):
+    name: str
+    table: str
+    column: str
+    cast: Callable[[str], Any]
+
+
+class CacheSync:
+    """
+    Keeps set caches on the bot in sync with their tables. Triggers on the tables notify a dedicated connection
+    which is kept on LISTEN, and every notification is applied to the cache in place. If the connection is lost
+    the caches are fully reloaded through their preloads once it is back, as notifications may have been missed.
+
+    Every notification bumps the version of its cache. A preload whose cache changed version while it was fetching
+    loads again, so a result older than a notification never overwrites it.
+
+    A cache is registered under the name of the bot attribute holding it, which must also be the name of its preload.
+
+    Parameters
+    -----------
+    bot: BunkerBot
+        The bot whose caches are kept in sync
+    """
+
+    def __init__(self, bot: BunkerBot) -> None:
+        self.bot = bot
+        self.caches: Dict[str, SyncedCache] = {}
+        self._con: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self._installed = False
+        self._late = False # the first connection was made after warm_up stopped waiting for it
+        self._versions: Dict[str, int] = {}
+
+    def register(self, name: str, table: str, column: str, cast: Callable[[str], Any] = str) -> None:
+        """
+        Registers a set cache to be kept in sync
+
+        Parameters
+        -----------
+        name: str
+            Name of the bot attribute holding the cache
+        table: str
+            The table the cache is loaded from
+        column: str
+            The column holding the cached values
+        cast: Callable[[str], Any]
+            Converts a value from a notification to the type stored in the cache
+        """
+        self.caches[name] = SyncedCache(name, table, column, cast)
+
+    def version(self, name: str) -> int:
+        """
+        Returns a number that changes whenever the cache may have changed without its preload seeing it
+        """
+        return self._versions.get(name, 0)
+
+    def _bump(self, *names: str) -> None:
+        for name in names:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    async def start(self, *, timeout: float = 10.0) -> None:
+        """
+        Starts listening and waits up to timeout seconds for the first connection to be made
+        """
+        if self._task is None:
+            self._task = self.bot.loop.create_task(self._run())
+
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._late = True
+            self.bot.logger.warning('Cache sync did not connect within %ss, caches will sync once it does', timeout)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        if self._con and not self._con.is_closed():
+            await self._con.close()
+
+    def _triggers(self) -> Set[str]:
+        return {f'{cache.name}_cache_notify{suffix}' for cache in self.caches.values() for suffix in ('', '_truncate')}
+
+    async def _install(self, con: asyncpg.Connection) -> None:
+        """
+        Creates the notify function and triggers unless they already exist. DDL takes locks on the tables, so this
+        runs at most once per process and not on every reconnect.
+        """
+        if self._installed:
+            return
+
+        query = '''
+            SELECT tgname FROM pg_trigger
+            WHERE NOT tgisinternal AND tgrelid = ANY($1::text[]::regclass[])
+        '''
+        tables = list({cache.table for cache in self.caches.values()})
+        existing = {row['tgname'] for row in await con.fetch(query, tables)}
+        has_function = await con.fetchval("SELECT to_regproc('extras.cache_notify') IS NOT NULL")
+        if has_function and existing.issuperset(self._triggers()):
+            self._installed = True
+            return
+
+        async with con.transaction():
+            await con.execute(NOTIFY_FUNCTION)
+            for cache in self.caches.values():
+                trigger = f'{cache.name}_cache_notify'
+                await con.execute(f'DROP TRIGGER IF EXISTS {trigger} ON {cache.table}')
+                await con.execute(f'DROP TRIGGER IF EXISTS {trigger}_truncate ON {cache.table}')
+                await con.execute(f"CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {cache.table} FOR EACH ROW EXECUTE FUNCTION extras.cache_notify('{cache.name}', '{cache.column}')")
+                await con.execute(f"CREATE TRIGGER {trigger}_truncate AFTER TRUNCATE ON {cache.table} FOR EACH STATEMENT EXECUTE FUNCTION extras.cache_notify('{cache.name}', '{cache.column}')")
+        self._installed = True
+
+    async def _run(self) -> None:
+        delay = RECONNECT_DELAY
+        reconnect = False
+
+        while not self.bot.is_closed():
+            lost = asyncio.Event()
+            try:
+                self._con = await asyncpg.connect(**self.bot.connect_kwargs)
+                self._con.add_termination_listener(lambda _: lost.set())
+                await self._install(self._con)
+                await self._con.add_listener(CHANNEL, self._on_notification)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                if self._con and not self._con.is_closed():
+                    self._con.terminate() # closing would wait on a connection that may be broken
+
+                self.bot.logger.exception('Cache sync connection failed, retrying in %ss', delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+
+            delay = RECONNECT_DELAY
+            self._bump(*self.caches) # loads in flight may have missed changes made before this connection
+            self._connected.set()
+            if reconnect or self._late: # changes made while not listening were missed by the finished loads
+                self.bot.logger.info('Cache sync reconnected, reloading %s', ', '.join(self.caches))
+                await self.reload()
+
+            reconnect = True
+            await lost.wait()
+            self.bot.logger.warning('Cache sync connection lost')
+
+    async def reload(self, *names: str) -> None:
+        """
+        Fully reloads the given caches, or every synced cache if none are given, through their preloads
+        """
+        preloads = [self.bot.preloads[name] for name in (names or self.caches) if name in self.bot.preloads]
+        await asyncio.gather(*(self.bot._run_preload(preload) for preload in preloads))
+
+    def _on_notification(self, con: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        name, op, value = payload.split(':', 2)
+        cache = self.caches.get(name)
+        if cache is None:
+            return
+
+        self._bump(name)
+        if op == '*':
+            self.bot.loop.create_task(self.reload(name))
+            return
+
+        values = getattr(self.bot, name)
+        if op == '+':
+            values.add(cache.cast(value))
+        elif op == '-':
+            values.discard(cache.cast(value))
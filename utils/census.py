@@ -0,0 +1,88 @@
+import discord
+import gc
+import tracemalloc
+
+from collections import Counter
+from typing import List, Optional, Tuple
+
+
+__all__ = (
+    'view_census',
+    'AllocationTracker',
+)
+
+
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+def view_census() -> Tuple[Counter, Counter]:
+    """
+    Walks every object tracked by the garbage collector and returns the live views per class, and the amount of
+    rows the paginators among them hold per class
+    """
+    views: Counter = Counter()
+    rows: Counter = Counter()
+
+    for obj in gc.get_objects():
+        if isinstance(obj, discord.ui.View):
+            name = type(obj).__qualname__
+            views[name] += 1
+            pages = getattr(obj, '_data', None) # EmbedViewPagination keeps its data split into pages
+            if isinstance(pages, list):
+                rows[name] += sum(len(page) if isinstance(page, (list, tuple)) else 1 for page in pages)
+
+    return views, rows
+
+
+class AllocationTracker:
+    """
+    Diffs tracemalloc snapshots against a baseline. Tracing slows every allocation down, so it only runs between
+    :meth:`start` and :meth:`stop`.
+
+    Parameters
+    -----------
+    frames: int
+        Frames stored per allocation
+    """
+
+    def __init__(self, *, frames: int = 1) -> None:
+        self.frames = frames
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, file) for file in IGNORED_FILES])
+
+    def start(self) -> None:
+        """
+        Starts tracing if it is not already, and takes the baseline
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self.baseline = self._snapshot()
+
+    def diff(self, limit: int = 10) -> List[tracemalloc.StatisticDiff]:
+        """
+        Returns the allocation sites that grew the most since the baseline
+
+        Raises
+        -------
+        RuntimeError
+            No baseline was taken
+        """
+        if self.baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError('No baseline, start tracing first')
+
+        stats = self._snapshot().compare_to(self.baseline, 'lineno')
+        return stats[:limit]
+
+    def stop(self) -> None:
+        self.baseline = None
+        if self._started_tracing: # tracing started by someone else, e.g. PYTHONTRACEMALLOC, is left running
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import asyncpg
+import logging
+import time
+
+from typing import Dict, List, Optional, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.metrics import MetricsRegistry
+
+
+__all__ = (
+    'Lease',
+    'ConnectionTracker',
+)
+
+
+HELD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0)
+STACK_LIMIT = 8 # frames of the holding task logged for an overdue lease
+
+
+class Lease:
+    """
+    A pool connection acquired through :meth:`ConnectionTracker.acquire` and not released yet
+
+    Attributes
+    ------------
+    connection: asyncpg.Connection
+        The acquired connection
+    pool: asyncpg.Pool
+        The pool it has to go back to
+    holder: str
+        The command holding it
+    role: str
+        The pool it came from, primary or replica
+    acquired_at: float
+        time.monotonic() when it was acquired
+    task: Optional[asyncio.Task]
+        The task that acquired it
+    flagged: bool
+        If it was already logged as overdue
+    """
+
+    __slots__ = ('connection', 'pool', 'holder', 'role', 'acquired_at', 'task', 'flagged')
+
+    def __init__(self, connection: asyncpg.Connection, pool: asyncpg.Pool, holder: str, role: str) -> None:
+        self.connection = connection
+        self.pool = pool
+        self.holder = holder
+        self.role = role
+        self.acquired_at = time.monotonic()
+        self.task = asyncio.current_task()
+        self.flagged = False
+
+    @property
+    def held(self) -> float:
+        return time.monotonic() - self.acquired_at
+
+
+class ConnectionTracker:
+    """
+    Acquires and releases the connections commands hold for their whole invocation, and keeps track of who holds
+    which connection for how long. A watchdog logs the holder and stack of connections held longer than budget
+    seconds and, after reclaim_after seconds, releases them back to the pool so a stuck command cannot starve it.
+    A reclaimed connection raises InterfaceError if its holder uses it again, check :meth:`holds` before reusing one.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop the watchdog runs on
+    logger: logging.Logger
+        Overdue and reclaimed connections are logged here
+    budget: float
+        Seconds a connection can be held before it is flagged
+    reclaim_after: Optional[float]
+        Seconds after which a held connection is reclaimed, None to only flag it
+    interval: float
+        Seconds between two checks of the watchdog
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        logger: logging.Logger,
+        *,
+        budget: float = 60.0,
+        reclaim_after: Optional[float] = 600.0,
+        interval: float = 10.0,
+        ) -> None:
+        self.loop = loop
+        self.logger = logger
+        self.budget = budget
+        self.reclaim_after = reclaim_after
+        self.interval = interval
+        self.leases: Dict[int, Lease] = {} # id of the connection proxy
+        self.waiting = 0
+        self.pools: Dict[str, asyncpg.Pool] = {} # by role, the pools connections were acquired from
+        self._task: Optional[asyncio.Task] = None
+        self._releasing: Set[asyncio.Task] = set()
+
+    def register_metrics(self, metrics: MetricsRegistry) -> None:
+        self.wait = metrics.histogram('pool_acquire_seconds', 'Time commands waited for a pool connection')
+        self.held_time = metrics.histogram('pool_held_seconds', 'Time commands held a pool connection', labels=('command',), buckets=HELD_BUCKETS)
+        self.reclaimed = metrics.counter('pool_reclaimed_total', 'Connections taken back from commands holding them past the budget', labels=('command',))
+        metrics.gauge('pool_connections', 'Connections of the pools by state', labels=('pool', 'state'), collect=self._pool_sizes)
+        metrics.gauge('pool_waiting', 'Commands waiting for a pool connection', collect=lambda: self.waiting)
+        metrics.gauge('pool_overdue', 'Connections held by commands past the budget', collect=lambda: len(self.overdue()))
+
+    def _pool_sizes(self) -> Dict[tuple, float]:
+        sizes = {}
+        for role, pool in self.pools.items():
+            size, idle = pool.get_size(), pool.get_idle_size()
+            sizes.update({
+                (role, 'in_use'): size - idle,
+                (role, 'idle'): idle,
+                (role, 'max'): pool.get_max_size(),
+                (role, 'held_by_commands'): sum(lease.role == role for lease in self.leases.values()),
+            })
+        return sizes
+
+    async def acquire(self, pool: asyncpg.Pool, holder: str, *, role: str = 'primary') -> asyncpg.Connection:
+        self.pools[role] = pool
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            connection = await pool.acquire()
+        finally:
+            self.waiting -= 1
+            self.wait.observe(time.perf_counter() - start)
+
+        self.leases[id(connection)] = Lease(connection, pool, holder, role)
+        return connection
+
+    async def release(self, connection: asyncpg.Connection) -> None:
+        """
+        Releases the connection unless the watchdog already reclaimed it
+        """
+        lease = self.leases.pop(id(connection), None)
+        if lease is None:
+            return
+
+        self.held_time.labels(lease.holder).observe(lease.held)
+        await lease.pool.release(connection)
+
+    def release_soon(self, connection: asyncpg.Connection) -> None:
+        """
+        Releases the connection in a background task, for callers that should not wait for the reset the pool runs
+        on every connection it takes back
+        """
+        task = self.loop.create_task(self.release(connection))
+        self._releasing.add(task)
+        task.add_done_callback(self._released)
+
+    def _released(self, task: asyncio.Task) -> None:
+        self._releasing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error('Releasing a connection failed', exc_info=task.exception())
+
+    def holds(self, connection: asyncpg.Connection) -> bool:
+        """
+        If connection was acquired through the tracker and is still held, False once the watchdog reclaimed it
+        """
+        lease = self.leases.get(id(connection))
+        return lease is not None and lease.connection is connection
+
+    def spare(self, pool: asyncpg.Pool) -> int:
+        """
+        Connections pool can hand out right away without making anyone wait
+        """
+        in_use = pool.get_size() - pool.get_idle_size()
+        return max(pool.get_max_size() - in_use - self.waiting, 0)
+
+    def overdue(self) -> List[Lease]:
+        return [lease for lease in self.leases.values() if lease.held > self.budget]
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = self.loop.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._releasing:
+            await asyncio.gather(*self._releasing, return_exceptions=True)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for lease in self.overdue():
+                try:
+                    await self._check(lease)
+                except Exception:
+                    self.logger.exception('Checking the connection held by %s failed', lease.holder)
+
+    async def _check(self, lease: Lease) -> None:
+        if not lease.flagged:
+            lease.flagged = True
+            stack = ''
+            if lease.task is not None and not lease.task.done():
+                stack = ''.join(f'\n  {frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}' for frame in lease.task.get_stack(limit=STACK_LIMIT))
+            self.logger.warning('Connection held by %s for %.0fs, longer than %.0fs%s', lease.holder, lease.held, self.budget, stack)
+
+        if self.reclaim_after is not None and lease.held > self.reclaim_after:
+            self.leases.pop(id(lease.connection), None)
+            self.reclaimed.labels(lease.holder).inc()
+            self.held_time.labels(lease.holder).observe(lease.held)
+            self.logger.error('Reclaimed the connection held by %s for %.0fs', lease.holder, lease.held)
+            # with a query still running the reset fails, asyncpg then terminates the connection and the error
+            # is logged by _watch. The holder's query fails with a connection error instead of finishing.
+            await lease.pool.release(lease.connection, timeout=5)
+
+    def summary(self) -> str:
+        sizes = self._pool_sizes()
+        overdue = sorted(self.overdue(), key=lambda lease: lease.held, reverse=True)
+        holders = ''.join(f', {lease.holder} {lease.held:.0f}s' for lease in overdue[:3])
+        reclaimed = sum(child.value for _, child in self.reclaimed.children()) # type: ignore
+        pools = ''.join(
+            f'{role}: {sizes[(role, "in_use")]:.0f}/{sizes[(role, "max")]:.0f} in use, {sizes[(role, "held_by_commands")]:.0f} held by commands\n'
+            for role in self.pools
+        )
+        return f'{pools}{self.waiting} waiting, overdue: {len(overdue)}{holders}, reclaimed: {reclaimed:.0f}'
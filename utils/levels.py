@@ -1,5 +1,6 @@
 from __future__ import annotations
 from typing import Union
+from utils import queries
 import asyncpg
 import discord
 
@@ -42,13 +43,8 @@ class LeaderboardPlayer:
         return f'LeaderboardPlayer<id={self.user.id} xp={self.xp} coins={self.coins} tickets={self.tickets} level={self.level}>'
 
     @classmethod
-    async def fetch(cls, con: asyncpg.Connection, user: Union[discord.Member, discord.User]):
-        query = 'SELECT l.xp, c.level, c.tickets, c.coins \
-                 FROM events.leaderboard l \
-                 INNER JOIN events.currency c ON l.user_id = c.user_id \
-                 WHERE l.user_id = $1'
-
-        row = await con.fetchrow(query, user.id)
+    async def fetch(cls, con: asyncpg.Connection, user: Union[discord.Member, discord.User]) -> LeaderboardPlayer:
+        row = await queries.PLAYER.fetchrow(con, user.id)
         if row:
             return cls(
                 user,
@@ -64,9 +60,4 @@ class LeaderboardPlayer:
         if tickets == coins == 0:
             raise ValueError('You need to provide at least one: tickets or coins')
 
-        query = 'INSERT INTO events.currency(user_id, tickets, coins) \
-                 VALUES($1, $2, $3) \
-                 ON CONFLICT(user_id) DO UPDATE \
-                 SET tickets = coalesce(events.currency.tickets, 0) + $2, \
-                 coins = coalesce(events.currency.coins, 0) + $3'
-        return await con.execute(query, self.user.id, tickets, coins)
\ No newline at end of file
+        return await queries.ADD_CURRENCY.execute(con, self.user.id, tickets, coins)
\ No newline at end of file
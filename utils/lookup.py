@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+__all__ = (
+    'NegativeCache',
+    'SingleFlight',
+    'LookupStats',
+)
+
+
+T = TypeVar('T')
+
+
+class NegativeCache:
+    """
+    Remembers keys that were not found for ttl seconds. The oldest keys are evicted once maxsize is reached.
+
+    Parameters
+    -----------
+    ttl: float
+        Seconds a key is remembered for
+    maxsize: int
+        Maximum amount of keys remembered
+    """
+
+    __slots__ = ('ttl', 'maxsize', '_expiry')
+
+    def __init__(self, *, ttl: float = 3600.0, maxsize: int = 10_000) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expiry: OrderedDict[Hashable, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def __contains__(self, key: Hashable) -> bool:
+        expiry = self._expiry.get(key)
+        if expiry is None:
+            return False
+
+        if expiry < time.monotonic():
+            del self._expiry[key]
+            return False
+
+        return True
+
+    def add(self, key: Hashable) -> None:
+        self._expiry.pop(key, None)
+        self._expiry[key] = time.monotonic() + self.ttl
+
+        while len(self._expiry) > self.maxsize:
+            self._expiry.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        self._expiry.pop(key, None)
+
+
+class SingleFlight:
+    """
+    Makes concurrent calls for the same key share a single in-flight call
+    """
+
+    __slots__ = ('_calls',)
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Awaits func() or, if a call for key is already in flight, its result
+
+        Parameters
+        -----------
+        key: Hashable
+            Identifies the call
+        func: Callable[[], Awaitable[T]]
+            Returns the awaitable to run if no call for key is in flight
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # shielded so a cancelled caller does not cancel the call for everyone else waiting on it
+        return await asyncio.shield(future)
+
+
+class LookupStats(Counter):
+    """
+    Counters for member and user lookups. The keys used are cache_hit, negative_hit, coalesced, fetch and not_found.
+    """
+
+    def summary(self) -> str:
+        lookups = self['cache_hit'] + self['negative_hit'] + self['coalesced'] + self['fetch']
+        rate = (lookups - self['fetch']) / lookups * 100 if lookups else 0.0
+        return (
+            f'{lookups} lookups, {rate:.1f}% without a request\n'
+            f'cache: {self["cache_hit"]}, negative: {self["negative_hit"]}, shared: {self["coalesced"]}\n'
+            f'fetched: {self["fetch"]}, not found: {self["not_found"]}'
+        )
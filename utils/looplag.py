@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from collections import Counter, deque
+from typing import Deque, List, NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.metrics import Histogram, MetricsRegistry
+
+
+__all__ = (
+    'Stall',
+    'LoopMonitor',
+)
+
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stall(NamedTuple):
+    """
+    A stack of the loop thread captured while it was blocked
+
+    Attributes
+    ------------
+    at: float
+        time.time() when the stack was captured
+    blocked: float
+        Seconds the loop had been blocked for when the stack was captured
+    hotspot: str
+        The innermost frame of the bot's own code, or of any code if none of it is on the stack
+    stack: List[str]
+        The formatted stack, outermost frame first
+    """
+    at: float
+    blocked: float
+    hotspot: str
+    stack: List[str]
+
+
+def _hotspot(frames: traceback.StackSummary) -> str:
+    own = [f for f in frames if f.filename.startswith(ROOT) and f'{os.sep}site-packages{os.sep}' not in f.filename]
+    frame = (own or frames)[-1]
+    return f'{os.path.relpath(frame.filename, ROOT) if own else frame.filename}:{frame.lineno} {frame.name}'
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs a callback scheduled every interval seconds. A watchdog thread checks the
+    heartbeat left by that callback and, once the loop has not run it for threshold seconds, captures the stack of
+    the loop thread while it is still blocked. The stall is logged right away and added to stalls and hotspots by
+    the loop once it runs again, so they are only ever read and written from the loop's thread.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop to monitor
+    logger: logging.Logger
+        Stalls are logged here with their stack
+    interval: float
+        Seconds between two samples
+    threshold: float
+        Seconds the loop has to be blocked for its stack to be captured
+    history: int
+        Amount of stalls kept
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        logger: logging.Logger,
+        *,
+        interval: float = 0.25,
+        threshold: float = 0.5,
+        history: int = 50,
+        ) -> None:
+        self.loop = loop
+        self.logger = logger
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls: Deque[Stall] = deque(maxlen=history)
+        self.hotspots: Counter[str] = Counter()
+        self.max_lag = 0.0
+        self.lag: Optional[Histogram] = None
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def register_metrics(self, metrics: MetricsRegistry) -> None:
+        self.lag = metrics.histogram('loop_lag_seconds', 'How late the event loop ran a periodic callback', buckets=LAG_BUCKETS)
+        metrics.counter('loop_stalls_total', 'Times the event loop was blocked longer than the threshold', collect=lambda: sum(self.hotspots.values()))
+
+    def start(self) -> None:
+        """
+        Starts sampling, must be called from the loop's thread
+        """
+        if self._task is not None:
+            return
+
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = self.loop.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._thread:
+            await self.loop.run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    async def _sample(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+
+            lag = max(now - expected, 0.0)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.lag is not None:
+                self.lag.observe(lag)
+
+    def _watch(self) -> None:
+        captured = None # heartbeat of the stall already captured, a stall is captured once
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == captured:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread) # type: ignore
+            if frame is None:
+                continue
+
+            captured = beat
+            frames = traceback.extract_stack(frame)
+            stall = Stall(time.time(), blocked, _hotspot(frames), frames.format())
+            self.logger.warning('Event loop blocked for %.3fs at %s\n%s', blocked, stall.hotspot, ''.join(stall.stack))
+            try:
+                self.loop.call_soon_threadsafe(self._record, stall) # stalls and hotspots are only touched on the loop
+            except RuntimeError: # the loop was closed
+                return
+
+    def _record(self, stall: Stall) -> None:
+        self.stalls.append(stall)
+        self.hotspots[stall.hotspot] += 1
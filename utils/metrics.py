@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import abc
+import bisect
+import math
+
+from aiohttp import web
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+
+__all__ = (
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'MetricsRegistry',
+    'MetricsServer',
+)
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+Collector = Callable[[], Union[float, Dict[LabelValues, float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    """
+    Base of every metric. A metric without labels is used directly, one with labels through :meth:`labels`.
+
+    Parameters
+    -----------
+    name: str
+        Name of the metric
+    documentation: str
+        Help text of the metric
+    labels: Sequence[str]
+        Names of the labels
+    collect: Optional[Callable[[], Union[float, Dict[Tuple[str, ...], float]]]]
+        Called on every scrape to read the value, or a mapping of label values to value, from somewhere else
+        instead of keeping it in the metric
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, *, labels: Sequence[str] = (), collect: Optional[Collector] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.collect = collect
+        self._children: Dict[LabelValues, Metric] = {}
+
+    @abc.abstractmethod
+    def _child(self) -> Metric:
+        """
+        Returns a new child for a set of label values
+        """
+
+    def labels(self, *values: str) -> Metric:
+        """
+        Returns the child for the given label values, creating it if needed
+        """
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} expects labels {self.label_names}, got {values}') from None
+            child = self._children[values] = self._child()
+            return child
+
+    def children(self) -> Iterator[Tuple[LabelValues, Metric]]:
+        if not self.label_names:
+            yield (), self
+        else:
+            yield from self._children.items()
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, str, float]]:
+        """
+        Yields (suffix, label values, extra label, value) for every sample of the metric
+        """
+        if self.collect is not None:
+            collected = self.collect()
+            if isinstance(collected, dict):
+                for values, value in collected.items():
+                    yield '', values, '', value
+            else:
+                yield '', (), '', collected
+            return
+
+        for values, child in self.children():
+            yield '', values, '', child.value # type: ignore
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.label_names, values, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, **kwargs) -> None:
+        super().__init__(name, documentation, **kwargs)
+        self.value = 0.0
+
+    def _child(self) -> Counter:
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, **kwargs) -> None:
+        super().__init__(name, documentation, **kwargs)
+        self.value = 0.0
+
+    def _child(self) -> Gauge:
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class Histogram(Metric):
+    """
+    Counts observations in cumulative buckets, see :class:`Metric` for the parameters
+
+    Parameters
+    -----------
+    buckets: Sequence[float]
+        Upper bounds of the buckets, an infinite bucket is always added
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, *, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(name, documentation, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def _child(self) -> Histogram:
+        return Histogram(self.name, self.documentation, buckets=self.buckets[:-1])
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates the q quantile by interpolating linearly within the bucket it falls in
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, str, float]]:
+        for values, child in self.children():
+            cumulative = 0
+            for upper, count in zip(child.buckets, child.counts): # type: ignore
+                cumulative += count
+                yield '_bucket', values, f'le="{_format_value(upper)}"', cumulative
+            yield '_sum', values, '', child.sum # type: ignore
+            yield '_count', values, '', child.count # type: ignore
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the bot. Registering a metric that already exists returns the existing one, so cogs can
+    register their metrics again when they are reloaded.
+    """
+
+    def __init__(self, namespace: str = 'bunkerbot') -> None:
+        self.namespace = namespace
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, cls: type, name: str, documentation: str, **kwargs) -> Metric:
+        name = f'{self.namespace}_{name}'
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, documentation, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f'{name} is already registered as a {metric.kind}')
+        elif 'collect' in kwargs:
+            metric.collect = kwargs['collect'] # a reloaded cog brings new bound methods
+        return metric
+
+    def counter(self, name: str, documentation: str, *, labels: Sequence[str] = (), collect: Optional[Collector] = None) -> Counter:
+        return self._register(Counter, name, documentation, labels=labels, collect=collect) # type: ignore
+
+    def gauge(self, name: str, documentation: str, *, labels: Sequence[str] = (), collect: Optional[Collector] = None) -> Gauge:
+        return self._register(Gauge, name, documentation, labels=labels, collect=collect) # type: ignore
+
+    def histogram(self, name: str, documentation: str, *, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labels=labels, buckets=buckets) # type: ignore
+
+    def get(self, name: str) -> Metric:
+        return self.metrics[f'{self.namespace}_{name}']
+
+    def values(self, name: str) -> Dict[LabelValues, float]:
+        """
+        Returns the current value of every sample of a counter or gauge by label values
+        """
+        return {values: value for _, values, _, value in self.get(name).samples()}
+
+    def value(self, name: str, *labels: str) -> float:
+        """
+        Returns the current value of a counter or gauge sample
+        """
+        return self.values(name).get(labels, 0.0)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text format
+        """
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class MetricsServer:
+    """
+    Serves a registry on /metrics
+
+    Parameters
+    -----------
+    registry: MetricsRegistry
+        The registry to serve
+    host: str
+        The address to bind, keep this local
+    port: int
+        The port to bind
+    """
+
+    def __init__(self, registry: MetricsRegistry, *, host: str = '127.0.0.1', port: int = 9100) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
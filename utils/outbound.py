@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import asyncio
+import discord
+import heapq
+import itertools
+import time
+
+from collections import Counter
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from utils.rest import REST_ORIGIN, current_origin
+
+
+__all__ = (
+    'Priority',
+    'Outbound',
+)
+
+
+T = TypeVar('T')
+
+# Discord allows 5 requests per 5 seconds on the per channel message routes. discord.py still handles the
+# actual 429s, this only decides which send goes first when a bucket is exhausted.
+BUCKET_RATE = 5
+BUCKET_PER = 5.0
+MAX_DEPTH = 25 # pending sends per bucket before cosmetic sends are dropped
+
+
+class Priority(IntEnum):
+    MODERATION = 0
+    STAFF = 1
+    REPLY = 2
+    COSMETIC = 3
+
+
+class OutboundSend:
+    __slots__ = ('priority', 'seq', 'func', 'future', 'merge_key', 'origin')
+
+    def __init__(self, priority: Priority, seq: int, func: Callable[[], Awaitable[Any]], future: asyncio.Future, merge_key: Optional[Hashable]) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.future = future
+        self.merge_key = merge_key
+        self.origin = current_origin() # the request is made from the queue's task, so it is tagged with the submitter
+
+    def __lt__(self, other: OutboundSend) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RouteQueue:
+    """
+    Pending sends for a single rate limit bucket, ordered by priority and then by age
+    """
+
+    __slots__ = ('heap', 'merges', 'tokens', 'updated', 'task')
+
+    def __init__(self) -> None:
+        self.heap: List[OutboundSend] = []
+        self.merges: Dict[Hashable, OutboundSend] = {}
+        self.tokens = float(BUCKET_RATE)
+        self.updated = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+    def delay(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(BUCKET_RATE, self.tokens + (now - self.updated) * BUCKET_RATE / BUCKET_PER)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * BUCKET_PER / BUCKET_RATE
+
+    def pop(self) -> OutboundSend:
+        send = heapq.heappop(self.heap)
+        if send.merge_key is not None:
+            self.merges.pop(send.merge_key, None)
+        return send
+
+
+class Outbound:
+    """
+    Schedules outbound messages. Every rate limit bucket, identified by channel and route, gets its own queue which
+    is drained in order of priority, so moderation output is not stuck behind replies to users when a channel is
+    busy. Once a queue is saturated cosmetic sends are dropped, and pending sends with the same merge key are
+    merged into the latest one.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop the queues are drained on
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, max_depth: int = MAX_DEPTH) -> None:
+        self.loop = loop
+        self.max_depth = max_depth
+        self.stats: Counter[str] = Counter()
+        self._queues: Dict[Tuple[int, str], RouteQueue] = {}
+        self._seq = itertools.count()
+
+    async def submit(
+        self,
+        channel_id: int,
+        priority: Priority,
+        func: Callable[[], Awaitable[T]],
+        *,
+        route: str = 'send',
+        merge_key: Optional[Hashable] = None,
+        ) -> Optional[T]:
+        """
+        Queues func() on the bucket of the channel and route and returns its result, or None if it was dropped
+
+        Parameters
+        -----------
+        channel_id: int
+            The channel the request is made to
+        priority: Priority
+            The priority class of the request
+        func: Callable[[], Awaitable[T]]
+            Makes the request
+        route: str
+            Name of the route within the channel, 'send' for new messages and 'edit' for message edits
+        merge_key: Optional[Hashable]
+            Pending requests with the same key are merged, only the latest one is made and every caller gets its result
+        """
+        key = (channel_id, route)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = RouteQueue()
+
+        if merge_key is not None and merge_key in queue.merges:
+            send = queue.merges[merge_key]
+            send.func = func
+            send.origin = current_origin()
+            if priority < send.priority:
+                send.priority = priority
+                heapq.heapify(queue.heap)
+            self.stats['merged'] += 1
+            return await asyncio.shield(send.future)
+
+        if len(queue.heap) >= self.max_depth:
+            if priority >= Priority.COSMETIC:
+                self.stats['dropped'] += 1
+                return None
+
+            # make room by dropping the newest cosmetic send, anything more important is always queued
+            cosmetic = [send for send in queue.heap if send.priority >= Priority.COSMETIC]
+            if cosmetic:
+                dropped = max(cosmetic, key=lambda send: send.seq)
+                queue.heap.remove(dropped)
+                heapq.heapify(queue.heap)
+                if dropped.merge_key is not None:
+                    queue.merges.pop(dropped.merge_key, None)
+                dropped.future.set_result(None)
+                self.stats['dropped'] += 1
+
+        send = OutboundSend(priority, next(self._seq), func, self.loop.create_future(), merge_key)
+        heapq.heappush(queue.heap, send)
+        if merge_key is not None:
+            queue.merges[merge_key] = send
+
+        if queue.task is None:
+            queue.task = self.loop.create_task(self._drain(key, queue))
+
+        # shielded so a cancelled caller does not cancel a send other callers were merged into
+        return await asyncio.shield(send.future)
+
+    async def send(
+        self,
+        channel: discord.abc.Messageable,
+        priority: Priority,
+        *args: Any,
+        merge_key: Optional[Hashable] = None,
+        **kwargs: Any,
+        ) -> Optional[discord.Message]:
+        """
+        Queues channel.send(*args, **kwargs), see :meth:`submit`
+        """
+        target = await channel._get_channel()
+        return await self.submit(target.id, priority, lambda: channel.send(*args, **kwargs), merge_key=merge_key)
+
+    async def _drain(self, key: Tuple[int, str], queue: RouteQueue) -> None:
+        send = None
+        try:
+            while queue.heap:
+                delay = queue.delay()
+                if delay:
+                    self.stats['bucket_waits'] += 1
+                    await asyncio.sleep(delay)
+                    continue # a more important send may have been queued in the meantime
+
+                send = queue.pop()
+                token = REST_ORIGIN.set(send.origin)
+                try:
+                    result = await send.func()
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    send.future.set_exception(e)
+                else:
+                    self.stats['sent'] += 1
+                    send.future.set_result(result)
+                finally:
+                    REST_ORIGIN.reset(token)
+        except asyncio.CancelledError:
+            for pending in [send, *queue.heap] if send else queue.heap:
+                if not pending.future.done():
+                    pending.future.cancel()
+            queue.heap.clear()
+            queue.merges.clear()
+            raise
+        finally:
+            queue.task = None
+            if not queue.heap:
+                del self._queues[key]
+
+    def depths(self) -> Counter[Priority]:
+        """
+        Returns the amount of pending sends per priority class
+        """
+        depths: Counter[Priority] = Counter()
+        for queue in self._queues.values():
+            depths.update(send.priority for send in queue.heap)
+        return depths
+
+    def pending(self) -> int:
+        return sum(len(queue.heap) for queue in self._queues.values())
+
+    async def join(self) -> str:
+        """
+        Waits until every pending send is made
+        """
+        pending = self.pending()
+        while True:
+            tasks = [queue.task for queue in self._queues.values() if queue.task]
+            if not tasks:
+                break
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return f'{pending} pending sends made'
+
+    def summary(self) -> str:
+        depths = self.depths()
+        busiest = max((len(queue.heap) for queue in self._queues.values()), default=0)
+        return (
+            f'queued: {" / ".join(str(depths[priority]) for priority in Priority)} (mod / staff / reply / cosmetic)\n'
+            f'busiest bucket: {busiest}, buckets: {len(self._queues)}\n'
+            f'sent: {self.stats["sent"]}, merged: {self.stats["merged"]}, dropped: {self.stats["dropped"]}, waits: {self.stats["bucket_waits"]}'
+        )
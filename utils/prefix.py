@@ -0,0 +1,47 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+
+__all__ = (
+    'PrefixResolver',
+)
+
+
+class PrefixResolver:
+    """
+    Matches command prefixes case insensitively. Prefixes are grouped by their first character so a message
+    that can not start with any prefix, which is most chat, is rejected with a single dict lookup.
+
+    Parameters
+    -----------
+    prefixes: Iterable[str]
+        The prefixes to match, case does not matter
+    """
+
+    __slots__ = ('prefixes', '_index')
+
+    def __init__(self, prefixes: Iterable[str]) -> None:
+        self.prefixes: Tuple[str, ...] = tuple(dict.fromkeys(prefix.lower() for prefix in prefixes))
+        self._index: Dict[str, Tuple[Tuple[int, str], ...]] = {}
+
+        for first in set(prefix[0] for prefix in self.prefixes):
+            candidates = sorted((p for p in self.prefixes if p[0] == first), key=len, reverse=True) # longest match wins
+            self._index[first] = tuple((len(p), p) for p in candidates)
+
+    def resolve(self, content: str) -> Optional[str]:
+        """
+        Returns the prefix as it is written in content or None if content does not start with a prefix
+
+        Parameters
+        -----------
+        content: str
+            The content of a message
+        """
+        candidates = self._index.get(content[:1].lower())
+        if candidates is None:
+            return None
+
+        for length, prefix in candidates:
+            if content[:length].lower() == prefix:
+                return content[:length]
+
+        return None
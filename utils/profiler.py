@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+from types import FrameType
+from typing import List, Optional, Tuple
+
+
+__all__ = (
+    'Profile',
+    'SamplingProfiler',
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NO_TASK = '(no task: loop idle or running callbacks)'
+MAX_DEPTH = 128
+
+
+def _own(filename: str) -> bool:
+    return filename.startswith(ROOT) and f'{os.sep}site-packages{os.sep}' not in filename
+
+
+def _label(frame: FrameType) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if _own(filename):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def _task_label(task: asyncio.Task, coroutine: Optional[str]) -> str:
+    # every discord.py event runs in a task of Client._run_event, so the innermost coroutine of the bot's own code
+    # on the sampled stack is what tells the events and listeners apart
+    label = coroutine or getattr(task.get_coro(), '__qualname__', repr(task.get_coro()))
+    name = task.get_name()
+    return label if name.startswith('Task-') else f'{name}: {label}' # only names given by whoever made the task
+
+
+class Profile:
+    """
+    The samples taken by a :class:`SamplingProfiler`
+
+    Attributes
+    ------------
+    duration: float
+        Seconds the profiler ran for
+    samples: int
+        Amount of samples taken
+    stacks: Counter[str]
+        Samples per stack, frames separated by ; from the outermost frame
+    tasks: Counter[str]
+        Samples per task running when the sample was taken, by the task's name and the innermost coroutine of the
+        bot's own code on the stack
+    """
+
+    __slots__ = ('duration', 'samples', 'stacks', 'tasks')
+
+    def __init__(self) -> None:
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self.tasks: Counter[str] = Counter()
+
+    @property
+    def interval(self) -> float:
+        return self.duration / self.samples if self.samples else 0.0
+
+    def collapsed(self) -> str:
+        """
+        Returns the stacks in the collapsed format flamegraph.pl and speedscope read
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def hottest(self, amount: int = 10) -> List[Tuple[str, int]]:
+        """
+        Returns the functions most often on top of the stack with their amount of samples
+        """
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(amount)
+
+    def task_times(self, amount: int = 10) -> List[Tuple[str, float, float]]:
+        """
+        Returns (task, seconds, share) for the tasks the loop spent most time running
+        """
+        return [(name, count * self.interval, count / self.samples) for name, count in self.tasks.most_common(amount)]
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the event loop's thread from another thread every interval seconds. Nothing is traced,
+    so the loop runs at full speed apart from the time the sampling thread holds the GIL.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop to profile
+    thread_id: int
+        Ident of the thread running the loop
+    interval: float
+        Seconds between two samples
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, *, interval: float = 0.01) -> None:
+        self.loop = loop
+        self.thread_id = thread_id
+        self.interval = interval
+
+    def _sample(self, profile: Profile) -> None:
+        frame: Optional[FrameType] = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        labels = []
+        coroutine = None
+        while frame is not None and len(labels) < MAX_DEPTH:
+            labels.append(_label(frame))
+            code = frame.f_code
+            if coroutine is None and code.co_flags & inspect.CO_COROUTINE and _own(code.co_filename):
+                coroutine = getattr(code, 'co_qualname', code.co_name)
+            frame = frame.f_back
+        labels.reverse()
+
+        task = asyncio.current_task(self.loop) # given the loop it only reads which task the loop is running
+
+        profile.samples += 1
+        profile.stacks[';'.join(labels)] += 1
+        profile.tasks[_task_label(task, coroutine) if task is not None else NO_TASK] += 1
+
+    def _run(self, duration: float, stop: threading.Event) -> Profile:
+        profile = Profile()
+        start = time.perf_counter()
+        deadline = start + duration
+
+        while not stop.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self._sample(profile)
+            stop.wait(self.interval)
+
+        profile.duration = time.perf_counter() - start
+        return profile
+
+    async def run(self, duration: float) -> Profile:
+        """
+        Samples for duration seconds on a separate thread and returns the result
+        """
+        stop = threading.Event()
+        future = self.loop.create_future()
+
+        def target() -> None:
+            try:
+                result = self._run(duration, stop)
+            except BaseException as e:
+                self.loop.call_soon_threadsafe(lambda e=e: future.done() or future.set_exception(e)) # e is unbound once the except block ends
+            else:
+                self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+        threading.Thread(target=target, name='profiler', daemon=True).start()
+        try:
+            return await future
+        finally:
+            stop.set()
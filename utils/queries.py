@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncpg
+import logging
+import time
+
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
+from utils.xp import TABLE_LEADERBOARD
+
+if TYPE_CHECKING:
+    from utils.metrics import Histogram, MetricsRegistry
+
+
+__all__ = (
+    'Query',
+    'QueryCatalog',
+    'catalog',
+)
+
+
+class Query:
+    """
+    A query of the catalog. Run it with the connection as the first argument,
+    ``await CLAN_OF_MEMBER.fetchrow(con, member_id)``. Queries run through asyncpg's statement cache, so a
+    connection prepares a query the first time it runs it and reuses the statement from then on, also after the
+    connection went back to the pool and was acquired again.
+
+    Attributes
+    ------------
+    name: str
+        Name of the query in the catalog and in the query_seconds metric
+    sql: str
+        The statement
+    calls: int
+        Times the query ran
+    elapsed: float
+        Seconds spent running it
+    """
+
+    __slots__ = ('name', 'sql', 'catalog', 'calls', 'elapsed')
+
+    def __init__(self, name: str, sql: str, catalog: QueryCatalog) -> None:
+        self.name = name
+        self.sql = sql
+        self.catalog = catalog
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def __repr__(self) -> str:
+        return f'<Query name={self.name!r} calls={self.calls}>'
+
+    async def _run(self, con: asyncpg.Connection, method: str, args: tuple) -> Any:
+        # the time is added to the handler's DBTimer by TimedConnection
+        start = time.perf_counter()
+        try:
+            return await getattr(con, method)(self.sql, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.calls += 1
+            self.elapsed += elapsed
+            if self.catalog.latency is not None:
+                self.catalog.latency.labels(self.name).observe(elapsed)
+
+    async def fetch(self, con: asyncpg.Connection, *args: Any) -> List[asyncpg.Record]:
+        return await self._run(con, 'fetch', args)
+
+    async def fetchrow(self, con: asyncpg.Connection, *args: Any) -> Optional[asyncpg.Record]:
+        return await self._run(con, 'fetchrow', args)
+
+    async def fetchval(self, con: asyncpg.Connection, *args: Any) -> Any:
+        return await self._run(con, 'fetchval', args)
+
+    async def execute(self, con: asyncpg.Connection, *args: Any) -> str:
+        return await self._run(con, 'execute', args)
+
+
+class QueryCatalog:
+    """
+    The queries declared with :meth:`add`. :meth:`check` prepares all of them once on boot, so a query the schema
+    no longer fits is logged right away instead of failing the first command that runs it.
+    """
+
+    def __init__(self) -> None:
+        self.queries: Dict[str, Query] = {}
+        self.latency: Optional[Histogram] = None
+        self.logger = logging.getLogger('bunkerbot')
+
+    def __iter__(self) -> Iterator[Query]:
+        return iter(self.queries.values())
+
+    def add(self, name: str, sql: str) -> Query:
+        if name in self.queries:
+            raise ValueError(f'A query named {name} is already in the catalog')
+        query = self.queries[name] = Query(name, sql, self)
+        return query
+
+    def register_metrics(self, metrics: MetricsRegistry) -> None:
+        self.latency = metrics.histogram('query_seconds', 'Time taken by the queries of the catalog', labels=('query',))
+
+    async def check(self, pool: asyncpg.Pool) -> List[str]:
+        """
+        Prepares every query on a connection of pool and returns the names of those that failed, which are logged.
+        The statements are not kept, asyncpg invalidates them once the connection goes back to the pool.
+        """
+        failed = []
+        async with pool.acquire() as con:
+            for query in self:
+                try:
+                    await con.prepare(query.sql)
+                except asyncpg.PostgresError as error:
+                    self.logger.warning('Query %s does not fit the schema: %s', query.name, error)
+                    failed.append(query.name)
+        return failed
+
+    def stats(self) -> List[Query]:
+        """
+        The queries that ran, those taking the most time in total first
+        """
+        return sorted((query for query in self if query.calls), key=lambda query: query.elapsed, reverse=True)
+
+
+catalog = QueryCatalog()
+
+# clans
+CLAN_OF_MEMBER = catalog.add('clan_of_member', '''
+    SELECT clan_name, description, banner_url, clan_role, clan_language, clan_tag FROM clans.clan_members
+    INNER JOIN clans.clan ON clan.clan_id = clan_members.clan_id WHERE member_id = $1
+''')
+
+# events
+PLAYER = catalog.add('player', f'''
+    SELECT l.xp, c.level, c.tickets, c.coins
+    FROM {TABLE_LEADERBOARD} l
+    INNER JOIN events.currency c ON l.user_id = c.user_id
+    WHERE l.user_id = $1
+''')
+ADD_CURRENCY = catalog.add('add_currency', '''
+    INSERT INTO events.currency(user_id, tickets, coins)
+    VALUES($1, $2, $3)
+    ON CONFLICT(user_id) DO UPDATE
+    SET tickets = coalesce(events.currency.tickets, 0) + $2,
+    coins = coalesce(events.currency.coins, 0) + $3
+''')
+LEADERBOARD_TOP = catalog.add('leaderboard_top', f'SELECT user_id, xp FROM {TABLE_LEADERBOARD} ORDER BY xp DESC LIMIT 100')
+GAME_TTL = catalog.add('game_ttl', 'SELECT time FROM events.game_ttl WHERE user_id = $1')
+GAME_TTL_ADD = catalog.add('game_ttl_add', 'INSERT INTO events.game_ttl(user_id, time) VALUES($1, $2)')
+GAME_TTL_DUE = catalog.add('game_ttl_due', 'SELECT user_id, time FROM events.game_ttl WHERE time < $1')
+GAME_TTL_REMOVE = catalog.add('game_ttl_remove', 'DELETE FROM events.game_ttl WHERE user_id = $1')
+GAME_SITUATIONS = catalog.add('game_situations', 'SELECT description, outcomes FROM events.situations WHERE game_id = $1 ORDER BY random() LIMIT $2')
+AUCTION_ITEM = catalog.add('auction_item', 'SELECT id, name, current_bet, minimum_increment, active_till, current_holder FROM events.auctions WHERE name = $1')
+AUCTION_ACTIVE = catalog.add('auction_active', 'SELECT id, name, current_bet, minimum_increment, active_till, current_holder FROM events.auctions WHERE active_till > $1')
+AUCTION_BET = catalog.add('auction_bet', '''
+    INSERT INTO events.auctions_log(user_id, item_id, bet_amount, time, item_name, old_bet, old_user_id)
+    VALUES($1, $2, $3, $4, $5, $6, $7)
+''')
+SHOP_ITEMS = catalog.add('shop_items', 'SELECT id, name, description, emoji, price, currency, stock, minimum_level, cooldown, amount FROM events.shop ORDER BY price')
+SHOP_BOUGHT_RECENTLY = catalog.add('shop_bought_recently', 'SELECT EXISTS (SELECT FROM events.shop_log WHERE user_id = $1 and item_id = $2 and time < $3)')
+SHOP_BUY = catalog.add('shop_buy', '''
+    INSERT INTO events.shop_log(user_id, item_id, price, time, item_name, item_amount, currency_used)
+    VALUES($1, $2, $3, $4, $5, $6, $7)
+''')
+
+# tags
+TAG = catalog.add('tag', 'SELECT tags.get_tag($1)')
+TAG_CONTENT = catalog.add('tag_content', 'SELECT content, embed FROM tags.content WHERE id = $1')
+TAG_NAMES = catalog.add('tag_names', 'SELECT name, id FROM tags.names ORDER BY name')
+
+# arts
+ARTS_RANDOM = catalog.add('arts_random', 'SELECT url, artist_name FROM extras.arts ORDER BY random() LIMIT 20')
+ARTS_BY_ARTIST = catalog.add('arts_by_artist', 'SELECT url, artist_name FROM extras.arts WHERE artist_id = $1 LIMIT 20')
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import os
+import re
+import time
+
+from collections import Counter
+from typing import Any, Collection, Dict, List, Optional, Pattern, Tuple
+
+
+__all__ = (
+    'RECORDED_EVENTS',
+    'Anonymizer',
+    'GatewayRecorder',
+    'read_recording',
+)
+
+
+RECORDING_VERSION = 1
+FLUSH_EVERY = 256 # events buffered before they are compressed and written on the writer thread
+USER_BASE = 10**17 # anonymized user ids are counted up from here in order of appearance
+
+# traffic the bot reacts to, READY and GUILD_CREATE are left out as they hold the whole guild
+RECORDED_EVENTS = frozenset({
+    'MESSAGE_CREATE',
+    'MESSAGE_UPDATE',
+    'MESSAGE_DELETE',
+    'MESSAGE_DELETE_BULK',
+    'MESSAGE_REACTION_ADD',
+    'MESSAGE_REACTION_REMOVE',
+    'GUILD_MEMBER_ADD',
+    'GUILD_MEMBER_REMOVE',
+    'GUILD_MEMBER_UPDATE',
+    'GUILD_BAN_ADD',
+    'INTERACTION_CREATE',
+})
+
+USER_KEYS = frozenset({'user', 'author'})
+USER_ID_KEYS = frozenset({'user_id', 'owner_id', 'author_id'})
+DROPPED_KEYS = {
+    'nick': None,
+    'avatar': None,
+    'banner': None,
+    'premium_since': None,
+    'token': 'replay',
+    'attachments': [],
+    'embeds': [],
+    'resolved': {}, # keyed by user id
+}
+
+# role and channel mentions and custom emojis are kept, user mentions are mapped
+MARKUP = re.compile(r'<(?:@&|#|a?:\w+:)\d+>|<@(?P<bang>!?)(?P<mention>\d{15,21})>')
+IDS = re.compile(MARKUP.pattern + r'|\b(?P<id>\d{15,21})\b')
+URL = re.compile(r'https?://\S+')
+WORD = re.compile(r'\S+')
+
+
+class Anonymizer:
+    """
+    Replaces user ids with ids counted up in order of appearance, and names, avatars, tokens, attachments and
+    embeds with placeholders. Message content is kept only if it matches one of the kept patterns, such as
+    commands, otherwise every word is masked while its length and any mention are kept. Guild, channel, role and
+    message ids are kept since the cogs refer to them.
+    """
+
+    def __init__(self) -> None:
+        self.users: Dict[int, int] = {}
+        self.kept: List[Pattern[str]] = []
+
+    def user_id(self, user_id: int) -> int:
+        mapped = self.users.get(user_id)
+        if mapped is None:
+            mapped = self.users[user_id] = USER_BASE + len(self.users)
+        return mapped
+
+    def user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = self.user_id(int(data['id']))
+        return {'id': str(user_id), 'username': f'user{user_id - USER_BASE}', 'discriminator': '0000', 'avatar': None, 'bot': data.get('bot', False)}
+
+    def _id(self, match: re.Match) -> str:
+        if match['mention']:
+            return f'<@{match["bang"]}{self.user_id(int(match["mention"]))}>'
+        if match.groupdict().get('id'):
+            return str(self.user_id(int(match['id']))) # ids passed to commands are users more often than not
+        return match[0]
+
+    @staticmethod
+    def _mask_text(text: str) -> str:
+        return re.sub(r'\d', '0', re.sub(r'[^\W\d]', 'x', text))
+
+    def _mask(self, match: re.Match) -> str:
+        word = match[0]
+        if URL.match(word):
+            return 'https://example.com'
+
+        parts = []
+        end = 0
+        for markup in MARKUP.finditer(word):
+            parts.append(self._mask_text(word[end:markup.start()]))
+            parts.append(self._id(markup))
+            end = markup.end()
+        parts.append(self._mask_text(word[end:]))
+        return ''.join(parts)
+
+    def content(self, content: str) -> str:
+        if any(pattern.search(content) for pattern in self.kept):
+            return IDS.sub(self._id, content)
+        return WORD.sub(self._mask, content)
+
+    def scrub(self, value: Any, key: Optional[str] = None) -> Any:
+        if isinstance(value, dict):
+            if key in USER_KEYS and 'id' in value:
+                return self.user(value)
+            return {k: self._field(k, v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.scrub(v, key) for v in value]
+        return value
+
+    def _field(self, key: str, value: Any) -> Any:
+        if value is None:
+            return None
+        if key in DROPPED_KEYS:
+            return DROPPED_KEYS[key]
+        if key in USER_ID_KEYS:
+            return str(self.user_id(int(value)))
+        if key == 'mentions':
+            return [self.user(user) for user in value]
+        if key == 'content':
+            return self.content(value)
+        return self.scrub(value, key)
+
+
+class GatewayRecorder:
+    """
+    Writes the gateway events the bot receives, anonymized, to a gzip compressed JSON lines file in directory.
+    The first line is a header, every other line is [seconds since the recording started, event, data].
+
+    Parameters
+    -----------
+    directory: str
+        Where the recordings are written, a new file is started on every boot
+    events: Collection[str]
+        The events recorded
+    """
+
+    def __init__(self, directory: str, *, events: Collection[str] = RECORDED_EVENTS) -> None:
+        self.directory = directory
+        self.events = events
+        self.anonymizer = Anonymizer()
+        self.recorded: Counter[str] = Counter()
+        self.path: Optional[str] = None
+        self._file: Optional[gzip.GzipFile] = None
+        self._buffer: List[str] = []
+        self._start = 0.0
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='recorder') # keeps the batches in order
+
+    def keep(self, pattern: Pattern[str]) -> None:
+        """
+        Keeps the content of messages matching pattern, so the replay triggers the same commands and stages
+        """
+        if pattern not in self.anonymizer.kept:
+            self.anonymizer.kept.append(pattern)
+
+    def start(self, bot_id: int) -> None:
+        """
+        Starts a new recording, does nothing if one is running
+        """
+        if self._file is not None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, time.strftime('gateway-%Y%m%d-%H%M%S.jsonl.gz'))
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8') # type: ignore
+        self._start = time.monotonic()
+        header = {'version': RECORDING_VERSION, 'bot_id': str(self.anonymizer.user_id(bot_id)), 'started': time.time()}
+        self._buffer.append(json.dumps(header))
+
+    def receive(self, msg: Any) -> None:
+        """
+        Records msg if it is one of the recorded dispatch events, called with every raw gateway message
+        """
+        if self._file is None:
+            return
+
+        payload = json.loads(msg)
+        event = payload.get('t')
+        if payload.get('op') != 0 or event not in self.events:
+            return
+
+        data = self.anonymizer.scrub(payload['d'])
+        self._buffer.append(json.dumps([round(time.monotonic() - self._start, 4), event, data], separators=(',', ':')))
+        self.recorded[event] += 1
+        if len(self._buffer) >= FLUSH_EVERY:
+            self._flush()
+
+    def _write(self, file: gzip.GzipFile, lines: List[str]) -> None:
+        file.write('\n'.join(lines) + '\n') # type: ignore
+
+    def _flush(self) -> Optional[concurrent.futures.Future]:
+        if not self._buffer or self._file is None:
+            return None
+        lines, self._buffer = self._buffer, []
+        return self._writer.submit(self._write, self._file, lines)
+
+    async def close(self) -> Optional[str]:
+        if self._file is None:
+            return None
+
+        file = self._file
+        future = self._flush()
+        self._file = None
+        if future is not None:
+            await asyncio.wrap_future(future)
+        await asyncio.wrap_future(self._writer.submit(file.close))
+        return f'{sum(self.recorded.values())} events recorded to {self.path}'
+
+
+def read_recording(path: str) -> Tuple[Dict[str, Any], List[List[Any]]]:
+    """
+    Returns the header and the [offset, event, data] entries of a recording
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        if header.get('version') != RECORDING_VERSION:
+            raise ValueError(f'Unsupported recording version {header.get("version")}')
+        return header, [json.loads(line) for line in file if line.strip()]
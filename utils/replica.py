@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import asyncpg
+import logging
+
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.metrics import MetricsRegistry
+
+
+__all__ = (
+    'ReplicaMonitor',
+)
+
+
+# seconds the replica's replay is behind the primary, 0 once it replayed everything it received, NULL if it is not
+# streaming from the primary. A server that is not in recovery is the primary or was promoted, so it is never behind.
+LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0.0
+        WHEN NOT EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0.0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8
+    END
+'''
+
+
+class ReplicaMonitor:
+    """
+    Checks how far the read replica is behind the primary every interval seconds. Reads are only routed to the
+    replica while it streams from the primary and is at most max_lag seconds behind, otherwise they go to the
+    primary until it caught up again.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop the checks run on
+    logger: logging.Logger
+        Replicas falling behind and catching up are logged here
+    max_lag: float
+        Seconds the replica can be behind and still be read from
+    interval: float
+        Seconds between two checks
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, logger: logging.Logger, *, max_lag: float = 2.0, interval: float = 5.0) -> None:
+        self.loop = loop
+        self.logger = logger
+        self.max_lag = max_lag
+        self.interval = interval
+        self.pool: Optional[asyncpg.Pool] = None
+        self.lag: Optional[float] = None # None until checked, or while the replica is unreachable or not streaming
+        self.healthy = False
+        self._task: Optional[asyncio.Task] = None
+
+    def register_metrics(self, metrics: MetricsRegistry) -> None:
+        metrics.gauge('replica_lag_seconds', 'Seconds the read replica is behind the primary, -1 if unknown', collect=lambda: -1.0 if self.lag is None else self.lag)
+        metrics.gauge('replica_healthy', 'If reads are routed to the read replica', collect=lambda: float(self.healthy))
+
+    async def check(self) -> None:
+        if self.pool is None:
+            return
+
+        try:
+            async with self.pool.acquire(timeout=self.interval) as con:
+                self.lag = await con.fetchval(LAG_QUERY, timeout=self.interval)
+        except (asyncio.TimeoutError, OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as error:
+            self.lag = None
+            self.logger.warning('Checking the read replica failed: %s', error)
+
+        healthy = self.lag is not None and self.lag <= self.max_lag
+        if healthy != self.healthy:
+            if healthy:
+                self.logger.info('Routing reads to the read replica, %.2fs behind', self.lag)
+            else:
+                self.logger.warning('Routing reads to the primary, the read replica is %s', 'not streaming' if self.lag is None else f'{self.lag:.2f}s behind')
+        self.healthy = healthy
+
+    def start(self, pool: asyncpg.Pool) -> None:
+        """
+        Starts checking pool, reads stay on the primary until the first check passed
+        """
+        self.pool = pool
+        if self._task is None:
+            self._task = self.loop.create_task(self._watch())
+
+    async def stop(self) -> None:
+        self.healthy = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                self.logger.exception('Read replica check failed')
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> str:
+        if self.pool is None:
+            return 'replica: not configured'
+        lag = 'unknown' if self.lag is None else f'{self.lag:.2f}s behind'
+        return f'replica: {"in use" if self.healthy else "not used"}, {lag} (max {self.max_lag:.1f}s)'
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import aiohttp
+import contextvars
+import functools
+import logging
+import os
+import sys
+import time
+
+from collections import Counter
+from types import FrameType, SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from discord.http import HTTPClient, Route
+    from utils.metrics import MetricsRegistry
+
+
+__all__ = (
+    'REST_ORIGIN',
+    'current_origin',
+    'tagged',
+    'RouteStats',
+    'RestAccounting',
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COGS = os.path.join(ROOT, 'cogs') + os.sep
+UTILS = os.path.join(ROOT, 'utils') + os.sep
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+UNTRACED_LIMIT = 20 # calls without a single traced HTTP attempt before tracing is reported as broken
+
+# cog:handler making the requests of the current task, set for commands and listeners
+REST_ORIGIN: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('REST_ORIGIN', default=None)
+
+
+class RestCall:
+    """
+    The HTTP attempts made for a single call of HTTPClient.request, a 429 is retried by discord.py
+    """
+
+    __slots__ = ('attempts', 'on_wire', 'rate_limited')
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        self.on_wire = 0.0
+        self.rate_limited = 0
+
+
+_CALL: contextvars.ContextVar[Optional[RestCall]] = contextvars.ContextVar('_CALL', default=None)
+
+
+def _frame_origin(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}'
+
+
+def current_origin() -> str:
+    """
+    Returns the origin of requests made now: the command or listener running, else the innermost cog function on
+    the stack, e.g. a view callback or a loop, else the innermost function of the bot's own code
+    """
+    origin = REST_ORIGIN.get()
+    if origin is not None:
+        return origin
+
+    fallback = None
+    frame: Optional[FrameType] = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(COGS):
+            return _frame_origin(frame)
+        if fallback is None and filename.startswith(ROOT) and not filename.startswith(UTILS) and f'{os.sep}site-packages{os.sep}' not in filename:
+            fallback = _frame_origin(frame)
+        frame = frame.f_back
+
+    return fallback or 'discord' # made by discord.py itself, e.g. chunking or the gateway
+
+
+class RouteStats:
+    """
+    The requests made to a route, identified by method and path template
+
+    Attributes
+    ------------
+    requests: int
+        Calls of the route, a call retried after a 429 counts once
+    rate_limited: int
+        429 responses
+    errors: int
+        Calls that raised, e.g. Forbidden or NotFound
+    elapsed: float
+        Seconds from the call until its result
+    waited: float
+        Seconds of elapsed not spent on a request, waiting for the bucket, a global rate limit or a retry
+    """
+
+    __slots__ = ('requests', 'rate_limited', 'errors', 'elapsed', 'waited')
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.waited = 0.0
+
+
+class RestAccounting:
+    """
+    Counts the requests discord.py makes to the REST API per route and per origin. The calls of
+    HTTPClient.request are wrapped to tag them with their origin, and the time of every HTTP attempt and its
+    status are taken from aiohttp's request tracing, so whatever else a call spent was waited. :meth:`trace` adds
+    the trace config to the session discord.py makes while logging in.
+
+    Attributes
+    ------------
+    verify: bool
+        If calls that are never traced are logged as an error, off for clients whose requests do not go through
+        aiohttp such as the benchmarks' simulator
+    """
+
+    def __init__(self) -> None:
+        self.routes: Dict[str, RouteStats] = {}
+        self.consumers: Counter[Tuple[str, str]] = Counter() # (origin, route)
+        self.logger = logging.getLogger('bunkerbot')
+        self.verify = True
+        self.calls = 0
+        self.traced = 0
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_request_exception.append(self._on_request_end)
+        self.trace_config.freeze()
+
+    def register_metrics(self, metrics: MetricsRegistry) -> None:
+        self.requests = metrics.counter('rest_requests_total', 'Discord REST calls by route and origin', labels=('route', 'origin'))
+        self.rate_limits = metrics.counter('rest_rate_limited_total', '429 responses from Discord by route', labels=('route',))
+        self.latency = metrics.histogram('rest_request_seconds', 'Time from a Discord REST call until its result', labels=('route',))
+        self.wait = metrics.histogram('rest_wait_seconds', 'Time Discord REST calls waited on rate limits', labels=('route',), buckets=WAIT_BUCKETS)
+
+    def trace(self, http: HTTPClient) -> bool:
+        """
+        Adds the trace config to the session http made while logging in and returns whether it could. The
+        discord.py the bot runs on takes no trace configs and keeps its session private, and aiohttp only takes them
+        when a session is made, so both are reached into here.
+        """
+        session = getattr(http, '_HTTPClient__session', None)
+        configs = getattr(session, '_trace_configs', None)
+        if not isinstance(session, aiohttp.ClientSession) or not isinstance(configs, list):
+            self.logger.error('Could not trace the REST session of discord.py, every REST call counts as waited')
+            return False
+
+        if self.trace_config not in configs:
+            configs.append(self.trace_config)
+        return True
+
+    def attach(self, http: HTTPClient) -> None:
+        """
+        Starts accounting the calls of http.request. The time on the wire and the 429s are only known once
+        :meth:`trace` was called, otherwise every call counts as waited.
+        """
+        request = http.request
+        if getattr(request, '__rest_accounting__', None) is not self:
+            http.request = self._wrap(request) # type: ignore
+
+    def _wrap(self, request: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(request)
+        async def wrapper(route: Route, **kwargs: Any) -> Any:
+            origin = current_origin()
+            call = RestCall()
+            token = _CALL.set(call)
+            failed = False
+            start = time.perf_counter()
+            try:
+                return await request(route, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                _CALL.reset(token)
+                self.record(f'{route.method} {route.path}', origin, time.perf_counter() - start, call, failed)
+
+        wrapper.__rest_accounting__ = self # type: ignore
+        return wrapper
+
+    async def _on_request_start(self, session: aiohttp.ClientSession, trace: SimpleNamespace, params: Any) -> None:
+        trace.call = _CALL.get() # None for requests not made through HTTPClient.request, e.g. the gateway
+        trace.start = time.perf_counter()
+
+    async def _on_request_end(self, session: aiohttp.ClientSession, trace: SimpleNamespace, params: Any) -> None:
+        call: Optional[RestCall] = trace.call
+        if call is None:
+            return
+
+        self.traced += 1
+        call.attempts += 1
+        call.on_wire += time.perf_counter() - trace.start
+        response = getattr(params, 'response', None) # the exception params have none
+        if response is not None and response.status == 429:
+            call.rate_limited += 1
+
+    def record(self, route: str, origin: str, elapsed: float, call: RestCall, failed: bool) -> None:
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteStats()
+
+        self.calls += 1
+        if self.verify and self.calls == UNTRACED_LIMIT and not self.traced:
+            self.logger.error('None of the first %d REST calls was traced, their time on the wire and 429s are missing', UNTRACED_LIMIT)
+
+        waited = max(elapsed - call.on_wire, 0.0)
+        stats.requests += 1
+        stats.rate_limited += call.rate_limited
+        stats.errors += failed
+        stats.elapsed += elapsed
+        stats.waited += waited
+        self.consumers[(origin, route)] += 1
+
+        self.requests.labels(route, origin).inc()
+        self.latency.labels(route).observe(elapsed)
+        self.wait.labels(route).observe(waited)
+        if call.rate_limited:
+            self.rate_limits.labels(route).inc(call.rate_limited)
+
+    def origins(self) -> Counter[str]:
+        """
+        Returns the amount of requests per origin
+        """
+        origins: Counter[str] = Counter()
+        for (origin, _), count in self.consumers.items():
+            origins[origin] += count
+        return origins
+
+    def top(self, amount: int = 10) -> List[Tuple[str, str, int]]:
+        """
+        Returns (origin, route, requests) for the origins and routes making the most requests
+        """
+        return [(origin, route, count) for (origin, route), count in self.consumers.most_common(amount)]
+
+    def summary(self) -> str:
+        requests = sum(stats.requests for stats in self.routes.values())
+        rate_limited = sum(stats.rate_limited for stats in self.routes.values())
+        waited = sum(stats.waited for stats in self.routes.values())
+        return f'requests: {requests}, 429s: {rate_limited}, waited: {waited:.2f}s, routes: {len(self.routes)}'
+
+
+def tagged(origin: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Returns a coroutine function making the requests of func under the given origin
+    """
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = REST_ORIGIN.set(origin)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            REST_ORIGIN.reset(token)
+
+    return wrapper
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from itertools import groupby
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+
+__all__ = (
+    'DrainHook',
+    'InFlight',
+    'ShutdownCoordinator',
+)
+
+
+REPLAY_PATH = 'shutdown_replay.json'
+
+
+class DrainHook(NamedTuple):
+    """
+    Work to finish when the bot shuts down
+
+    Attributes
+    ------------
+    name: str
+        Unique name of the hook, also used as the key of its entries in the replay file
+    drain: Callable[[], Awaitable[Optional[str]]]
+        Finishes the work, may return a short description of what was drained for the log
+    priority: int
+        Hooks with a lower priority drain first, hooks with the same priority drain in parallel
+    budget: float
+        Seconds the hook is given before it is cancelled
+    persist: Optional[Callable[[], List[Any]]]
+        Called after drain, even if it failed or ran out of time, returns JSON serializable entries for the work
+        still pending. Without it the unfinished work is dropped.
+    replay: Optional[Callable[[List[Any]], Awaitable[None]]]
+        Called on the next boot with the entries persisted for this hook
+    """
+    name: str
+    drain: Callable[[], Awaitable[Optional[str]]]
+    priority: int = 0
+    budget: float = 5.0
+    persist: Optional[Callable[[], List[Any]]] = None
+    replay: Optional[Callable[[List[Any]], Awaitable[None]]] = None
+
+
+class InFlight:
+    """
+    Counts operations in progress so a drain hook can wait for them, used as ``async with in_flight:``
+    """
+
+    __slots__ = ('count', '_idle')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __aenter__(self) -> InFlight:
+        self.count += 1
+        self._idle.clear()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.count -= 1
+        if self.count == 0:
+            self._idle.set()
+
+    async def wait(self) -> str:
+        count = self.count
+        await self._idle.wait()
+        return f'{count} waited for'
+
+
+class ShutdownCoordinator:
+    """
+    Drains registered hooks in order of priority when the bot shuts down. Work a hook could not finish is
+    persisted to a replay file and handed back to the hook on the next boot.
+
+    Parameters
+    -----------
+    logger: logging.Logger
+        The logger every drained and dropped hook is reported to
+    path: str
+        The replay file
+    """
+
+    def __init__(self, logger: logging.Logger, *, path: str = REPLAY_PATH) -> None:
+        self.logger = logger
+        self.path = path
+        self.hooks: Dict[str, DrainHook] = {}
+
+    def register(self, hook: DrainHook) -> None:
+        self.hooks[hook.name] = hook
+
+    def unregister(self, name: str) -> Optional[DrainHook]:
+        return self.hooks.pop(name, None)
+
+    async def _run(self, hook: DrainHook) -> Optional[List[Any]]:
+        """
+        Drains a single hook and returns the entries it left for replay
+        """
+        start = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(hook.drain(), hook.budget)
+        except Exception as e:
+            outcome = 'timed out' if isinstance(e, asyncio.TimeoutError) else f'failed ({e!r})'
+            failed = True
+        else:
+            outcome = f'drained{f" ({detail})" if detail else ""}'
+            failed = False
+
+        elapsed = time.perf_counter() - start
+        entries = None
+        if hook.persist is not None:
+            try:
+                entries = hook.persist()
+            except Exception:
+                self.logger.exception('Shutdown: %s %s in %.2fs, persisting what was left failed, dropped', hook.name, outcome, elapsed)
+                return None
+
+        if entries:
+            self.logger.warning('Shutdown: %s %s in %.2fs, %d entries persisted for replay', hook.name, outcome, elapsed, len(entries))
+        elif failed and hook.persist is None:
+            self.logger.warning('Shutdown: %s %s in %.2fs, dropped', hook.name, outcome, elapsed)
+        elif failed:
+            self.logger.warning('Shutdown: %s %s in %.2fs, nothing left to persist', hook.name, outcome, elapsed)
+        else:
+            self.logger.info('Shutdown: %s %s in %.2fs', hook.name, outcome, elapsed)
+
+        return entries
+
+    async def drain(self) -> None:
+        """
+        Drains every hook. Never raises, failures are logged and persisted.
+        """
+        start = time.perf_counter()
+        replay: Dict[str, List[Any]] = {}
+
+        for _, group in groupby(sorted(self.hooks.values(), key=lambda h: h.priority), key=lambda h: h.priority):
+            hooks = list(group)
+            results = await asyncio.gather(*(self._run(hook) for hook in hooks))
+            for hook, entries in zip(hooks, results):
+                if entries:
+                    replay[hook.name] = entries
+
+        if replay:
+            try:
+                with open(self.path, 'w', encoding='utf-8') as file:
+                    json.dump(replay, file)
+            except (OSError, TypeError, ValueError):
+                self.logger.exception('Shutdown: writing the replay file failed, dropped %s', ', '.join(replay))
+
+        self.logger.info('Shutdown: drained %d hooks in %.2fs, %d left work for replay', len(self.hooks), time.perf_counter() - start, len(replay))
+
+    async def replay(self) -> None:
+        """
+        Hands the entries persisted by the previous shutdown back to their hooks and removes the replay file
+        """
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                replay: Dict[str, List[Any]] = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            self.logger.exception('Ignoring unreadable replay file')
+            replay = {}
+
+        os.remove(self.path)
+        for name, entries in replay.items():
+            hook = self.hooks.get(name)
+            if hook is None or hook.replay is None:
+                self.logger.warning('Replay: no handler for %s, dropped %d entries', name, len(entries))
+                continue
+
+            try:
+                await hook.replay(entries)
+            except Exception:
+                self.logger.exception('Replay: %s failed, dropped %d entries', name, len(entries))
+            else:
+                self.logger.info('Replay: %s replayed %d entries', name, len(entries))
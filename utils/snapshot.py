@@ -0,0 +1,113 @@
+import marshal
+import mmap
+import os
+import struct
+import zlib
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+__all__ = (
+    'SnapshotError',
+    'fingerprint',
+    'write_snapshot',
+    'read_snapshot',
+)
+
+
+# File layout, all integers little endian:
+#   header  : magic (8s) version (H) section count (H)
+#   section : name length (H) name (utf-8) fingerprint (I) offset (Q) length (Q)   repeated section count times
+#   data    : every section's rows serialized with marshal, at the offsets given above
+# Every section is deserialized on load, straight from the memory mapped file without copying it first.
+MAGIC = b'BBSNAP\r\n'
+VERSION = 1
+HEADER = struct.Struct('<8sHH')
+NAME_LENGTH = struct.Struct('<H')
+SECTION = struct.Struct('<IQQ')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def fingerprint(query: str) -> int:
+    """
+    Returns the fingerprint stored with a section, rows are discarded on load if the query producing them changed
+    """
+    return zlib.crc32(query.encode('utf-8'))
+
+
+def write_snapshot(path: str, sections: Dict[str, Tuple[int, Sequence[Sequence[Any]]]]) -> int:
+    """
+    Atomically writes a snapshot and returns its size in bytes. Sections whose rows marshal can not serialize
+    are left out.
+
+    Parameters
+    -----------
+    path: str
+        The file to write
+    sections: Dict[str, Tuple[int, Sequence[Sequence[Any]]]]
+        Mapping of section name to (fingerprint, rows)
+    """
+    blobs: List[Tuple[bytes, int, bytes]] = []
+    for name, (fp, rows) in sections.items():
+        try:
+            blobs.append((name.encode('utf-8'), fp, marshal.dumps([tuple(row) for row in rows])))
+        except ValueError:
+            continue
+
+    offset = HEADER.size + sum(NAME_LENGTH.size + len(name) + SECTION.size for name, _, _ in blobs)
+    parts = [HEADER.pack(MAGIC, VERSION, len(blobs))]
+    for name, fp, blob in blobs:
+        parts.append(NAME_LENGTH.pack(len(name)) + name + SECTION.pack(fp, offset, len(blob)))
+        offset += len(blob)
+    parts.extend(blob for _, _, blob in blobs)
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as file:
+        file.writelines(parts)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+    return offset
+
+
+def read_snapshot(path: str) -> Dict[str, Tuple[int, List[tuple]]]:
+    """
+    Reads a snapshot written by :func:`write_snapshot`
+
+    Parameters
+    -----------
+    path: str
+        The file to read
+
+    Raises
+    -------
+    FileNotFoundError
+        There is no snapshot
+    SnapshotError
+        The snapshot is corrupt or from another version
+    """
+    with open(path, 'rb') as file:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data: # an empty file can not be mapped
+                magic, version, count = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise SnapshotError(f'Unsupported snapshot {magic!r} version {version}')
+
+                sections = {}
+                position = HEADER.size
+                for _ in range(count):
+                    length, = NAME_LENGTH.unpack_from(data, position)
+                    position += NAME_LENGTH.size
+                    name = data[position:position+length].decode('utf-8')
+                    position += length
+                    fp, offset, size = SECTION.unpack_from(data, position)
+                    position += SECTION.size
+                    sections[name] = (fp, marshal.loads(data[offset:offset+size]))
+        except (struct.error, ValueError, EOFError, TypeError) as e:
+            raise SnapshotError(f'Corrupt snapshot: {e}') from e
+
+    return sections
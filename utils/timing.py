@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncpg
+import contextvars
+import functools
+import time
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.metrics import MetricsRegistry
+
+
+__all__ = (
+    'DBTimer',
+    'DB_TIMER',
+    'TimedConnection',
+    'HandlerStats',
+    'HandlerTimings',
+)
+
+
+T = TypeVar('T')
+
+WINDOW = 300.0 # seconds of calls the percentiles and error rate are computed over
+MAX_SAMPLES = 4096 # per handler, the oldest calls are dropped first if a handler is busier than this
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class DBTimer:
+    """
+    Seconds spent waiting on queries by the handler that set it
+    """
+
+    __slots__ = ('elapsed', 'queries')
+
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+        self.queries = 0
+
+
+DB_TIMER: contextvars.ContextVar[Optional[DBTimer]] = contextvars.ContextVar('DB_TIMER', default=None)
+
+
+def _timed(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    @functools.wraps(method)
+    async def wrapper(self, *args: Any, **kwargs: Any) -> T:
+        timer = DB_TIMER.get()
+        if timer is None:
+            return await method(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            timer.elapsed += time.perf_counter() - start
+            timer.queries += 1
+
+    return wrapper
+
+
+class TimedConnection(asyncpg.Connection):
+    """
+    Adds the time spent in queries to the :class:`DBTimer` of the current handler, pass it to create_pool as
+    connection_class
+    """
+
+    execute = _timed(asyncpg.Connection.execute)
+    executemany = _timed(asyncpg.Connection.executemany)
+    fetch = _timed(asyncpg.Connection.fetch)
+    fetchval = _timed(asyncpg.Connection.fetchval)
+    fetchrow = _timed(asyncpg.Connection.fetchrow)
+    copy_records_to_table = _timed(asyncpg.Connection.copy_records_to_table)
+
+
+class HandlerStats:
+    """
+    The calls of a single command or listener in the last WINDOW seconds
+    """
+
+    __slots__ = ('kind', 'name', 'calls')
+
+    def __init__(self, kind: str, name: str) -> None:
+        self.kind = kind
+        self.name = name
+        self.calls: Deque[Tuple[float, float, float, bool]] = deque(maxlen=MAX_SAMPLES) # (finished at, latency, db time, failed)
+
+    def record(self, latency: float, db_time: float, failed: bool) -> None:
+        self.calls.append((time.monotonic(), latency, db_time, failed))
+
+    def _trim(self) -> None:
+        cutoff = time.monotonic() - WINDOW
+        while self.calls and self.calls[0][0] < cutoff:
+            self.calls.popleft()
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        """
+        Returns the count, p50, p95, p99, error rate and share of time spent in the database over the window, or
+        None if there were no calls
+        """
+        self._trim()
+        if not self.calls:
+            return None
+
+        latencies = sorted(call[1] for call in self.calls)
+        total = sum(latencies)
+        count = len(latencies)
+        summary = {f'p{int(q * 100)}': latencies[min(int(q * count), count - 1)] for q in QUANTILES}
+        summary['count'] = count
+        summary['error_rate'] = sum(call[3] for call in self.calls) / count
+        summary['db_share'] = sum(call[2] for call in self.calls) / total if total else 0.0
+        return summary
+
+
+class HandlerTimings:
+    """
+    Latency, errors and database time of every command and listener. Cumulative totals go to the metrics
+    registry, the rolling windows are kept here.
+
+    Parameters
+    -----------
+    metrics: MetricsRegistry
+        The registry the handler metrics are registered in
+    """
+
+    def __init__(self, metrics: MetricsRegistry) -> None:
+        self.handlers: Dict[Tuple[str, str], HandlerStats] = {}
+        self.latency = metrics.histogram('handler_seconds', 'Time taken by commands and listeners', labels=('kind', 'handler'))
+        self.db_time = metrics.histogram('handler_db_seconds', 'Time commands and listeners spent waiting on queries', labels=('kind', 'handler'))
+        self.errors = metrics.counter('handler_errors_total', 'Commands and listeners that raised', labels=('kind', 'handler'))
+        metrics.gauge('handler_window_seconds', f'Latency quantiles of commands and listeners over the last {WINDOW:.0f}s', labels=('kind', 'handler', 'quantile'), collect=self._window_latency)
+        metrics.gauge('handler_window_error_ratio', f'Share of calls that raised over the last {WINDOW:.0f}s', labels=('kind', 'handler'), collect=self._window_errors)
+
+    def get(self, kind: str, name: str) -> HandlerStats:
+        stats = self.handlers.get((kind, name))
+        if stats is None:
+            stats = self.handlers[(kind, name)] = HandlerStats(kind, name)
+        return stats
+
+    def record(self, kind: str, name: str, latency: float, db_time: float, failed: bool) -> None:
+        self.get(kind, name).record(latency, db_time, failed)
+        self.latency.labels(kind, name).observe(latency)
+        self.db_time.labels(kind, name).observe(db_time)
+        if failed:
+            self.errors.labels(kind, name).inc()
+
+    def wrap(self, kind: str, name: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """
+        Returns a coroutine function recording every call of func under the given name
+        """
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            timer = DBTimer()
+            token = DB_TIMER.set(timer)
+            failed = False
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.record(kind, name, time.perf_counter() - start, timer.elapsed, failed)
+                DB_TIMER.reset(token)
+
+        return wrapper
+
+    def summaries(self) -> Iterator[Tuple[HandlerStats, Dict[str, float]]]:
+        for stats in list(self.handlers.values()):
+            summary = stats.summary()
+            if summary is not None:
+                yield stats, summary
+
+    def _window_latency(self) -> Dict[Tuple[str, ...], float]:
+        return {
+            (stats.kind, stats.name, str(q)): summary[f'p{int(q * 100)}']
+            for stats, summary in self.summaries() for q in QUANTILES
+        }
+
+    def _window_errors(self) -> Dict[Tuple[str, ...], float]:
+        return {(stats.kind, stats.name): summary['error_rate'] for stats, summary in self.summaries()}
@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+import asyncio
+import asyncpg
+import contextlib
+import mmap
+import os
+import struct
+import uuid
+
+from array import array
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
+
+
+__all__ = (
+    'XPStore',
+    'XPJournal',
+    'XPCache',
+    'create_staging_table',
+    'create_flush_table',
+    'record_flush',
+    'forget_flush',
+    'flush_executemany',
+    'flush_copy',
+)
+
+
+RECORD = struct.Struct('<Qd') # (user_id, xp delta)
+SEGMENT_RECORDS = 65536 # 1 MiB per segment
+SEGMENT_SUFFIX = '.journal'
+MARKER_SUFFIX = '.flushing'
+MIN_CAPACITY = 1024
+FIBONACCI = 11400714819323198485 # 2**64 / golden ratio, spreads the sequential bits of snowflakes over the table
+TABLE_LEADERBOARD = 'events.leaderboard'
+TABLE_XP_STAGING = 'xp_staging' # in the events schema
+TABLE_XP_FLUSHES = 'events.xp_flushes'
+
+
+class XPStore:
+    """
+    A compact mapping of user ids to xp. Ids and xp are kept densely in insertion order in two typed arrays and
+    located through an open addressing index, which costs around 30 bytes per user instead of the 100+ bytes of a
+    dict holding boxed ints and floats. Users can not be removed, the whole store is replaced when it is drained.
+
+    Parameters
+    -----------
+    capacity: int
+        Initial amount of slots in the index, rounded up to a power of two
+    """
+
+    __slots__ = ('_ids', '_xp', '_index', '_mask', '_shift')
+
+    def __init__(self, capacity: int = MIN_CAPACITY) -> None:
+        self._ids = array('Q')
+        self._xp = array('d')
+        self._allocate(max(capacity, MIN_CAPACITY))
+
+    def _allocate(self, capacity: int) -> None:
+        bits = (capacity - 1).bit_length()
+        self._index = array('q', [-1]) * (1 << bits)
+        self._mask = (1 << bits) - 1
+        self._shift = 64 - bits
+
+        for position, user_id in enumerate(self._ids):
+            self._index[self._find(user_id)] = position
+
+    def _find(self, user_id: int) -> int:
+        """
+        Returns the index slot that holds user_id or the empty slot where it would be inserted
+        """
+        slot = ((user_id * FIBONACCI) & 0xFFFFFFFFFFFFFFFF) >> self._shift
+        index, ids, mask = self._index, self._ids, self._mask
+
+        while True:
+            position = index[slot]
+            if position == -1 or ids[position] == user_id:
+                return slot
+            slot = (slot + 1) & mask
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._index[self._find(user_id)] != -1
+
+    def __getitem__(self, user_id: int) -> float:
+        position = self._index[self._find(user_id)]
+        if position == -1:
+            raise KeyError(user_id)
+        return self._xp[position]
+
+    def __setitem__(self, user_id: int, xp: float) -> None:
+        slot = self._find(user_id)
+        position = self._index[slot]
+
+        if position != -1:
+            self._xp[position] = xp
+            return
+
+        self._index[slot] = len(self._ids)
+        self._ids.append(user_id)
+        self._xp.append(xp)
+
+        if len(self._ids) * 3 > len(self._index) * 2: # keep the load factor under 2/3
+            self._allocate(len(self._index) * 2)
+
+    def add(self, user_id: int, xp: float) -> None:
+        position = self._index[self._find(user_id)]
+        if position == -1:
+            self[user_id] = xp
+        else:
+            self._xp[position] += xp
+
+    def get(self, user_id: int, default: float = 0.0) -> float:
+        position = self._index[self._find(user_id)]
+        return default if position == -1 else self._xp[position]
+
+    def items(self) -> Iterator[Tuple[int, float]]:
+        """
+        Returns an iterator of (user_id, xp) read straight from the underlying arrays
+        """
+        return zip(self._ids, self._xp)
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the arrays of the store
+        """
+        return sum(a.buffer_info()[1] * a.itemsize for a in (self._ids, self._xp, self._index))
+
+
+class XPJournal:
+    """
+    An append-only, memory mapped journal of xp increments. The journal is split into fixed size segments,
+    a segment is sealed whenever the cache is drained or the segment is full and only deleted once its
+    contents are stored in the database.
+
+    Records are written into the mapped segment on every increment, so they survive the process being killed.
+    They are synced to disk in batches of ``sync_every`` records or whenever :meth:`sync` is called. While a loop is
+    running, syncs run in its default executor so a slow disk does not block it.
+
+    Segments left behind by a previous run are not claimed by drains until :meth:`recover` has loaded them. A drain
+    writes a marker naming its segments and a token, the flush stores the token in the same transaction as the xp.
+    A marker still present on recovery tells whether its segments were stored before the process died.
+
+    Parameters
+    -----------
+    path: str
+        Directory in which the segments are stored
+    sync_every: int
+        Amount of records after which the current segment is synced to disk
+    """
+
+    def __init__(self, path: str, *, sync_every: int = 128) -> None:
+        self.path = path
+        self.sync_every = sync_every
+        self._unsynced = 0
+        self._position = 0
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._segment: Optional[str] = None
+        self._syncing: Optional[asyncio.Task] = None
+
+        os.makedirs(path, exist_ok=True)
+        self._pending: List[str] = []
+        self._leftover: List[str] = sorted(
+            (os.path.join(path, f) for f in os.listdir(path) if f.endswith(SEGMENT_SUFFIX)),
+            key=self._segment_index
+        )
+        self._next_index = self._segment_index(self._leftover[-1]) + 1 if self._leftover else 0
+
+    @staticmethod
+    def _segment_index(segment: str) -> int:
+        return int(os.path.basename(segment)[:-len(SEGMENT_SUFFIX)])
+
+    def _open_segment(self) -> None:
+        self._segment = os.path.join(self.path, f'{self._next_index}{SEGMENT_SUFFIX}')
+        self._next_index += 1
+        self._file = open(self._segment, 'w+b')
+        self._file.truncate(SEGMENT_RECORDS * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._position = 0
+        self._unsynced = 0
+
+    def _close_segment(self, *, blocking: bool = False) -> Optional[str]:
+        if self._map is None:
+            return None
+
+        fd = self._detach_sync()
+        if fd is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                blocking = True
+            if blocking:
+                self._fsync(fd)
+            else:
+                loop.run_in_executor(None, self._fsync, fd)
+        self._map.close()
+        self._file.close() # type: ignore
+        segment, self._segment, self._map, self._file = self._segment, None, None, None
+        return segment
+
+    def append(self, user_id: int, xp: float) -> None:
+        """
+        Writes an increment to the journal
+
+        Parameters
+        -----------
+        user_id: int
+            ID of the user who gained xp
+        xp: float
+            The amount of xp gained
+        """
+        if self._map is None:
+            self._open_segment()
+        elif self._position == len(self._map): # type: ignore
+            self._pending.append(self._close_segment()) # type: ignore
+            self._open_segment()
+
+        RECORD.pack_into(self._map, self._position, user_id, xp) # type: ignore
+        self._position += RECORD.size
+        self._unsynced += 1
+
+        if self._unsynced >= self.sync_every and (self._syncing is None or self._syncing.done()):
+            try:
+                self._syncing = asyncio.get_running_loop().create_task(self.sync_async())
+            except RuntimeError: # no loop, as in scripts using the cache directly
+                self.sync()
+
+    def sync(self) -> None:
+        """
+        Flushes the records written since the last sync to disk, blocking until they are written
+        """
+        if self._map is not None and self._unsynced:
+            self._map.flush()
+            self._unsynced = 0
+
+    def _detach_sync(self) -> Optional[int]:
+        # a duplicate descriptor stays valid if the segment is closed while the sync runs
+        if self._file is None or not self._unsynced:
+            return None
+        self._unsynced = 0
+        return os.dup(self._file.fileno())
+
+    @staticmethod
+    def _fsync(fd: int) -> None:
+        try:
+            os.fsync(fd) # the mapping is shared, its dirty pages are the file's pages in the page cache
+        finally:
+            os.close(fd)
+
+    async def sync_async(self) -> None:
+        """
+        Flushes the records written since the last sync to disk on the loop's default executor
+        """
+        fd = self._detach_sync()
+        if fd is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._fsync, fd)
+
+    def rotate(self) -> List[str]:
+        """
+        Seals the current segment and claims every sealed segment that is not already claimed by another drain.
+        """
+        segment = self._close_segment()
+        if segment:
+            self._pending.append(segment)
+
+        claimed, self._pending = self._pending, []
+        return claimed
+
+    def release(self, segments: List[str]) -> None:
+        """
+        Returns claimed segments whose contents could not be stored so they are claimed by the next drain
+        """
+        self._pending = segments + self._pending
+
+    def discard(self, segments: List[str]) -> None:
+        """
+        Deletes segments whose contents have been stored in the database
+        """
+        for segment in segments:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(segment)
+
+    def mark(self, segments: List[str]) -> str:
+        """
+        Writes a marker naming claimed segments and returns its token, which the flush of their contents stores
+        """
+        token = uuid.uuid4().hex
+        if segments: # written before the flush commits, the page cache keeps it if the process dies
+            with open(os.path.join(self.path, f'{token}{MARKER_SUFFIX}'), 'w') as file:
+                file.write('\n'.join(os.path.basename(segment) for segment in segments))
+        return token
+
+    def unmark(self, token: str) -> None:
+        """
+        Deletes the marker of a finished drain
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.path, f'{token}{MARKER_SUFFIX}'))
+
+    def markers(self) -> Dict[str, List[str]]:
+        """
+        Returns the segments named by every marker left behind by a previous run, keyed by token
+        """
+        markers = {}
+        for name in os.listdir(self.path):
+            if name.endswith(MARKER_SUFFIX):
+                with open(os.path.join(self.path, name)) as file:
+                    markers[name[:-len(MARKER_SUFFIX)]] = [os.path.join(self.path, f) for f in file.read().split()]
+        return markers
+
+    def recover(self, flushed: Collection[str] = ()) -> Iterator[Tuple[int, float]]:
+        """
+        Deletes the segments of the markers whose token is in ``flushed`` and yields (user_id, xp) for every
+        record in the other segments left behind by a previous run. Those segments are claimed by the next drain.
+
+        Parameters
+        -----------
+        flushed: Collection[str]
+            Tokens of the drains whose flush was committed
+        """
+        for token, segments in self.markers().items():
+            if token in flushed:
+                self.discard(segments)
+            self.unmark(token)
+
+        leftover = [segment for segment in self._leftover if os.path.exists(segment)]
+        self._leftover = []
+        self._pending = leftover + self._pending
+        return self._read(leftover)
+
+    @staticmethod
+    def _read(segments: List[str]) -> Iterator[Tuple[int, float]]:
+        for segment in segments:
+            with open(segment, 'rb') as file:
+                data = file.read()
+
+            for user_id, xp in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+                if user_id == 0: # unwritten part of a preallocated segment
+                    break
+                yield user_id, xp
+
+    def close(self) -> None:
+        segment = self._close_segment(blocking=True)
+        if segment:
+            self._pending.append(segment)
+
+
+class XPCache:
+    """
+    Accumulates xp in memory until it is flushed to the database. Every increment is also written to an
+    :class:`XPJournal` so that a crash does not lose xp that was not flushed yet. Xp left in the journal by
+    a previous run is loaded into the cache by :meth:`recover` and stored by the next flush.
+
+    Parameters
+    -----------
+    path: str
+        Directory in which the journal is stored
+    """
+
+    def __init__(self, path: str = 'xp_journal') -> None:
+        self.journal = XPJournal(path)
+        self._data = XPStore()
+
+    async def recover(self, con: asyncpg.Connection) -> None:
+        """
+        Loads the xp left in the journal by a previous run, skipping the segments of drains whose flush was
+        committed before the process died. Runs before the first flush, while no drain is in flight.
+        """
+        tokens = list(self.journal.markers())
+        query = f'SELECT token FROM {TABLE_XP_FLUSHES} WHERE token = ANY($1::text[])'
+        flushed = {row['token'] for row in await con.fetch(query, tokens)} if tokens else set()
+
+        for user_id, xp in self.journal.recover(flushed):
+            self._data.add(user_id, xp)
+        await con.execute(f'DELETE FROM {TABLE_XP_FLUSHES}') # tokens of drains finished before their row was deleted
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._data
+
+    def __getitem__(self, user_id: int) -> float:
+        return self._data[user_id]
+
+    def __setitem__(self, user_id: int, xp: float) -> None:
+        self.journal.append(user_id, xp - self._data.get(user_id, 0.0))
+        self._data[user_id] = xp
+
+    def add(self, user_id: int, xp: float) -> None:
+        """
+        Increments the xp for a user
+
+        Parameters
+        -----------
+        user_id: int
+            ID of the user who gained xp
+        xp: float
+            The amount of xp gained
+        """
+        self.journal.append(user_id, xp)
+        self._data.add(user_id, xp)
+
+    @contextlib.contextmanager
+    def drain(self) -> Iterator[Tuple[XPStore, str]]:
+        """
+        Empties the cache and yields its store without copying it, along with the token the flush has to store with
+        :func:`record_flush` in the same transaction. The journal segments holding the yielded xp are deleted if the
+        block exits normally, otherwise the xp is put back in the cache and the segments are kept.
+        """
+        data, self._data = self._data, XPStore(len(self._data) * 2)
+        segments = self.journal.rotate()
+        token = self.journal.mark(segments)
+
+        try:
+            yield data, token
+        except BaseException:
+            for user_id, xp in data.items():
+                self._data.add(user_id, xp)
+            self.journal.unmark(token)
+            self.journal.release(segments)
+            raise
+        else:
+            self.journal.discard(segments)
+            self.journal.unmark(token)
+
+    def sync(self) -> None:
+        self.journal.sync()
+
+    async def sync_async(self) -> None:
+        await self.journal.sync_async()
+
+    def close(self) -> None:
+        self.journal.close()
+
+
+async def create_staging_table(con: asyncpg.Connection) -> None:
+    """
+    Creates the unlogged table used by :func:`flush_copy` if it does not exist
+    """
+    query = f'CREATE UNLOGGED TABLE IF NOT EXISTS events.{TABLE_XP_STAGING}(user_id bigint NOT NULL, xp double precision NOT NULL)'
+    await con.execute(query)
+
+
+async def create_flush_table(con: asyncpg.Connection) -> None:
+    """
+    Creates the table in which flushes record the token of their drain if it does not exist
+    """
+    await con.execute(f'CREATE TABLE IF NOT EXISTS {TABLE_XP_FLUSHES}(token text PRIMARY KEY)')
+
+
+async def record_flush(con: asyncpg.Connection, token: str) -> None:
+    """
+    Stores the token of a drain, to be called in the transaction that stores its xp
+    """
+    await con.execute(f'INSERT INTO {TABLE_XP_FLUSHES}(token) VALUES($1)', token)
+
+
+async def forget_flush(con: asyncpg.Connection, token: str) -> None:
+    """
+    Deletes the token of a drain whose segments have been deleted
+    """
+    await con.execute(f'DELETE FROM {TABLE_XP_FLUSHES} WHERE token = $1', token)
+
+
+async def flush_executemany(con: asyncpg.Connection, data: XPStore) -> None:
+    """
+    Stores xp in the leaderboard using one upsert per user
+    """
+    query = f'INSERT INTO {TABLE_LEADERBOARD}(user_id, xp) \
+             VALUES($1, $2) \
+             ON CONFLICT(user_id) \
+             DO UPDATE SET xp = {TABLE_LEADERBOARD}.xp + $2'
+    await con.executemany(query, data.items())
+
+
+async def flush_copy(con: asyncpg.Connection, data: XPStore) -> None:
+    """
+    Stores xp in the leaderboard by copying it into the staging table and merging it with a single upsert.
+    The staging table is truncated inside the transaction which also serializes concurrent flushes.
+    """
+    query = f'INSERT INTO {TABLE_LEADERBOARD}(user_id, xp) \
+             SELECT user_id, xp FROM events.{TABLE_XP_STAGING} \
+             ON CONFLICT(user_id) \
+             DO UPDATE SET xp = {TABLE_LEADERBOARD}.xp + EXCLUDED.xp'
+
+    async with con.transaction():
+        await con.execute(f'TRUNCATE events.{TABLE_XP_STAGING}')
+        await con.copy_records_to_table(TABLE_XP_STAGING, records=data.items(), columns=('user_id', 'xp'), schema_name='events')
+        await con.execute(query)